@@ -12,8 +12,13 @@ Usage:
 
 import sys
 import json
+import time
 import readline
+import threading
+from contextvars import ContextVar
+from datetime import datetime
 from pathlib import Path
+from typing import Optional
 
 # 添加项目路径
 sys.path.insert(0, str(Path(__file__).parent))
@@ -28,7 +33,18 @@ from skills import (
     LearnExampleSkill
 )
 from lib.registry import registry
-from lib.api import ProviderFactory
+from lib.api import ProviderFactory, client
+from lib import metrics
+from lib.jobs import JobQueue, QueueFull, QUEUED, RUNNING, DONE, FAILED, CANCELLED
+from config import AGENT_BG_WORKERS, AGENT_JOB_LOG_TAIL, MODEL_STAGES, STAGE_MODELS
+
+PROMPT = "\n🤖 > "
+
+# 支持 --bg 后台执行的命令（需要交互输入的命令只能在前台执行）
+BACKGROUND_COMMANDS = ("pipeline", "learn", "discover", "generate")
+
+# 当前线程正在执行的后台任务 {"id", "on_stage", "result"}，前台命令为 None
+_background: ContextVar[Optional[dict]] = ContextVar("concept_viz_background", default=None)
 
 
 class ConceptVisualizerAgent:
@@ -47,6 +63,13 @@ class ConceptVisualizerAgent:
 
         self.registry = registry
         self.context = {}
+        # 后台任务在各自线程中写入上下文
+        self._context_lock = threading.Lock()
+        # 最近一次生成所用的 GenerateSkill（/finalize 需沿用其输出目录和风格）
+        self.last_generate = self.skills["generate"]
+        # 后台任务队列（首次使用 --bg 时创建）
+        self.jobs = None
+        self.interactive = False
 
         self.banner = """
 ╔══════════════════════════════════════════════════════════════╗
@@ -73,25 +96,31 @@ class ConceptVisualizerAgent:
 📚 可用技能 (Skills)
 ═══════════════════════════════════════════════════════════════
 
-/pipeline <文章路径> [输出目录] [--no-learn] [--style=样式ID]
+/pipeline <文章路径> [输出目录] [--no-learn] [--style=样式ID] [--styles=a,b] [--draft] [--force] [--fused] [--compress]
     一键执行完整workflow，自动学习新框架并生成概念图
     示例: /pipeline article.md ./output
     示例: /pipeline article.md --style=modern
     添加 --no-learn 可跳过框架学习
     添加 --style=<ID> 可跳过交互式样式选择
+    添加 --styles=blueprint,modern 一次输出多种样式（分析/映射只执行一次，各样式写入子目录）
+    添加 --draft 先以低分辨率出草稿，再用 /finalize 定稿
+    对同一输出目录重跑时只重新执行输入变化的阶段，添加 --force 全部重跑
+    添加 --fused 把框架发现与文章分析合并为一次模型调用（文章只上传一次）
+    添加 --compress 先在本地压缩文章（去除 Markdown 噪声和重复段落，按重要性保留原句）
     可用样式: blueprint(默认), modern, academic, creative
 
 /discover <文章路径>
     🎓 从文章中发现新理论框架并自动扩充框架库
     这是Agent的"博学家"能力核心
 
-/learn <示例文件夹> [--no-verify] [--threshold=70]
+/learn <示例文件夹> [--no-verify] [--threshold=70] [--batch]
     📚 从示例学习：分析文件夹中的文章+图片
     自动提取并添加新的 frameworks、charts、styles
     包含闭环验证：正向生成 → 比较 → 确认后保存
     示例: /learn ./examples/soul_document
     跳过验证: /learn ./examples --no-verify
     自定义阈值: /learn ./examples --threshold=80
+    批量学习: /learn ./archive --batch --workers=8 --budget=30
 
 /analyze <文章路径或文本>
     分析文章，提取核心概念和关键引文
@@ -102,8 +131,26 @@ class ConceptVisualizerAgent:
 /design [--style=<风格>]
     设计可视化方案和图像提示词（需要先执行 /map）
 
-/generate [prompt_index]
+/generate [prompt_index] [--draft]
     生成图像（需要先执行 /design）
+    添加 --draft 以低分辨率快速出草稿
+
+/finalize <序号,序号|all>
+    以完整分辨率、相同提示词和种子重新生成选中的草稿
+    示例: /finalize 1,3
+
+═══════════════════════════════════════════════════════════════
+
+⏳ 后台任务
+═══════════════════════════════════════════════════════════════
+
+在 /pipeline、/learn、/discover、/generate 后添加 --bg 即在后台执行，
+提示符立即返回，完成后结果写入当前上下文（后台 /pipeline 不交互选择样式，未指定时用默认样式）
+    示例: /pipeline a.md --style=modern --bg
+
+/jobs                    后台任务表（状态、当前阶段、耗时）
+/jobs log <id>           查看任务输出（--all 显示全部）
+/jobs cancel <id>        取消任务（运行中的 /pipeline 在下一阶段开始时停止，其余命令开始后不能取消）
 
 ═══════════════════════════════════════════════════════════════
 
@@ -117,6 +164,7 @@ class ConceptVisualizerAgent:
 /charts                  列出所有图表类型 ({n_charts}个)
 /styles                  列出所有视觉风格 ({n_styles}个)
 /providers               列出所有模型提供商
+/models                  各阶段使用的模型（STAGE_MODELS）与本次会话的调用延迟
 
 /reload                  重新加载所有配置（从YAML文件）
 
@@ -168,6 +216,10 @@ class ConceptVisualizerAgent:
                 success = sum(1 for r in results if r.get("success"))
                 print(f"✓ 图像生成: {success}/{len(results)} 成功")
 
+        if self.jobs:
+            stats = self.jobs.stats()
+            print(f"⏳ 后台任务: 运行 {stats[RUNNING]}，排队 {stats[QUEUED]}，完成 {stats[DONE]}，失败 {stats[FAILED]}")
+
         print("─" * 40)
 
         # 显示配置状态
@@ -294,6 +346,29 @@ class ConceptVisualizerAgent:
         print("设置环境变量来启用更多提供商:")
         print("  OPENAI_API_KEY, ANTHROPIC_API_KEY, STABILITY_API_KEY")
 
+    def list_models(self):
+        """各阶段的模型分配与本次会话中观测到的延迟"""
+        print(f"\n🧭 分阶段模型")
+        print("─" * 50)
+        for stage in MODEL_STAGES:
+            provider, model = client.text_provider_for(stage)
+            resolved = f"{provider.provider_id}:{model or provider.config.get('text_model')}" if provider else "不可用"
+            configured = STAGE_MODELS.get(stage)
+            print(f"  {stage:<17} {resolved}" + (f"  (配置: {configured})" if configured else "  (默认)"))
+
+        rows = [r for r in metrics.recent_latency() if r["stage"]]
+        if rows:
+            print(f"\n⏱ 本次会话的调用延迟")
+            print("─" * 50)
+            for r in sorted(rows, key=lambda r: (r["stage"], -r["calls"])):
+                print(f"  {r['stage']:<17} {r['provider']}:{r['model']}  {r['calls']} 次  "
+                      f"平均 {r['avg_s']:.2f}s  p95 {r['p95_s']:.2f}s  {r['output_tokens_per_s']:.0f} tokens/s"
+                      + (f"  失败 {r['errors']}" if r["errors"] else ""))
+
+        print("─" * 50)
+        print("在 config.STAGE_MODELS 或环境变量 CONCEPT_VIZ_MODEL_<阶段> 中调整，")
+        print("如 CONCEPT_VIZ_MODEL_MAP=ollama:llama3、CONCEPT_VIZ_MODEL_DESIGN=anthropic")
+
     def export_results(self, filename: str):
         """导出结果"""
         if not self.context:
@@ -304,11 +379,158 @@ class ConceptVisualizerAgent:
         if not output_path.suffix:
             output_path = output_path.with_suffix(".json")
 
+        with self._context_lock:
+            context = dict(self.context)
         with open(output_path, "w", encoding="utf-8") as f:
-            json.dump(self.context, f, ensure_ascii=False, indent=2, default=str)
+            json.dump(context, f, ensure_ascii=False, indent=2, default=str)
 
         print(f"✓ 结果已导出: {output_path}")
 
+    def submit_background(self, cmd: str, args: str):
+        """以后台任务执行命令，完成后结果写入上下文"""
+        if cmd not in BACKGROUND_COMMANDS:
+            print(f"/{cmd} 不支持后台执行（支持: {', '.join('/' + c for c in BACKGROUND_COMMANDS)}）")
+            return
+        if not args and cmd != "generate":
+            print(f"请提供路径: /{cmd} <路径> --bg")
+            return
+        if cmd == "generate" and "design" not in self.context:
+            print("请先执行 /design")
+            return
+
+        if self.jobs is None:
+            # 交互模式下后台输出写入任务日志，避免打断输入；单命令模式直接输出
+            self.jobs = JobQueue(self._run_background, workers=AGENT_BG_WORKERS,
+                                 capture_output=self.interactive, on_finish=self._notify)
+
+        command = f"/{cmd} {args}".strip()
+        try:
+            # 只有 /pipeline 在阶段之间检查取消请求
+            job = self.jobs.submit({"command": command}, cancellable=(cmd == "pipeline"))
+        except QueueFull as e:
+            print(f"❌ {e}")
+            return
+        print(f"⏳ 后台任务 #{job['id'][:6]} 已提交: {command}（/jobs 查看进度）")
+
+    def _run_background(self, job_id: str, params: dict, on_stage) -> dict:
+        """在后台线程中执行命令（JobQueue 的任务处理函数）"""
+        state = {"id": job_id, "on_stage": on_stage, "result": None}
+        _background.set(state)
+        self.handle_command(params["command"])
+
+        result = state["result"]
+        if isinstance(result, dict):
+            error = result.get("error") or ("steps" in result and PipelineSkill.error_message(result))
+            if error:
+                raise RuntimeError(error)
+            return {"summary": str(result.get("output_dir") or "")}
+        if isinstance(result, list):
+            success = sum(1 for r in result if r.get("success"))
+            if result and not success:
+                raise RuntimeError("图像全部生成失败")
+            return {"summary": f"{success}/{len(result)} 张成功"}
+        return {"summary": ""}
+
+    @staticmethod
+    def _record(result):
+        """记录后台任务中命令的结果，用于判断成败（前台执行时无操作）"""
+        state = _background.get()
+        if state is not None:
+            state["result"] = result
+
+    def _notify(self, job: dict):
+        """后台任务结束时打印一行提示"""
+        params = job["params"]
+        elapsed = job["finished_at"] - (job["started_at"] or job["finished_at"])
+        label = {DONE: "✓ 完成", FAILED: "✗ 失败", CANCELLED: "⊘ 已取消"}.get(job["status"], job["status"])
+        line = f"\n{label} 后台任务 #{job['id'][:6]}: {params['command']} ({elapsed:.1f}s)"
+        if job["error"]:
+            line += f" - {job['error']}"
+        elif job["result"] and job["result"].get("summary"):
+            line += f" → {job['result']['summary']}"
+        if self.interactive:
+            line += f"\n  /jobs log {job['id'][:6]} 查看输出"
+        print(line)
+        if self.interactive:
+            print(PROMPT.lstrip("\n"), end="", flush=True)
+
+    def _find_job(self, prefix: str) -> Optional[dict]:
+        """按ID前缀查找后台任务（前缀需唯一）"""
+        prefix = prefix.lstrip("#")
+        matches = [job["id"] for job in self.jobs.list() if job["id"].startswith(prefix)]
+        return self.jobs.get(matches[0]) if len(matches) == 1 else None
+
+    def show_jobs(self, args: str):
+        """后台任务表 / 任务输出 / 取消任务"""
+        if not self.jobs:
+            print("没有后台任务（在 /pipeline、/learn、/discover、/generate 后添加 --bg）")
+            return
+
+        parts = args.split()
+        if parts and parts[0] in ("log", "cancel"):
+            if len(parts) < 2:
+                print("用法: /jobs log <id> [--all] | /jobs cancel <id>")
+                return
+            job = self._find_job(parts[1])
+            if not job:
+                print(f"未找到任务: {parts[1]}")
+                return
+
+            if parts[0] == "cancel":
+                if job["status"] == RUNNING and not job["cancellable"]:
+                    print(f"任务 #{job['id'][:6]} 正在运行，{job['params']['command'].split()[0]} 开始后不能取消")
+                elif not self.jobs.cancel(job["id"]):
+                    print(f"任务 #{job['id'][:6]} 已结束")
+                elif job["status"] == RUNNING:
+                    print(f"⊘ 已请求取消 #{job['id'][:6]}，将在下一阶段开始时停止")
+                else:
+                    print(f"⊘ 已取消 #{job['id'][:6]}")
+                return
+
+            lines = (self.jobs.log(job["id"]) or "").splitlines()
+            if "--all" not in parts and len(lines) > AGENT_JOB_LOG_TAIL:
+                print(f"... 省略 {len(lines) - AGENT_JOB_LOG_TAIL} 行（--all 显示全部）")
+                lines = lines[-AGENT_JOB_LOG_TAIL:]
+            print("\n".join(lines) if lines else "(暂无输出)")
+            return
+
+        stats = self.jobs.stats()
+        print(f"\n⏳ 后台任务 (运行 {stats[RUNNING]} / 排队 {stats[QUEUED]} / 完成 {stats[DONE]} / "
+              f"失败 {stats[FAILED]} / 取消 {stats[CANCELLED]})")
+        print("─" * 60)
+        now = time.time()
+        for item in self.jobs.list():
+            job = self.jobs.get(item["id"])
+            if not job:
+                continue
+            if job["started_at"]:
+                elapsed = f"{(job['finished_at'] or now) - job['started_at']:.1f}s"
+            else:
+                elapsed = "-"
+            stage = job["stage"] or "-"
+            if job["cancel_requested"] and job["status"] == RUNNING:
+                stage += " (取消中)"
+            print(f"  #{job['id'][:6]}  {job['status']:<9} {stage:<10} {elapsed:>8}  {job['params']['command']}")
+            if job["error"]:
+                print(f"           ✗ {job['error']}")
+            elif job["result"] and job["result"].get("summary"):
+                print(f"           → {job['result']['summary']}")
+        print("─" * 60)
+
+    def shutdown_jobs(self):
+        """退出前等待运行中的后台任务（排队中的任务取消）"""
+        if not self.jobs:
+            return
+        self.interactive = False
+        stats = self.jobs.stats()
+        if stats[RUNNING] or stats[QUEUED]:
+            print(f"⏳ 等待 {stats[RUNNING]} 个运行中的后台任务完成"
+                  f"（{stats[QUEUED]} 个排队任务已取消，Ctrl+C 强制退出）...")
+        try:
+            self.jobs.shutdown(wait=True)
+        except KeyboardInterrupt:
+            pass
+
     def handle_command(self, command: str) -> bool:
         """处理命令"""
         parts = command.strip().split(maxsplit=1)
@@ -321,6 +543,11 @@ class ConceptVisualizerAgent:
         if cmd.startswith("/"):
             cmd = cmd[1:]
 
+        # 后台执行
+        if "--bg" in args.split():
+            self.submit_background(cmd, " ".join(p for p in args.split() if p != "--bg"))
+            return True
+
         # 退出
         if cmd in ["quit", "exit", "q"]:
             print("👋 再见!")
@@ -380,6 +607,16 @@ class ConceptVisualizerAgent:
             self.list_providers()
             return True
 
+        # 分阶段模型
+        if cmd == "models":
+            self.list_models()
+            return True
+
+        # 后台任务
+        if cmd == "jobs":
+            self.show_jobs(args)
+            return True
+
         # Discover (框架发现)
         if cmd == "discover":
             if not args:
@@ -388,6 +625,7 @@ class ConceptVisualizerAgent:
 
             result = self.skills["discover"].run(args)
             self.context["discover"] = result
+            self._record(result)
 
             if "error" not in result:
                 print(self.skills["discover"].format_output(result))
@@ -401,6 +639,9 @@ class ConceptVisualizerAgent:
                 print("\n选项:")
                 print("  --no-verify      跳过闭环验证，直接保存学习结果")
                 print("  --threshold=N    设置验证通过阈值 (默认70)")
+                print("  --batch          批量学习根目录下的所有示例文件夹")
+                print("  --workers=N      批量模式并发分析的文件夹数 (默认4)")
+                print("  --budget=N       批量模式所有验证共享的生图上限 (默认30)")
                 return True
 
             # 解析参数
@@ -408,20 +649,40 @@ class ConceptVisualizerAgent:
             folder_path = parts[0]
             verify = True
             threshold = 70
+            batch = False
+            batch_options = {}
 
             for part in parts[1:]:
                 if part == "--no-verify":
                     verify = False
+                elif part == "--batch":
+                    batch = True
                 elif part.startswith("--threshold="):
                     try:
                         threshold = int(part.split("=")[1])
                     except:
                         pass
+                elif part.startswith("--workers=") or part.startswith("--budget="):
+                    key, value = part[2:].split("=", 1)
+                    try:
+                        batch_options["workers" if key == "workers" else "image_budget"] = int(value)
+                    except ValueError:
+                        pass
 
             # 创建带参数的技能实例
             learn_skill = LearnExampleSkill(verify=verify, pass_threshold=threshold)
+
+            if batch:
+                result = learn_skill.run_batch(folder_path, **batch_options)
+                self.context["learn"] = result
+                self._record(result)
+                if "error" in result:
+                    print(f"❌ 错误: {result['error']}")
+                return True
+
             result = learn_skill.run(folder_path)
             self.context["learn"] = result
+            self._record(result)
 
             if "error" in result:
                 print(f"❌ 错误: {result['error']}")
@@ -460,21 +721,47 @@ class ConceptVisualizerAgent:
             output_dir = None
             auto_learn = True
             style = None
+            styles = None
+            draft = False
+            force = False
+            fused = None
+            compress = None
 
             for part in parts[1:]:
                 if part == "--no-learn":
                     auto_learn = False
                 elif part.startswith("--style="):
                     style = part.split("=", 1)[1]
+                elif part.startswith("--styles="):
+                    styles = [s for s in part.split("=", 1)[1].split(",") if s]
+                elif part == "--draft":
+                    draft = True
+                elif part == "--force":
+                    force = True
+                elif part == "--fused":
+                    fused = True
+                elif part == "--compress":
+                    compress = True
                 elif not part.startswith("--"):
                     output_dir = part
 
-            # 如果指定了 style，则跳过交互选择
-            interactive_style = (style is None)
-            skill = PipelineSkill(output_dir, auto_learn=auto_learn, style=style, interactive_style=interactive_style)
-            result = skill.run(article_path)
-            self.context = result.get("steps", {})
-            self.context["learning"] = result.get("learning", {})
+            # 如果指定了 style，则跳过交互选择；后台任务无法交互，未指定时使用默认样式
+            background = _background.get()
+            interactive_style = (style is None and not styles and background is None)
+            if background and output_dir is None:
+                # 同一秒提交的多个后台任务不能共用默认的时间戳目录
+                output_dir = f"output/run_{datetime.now():%Y%m%d_%H%M%S}_{background['id'][:6]}"
+            skill = PipelineSkill(output_dir, auto_learn=auto_learn, style=style, interactive_style=interactive_style,
+                                  draft=draft, styles=styles, fused=fused, compress=compress)
+            result = skill.run(article_path, force=force, on_stage=background["on_stage"] if background else None)
+            # 选择样式之前就结束（如文章不存在）时没有生成技能，保留上一次的
+            if skill.generate is not None:
+                self.last_generate = skill.generate
+            # 合并而不是替换：并发的后台任务可能刚写入了其他结果
+            with self._context_lock:
+                self.context.update(result.get("steps", {}))
+                self.context["learning"] = result.get("learning", {})
+            self._record(result)
             return True
 
         # 分析
@@ -483,7 +770,7 @@ class ConceptVisualizerAgent:
                 print("请提供文章路径或文本: /analyze <文章路径>")
                 return True
 
-            result = self.skills["analyze"].run(args)
+            result = self.skills["analyze"].run(args, on_item=PipelineSkill.print_item("name_cn", "name"))
             self.context["analyze"] = result
 
             if "error" not in result:
@@ -496,7 +783,7 @@ class ConceptVisualizerAgent:
                 print("请先执行 /analyze")
                 return True
 
-            result = self.skills["map"].run(self.context["analyze"])
+            result = self.skills["map"].run(self.context["analyze"], on_item=PipelineSkill.print_item("new_title", "framework"))
             self.context["map"] = result
 
             if "error" not in result:
@@ -514,7 +801,7 @@ class ConceptVisualizerAgent:
                 style = args.split("=")[1]
 
             skill = DesignSkill(style)
-            result = skill.run(self.context["map"])
+            result = skill.run(self.context["map"], on_item=PipelineSkill.print_item("title"))
             self.context["design"] = result
 
             if "error" not in result:
@@ -528,27 +815,56 @@ class ConceptVisualizerAgent:
                 return True
 
             designs = self.context["design"].get("designs", [])
+            parts = args.split()
+            draft = "--draft" in parts
+            args = " ".join(p for p in parts if p != "--draft")
+            self.last_generate = self.skills["generate"]
 
             if args:
                 try:
                     idx = int(args) - 1
                     if 0 <= idx < len(designs):
-                        result = self.skills["generate"].run(
-                            designs[idx].get("image_prompt"),
-                            designs[idx].get("title")
-                        )
+                        result = self.skills["generate"].run_design(designs[idx], idx + 1, draft=draft)
                         self.context.setdefault("generate", []).append(result)
+                        self._record([result])
                     else:
                         print(f"索引超出范围 (1-{len(designs)})")
                 except ValueError:
                     print("请提供有效的索引数字")
             else:
-                results = self.skills["generate"].run_batch(designs)
+                results = self.skills["generate"].run_batch(designs, draft=draft)
                 self.context["generate"] = results
+                self._record(results)
                 print(self.skills["generate"].format_output(results))
 
             return True
 
+        # 定稿
+        if cmd == "finalize":
+            if "design" not in self.context:
+                print("请先执行 /design 或 /pipeline")
+                return True
+            if self.last_generate is None:
+                print("尚未生成过图像，请先执行 /generate 或 /pipeline")
+                return True
+            if not args:
+                print("请指定要定稿的序号: /finalize <1,3|all>")
+                return True
+
+            designs = self.context["design"].get("designs", [])
+            indices = None
+            if args.strip() != "all":
+                try:
+                    indices = [int(i) for i in args.replace(" ", "").split(",") if i]
+                except ValueError:
+                    print("请提供有效的序号，如 /finalize 1,3")
+                    return True
+
+            results = self.last_generate.finalize(designs, indices)
+            self.context["finalize"] = results
+            print(self.last_generate.format_output(results))
+            return True
+
         # 未知命令
         print(f"未知命令: {cmd}")
         print("输入 /help 查看可用命令")
@@ -558,10 +874,11 @@ class ConceptVisualizerAgent:
         """运行交互模式"""
         print(self.banner)
         self.show_help()
+        self.interactive = True
 
         while True:
             try:
-                command = input("\n🤖 > ").strip()
+                command = input(PROMPT).strip()
 
                 if not command:
                     continue
@@ -578,9 +895,12 @@ class ConceptVisualizerAgent:
             except Exception as e:
                 print(f"❌ 错误: {e}")
 
+        self.shutdown_jobs()
+
     def run_command(self, command: str):
         """运行单个命令"""
         self.handle_command(command)
+        self.shutdown_jobs()
 
 
 def main():
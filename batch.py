@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Concept Visualizer Batch - 持久化批处理
+任务记录在 SQLite 任务库中，进程重启后继续；多台机器共享文件系统时各自启动 work 即可协同处理。
+工作者以租约领取文章并定期续约，崩溃的工作者的任务在租约过期后被其他工作者接管，
+接管后按阶段产物（00_discover.json ~ 04_generate.json）与 manifest.json 继续，不重复已完成的阶段。
+
+Usage:
+    python batch.py add <文章或目录>... [--output=output/batch] [--style=blueprint] [--learn] [--fused] [--compress] [--draft] [--no-images]
+    python batch.py work [--workers=2] [--lease=300] [--wait]
+    python batch.py stats [--json]
+    python batch.py list [--status=failed]
+    python batch.py retry
+
+    全局选项: --db=<任务库路径>（默认 BATCH_DB_PATH）
+"""
+
+import os
+import sys
+import json
+import socket
+import sqlite3
+import threading
+import traceback
+from pathlib import Path
+from typing import Dict
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+from config import (BATCH_DB_PATH, BATCH_OUTPUT_DIR, BATCH_WORKERS, BATCH_LEASE_SECONDS, BATCH_POLL_SECONDS)
+from lib.job_store import JobStore, LeaseLost
+from lib.jobs import QUEUED
+from lib.prompt_cache import prompt_cache
+from skills import PipelineSkill
+from skills.pipeline import STAGE_ARTIFACTS
+
+ARTICLE_SUFFIXES = (".md", ".markdown", ".txt")
+
+
+def find_articles(paths) -> list:
+    """展开命令行中的文件和目录（目录下递归查找 .md/.markdown/.txt）"""
+    articles = []
+    for raw in paths:
+        path = Path(raw)
+        if path.is_dir():
+            articles.extend(sorted(p for p in path.rglob("*")
+                                   if p.is_file() and p.suffix.lower() in ARTICLE_SUFFIXES))
+        elif path.is_file():
+            articles.append(path)
+        else:
+            print(f"⚠ 跳过不存在的路径: {raw}")
+    return articles
+
+
+def run_job(store: JobStore, job: Dict, worker: str, lease_seconds: float) -> bool:
+    """
+    执行一个已领取的任务：后台线程定期续约，流水线按 manifest.json 增量运行；
+    租约被其他工作者接管后在下一阶段开始前停止，避免两个工作者同时写同一输出目录
+
+    Returns:
+        是否成功
+    """
+    job_id = job["id"]
+    params = job["params"]
+    stop = threading.Event()
+    lost = threading.Event()
+
+    def heartbeat():
+        while not stop.wait(max(1.0, lease_seconds / 3)):
+            try:
+                renewed = store.heartbeat(job_id, worker, lease_seconds)
+            except sqlite3.Error as e:
+                # 任务库被锁等临时错误：下个周期重试，租约有效期内续上即可
+                print(f"⚠ 任务 #{job_id} 续约失败，稍后重试: {e}")
+                continue
+            if not renewed:
+                print(f"⚠ 任务 #{job_id} 的租约已失效（已被其他工作者接管），将在下一阶段开始前停止")
+                lost.set()
+                return
+
+    def on_stage(stage: str):
+        if lost.is_set():
+            raise LeaseLost(f"任务 #{job_id} 的租约已失效")
+        store.set_stage(job_id, worker, stage)
+
+    beat = threading.Thread(target=heartbeat, name=f"heartbeat-{job_id}", daemon=True)
+    beat.start()
+
+    error = None
+    try:
+        skill = PipelineSkill(
+            job["output_dir"],
+            auto_learn=params.get("auto_learn", False),
+            style=params.get("style"),
+            interactive_style=False,
+            draft=bool(params.get("draft")),
+            fused=params.get("fused"),
+            compress=params.get("compress")
+        )
+        result = skill.run(job["article_path"], generate_images=params.get("generate_images", True),
+                           on_stage=on_stage)
+        error = PipelineSkill.error_message(result) or None
+    except LeaseLost:
+        pass
+    except Exception as e:
+        traceback.print_exc()
+        error = str(e)
+    finally:
+        stop.set()
+        beat.join()
+
+    if lost.is_set():
+        # 任务已归新工作者所有，阶段状态和结果都由它记录
+        print(f"✗ 任务 #{job_id} 已停止: 租约已被其他工作者接管")
+        return False
+
+    output_dir = Path(job["output_dir"])
+    store.sync_stages(job_id, {stage: output_dir / name for stage, name in STAGE_ARTIFACTS.items()
+                               if (output_dir / name).exists()})
+
+    if error is None:
+        if store.complete(job_id, worker):
+            print(f"✓ 任务 #{job_id} 完成: {job['article_path']}")
+        return True
+
+    status = store.fail(job_id, worker, error)
+    if status == QUEUED:
+        print(f"✗ 任务 #{job_id} 失败（第 {job['attempts']} 次），已重新排队: {error}")
+    elif status:
+        print(f"✗ 任务 #{job_id} 失败，已达最大尝试次数: {error}")
+    return False
+
+
+def work(store: JobStore, workers: int, lease_seconds: float, wait: bool):
+    """启动工作线程，直到队列为空（--wait 时持续轮询，Ctrl+C 退出）"""
+    prompt_cache.enable_explicit()
+    stop = threading.Event()
+    active = {}
+    totals = {"done": 0, "failed": 0}
+    lock = threading.Lock()
+    host = f"{socket.gethostname()}:{os.getpid()}"
+
+    def loop(index: int):
+        worker = f"{host}:{index}"
+        while not stop.is_set():
+            job = store.lease(worker, lease_seconds)
+            if not job:
+                if not wait:
+                    return
+                stop.wait(BATCH_POLL_SECONDS)
+                continue
+
+            with lock:
+                active[job["id"]] = worker
+            ok = run_job(store, job, worker, lease_seconds)
+            with lock:
+                active.pop(job["id"], None)
+                totals["done" if ok else "failed"] += 1
+
+    threads = [threading.Thread(target=loop, args=(i,), name=f"batch-worker-{i}", daemon=True)
+               for i in range(workers)]
+    print(f"🚀 批处理工作者 {host} 启动: {workers} 个线程，租约 {lease_seconds}s，任务库 {store.path}")
+    for thread in threads:
+        thread.start()
+
+    try:
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(0.5)
+    except KeyboardInterrupt:
+        stop.set()
+        with lock:
+            released = [job_id for job_id, worker in active.items() if store.release(job_id, worker)]
+        print(f"\n已停止，归还 {len(released)} 个运行中的任务，可由其他工作者继续")
+
+    print(f"本进程完成 {totals['done']} 篇，失败 {totals['failed']} 篇")
+
+
+def print_stats(stats: Dict, db_path: Path):
+    """打印队列统计"""
+    print(f"📊 批处理队列: {db_path}")
+    print(f"  排队: {stats['queued']}  运行中: {stats['running']}  完成: {stats['done']}  失败: {stats['failed']}")
+    print(f"  队列深度: {stats['queue_depth']}（其中 {stats['expired_leases']} 个租约过期待接管，累计接管 {stats['reclaims']} 次）")
+    print(f"  活跃工作者: {len(stats['active_workers'])} {', '.join(stats['active_workers'])}")
+    print(f"  吞吐量: {stats['throughput_per_min']} 篇/分钟（最近 {stats['window_s'] // 60} 分钟）")
+    if stats["avg_job_s"] is not None:
+        print(f"  平均耗时: {stats['avg_job_s']} 秒/篇")
+    if stats["eta_s"]:
+        print(f"  预计剩余: {stats['eta_s'] // 60} 分 {stats['eta_s'] % 60} 秒")
+    for stage in STAGE_ARTIFACTS:
+        if stage in stats["stages"]:
+            counts = stats["stages"][stage]
+            print(f"  · {stage}: " + "  ".join(f"{k} {v}" for k, v in sorted(counts.items())))
+
+
+def main():
+    """CLI入口"""
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    options = dict(a[2:].split("=", 1) if "=" in a else (a[2:], True) for a in sys.argv[1:] if a.startswith("--"))
+
+    if not args or args[0] not in ("add", "work", "stats", "list", "retry"):
+        print(__doc__)
+        sys.exit(1)
+
+    command, paths = args[0], args[1:]
+    store = JobStore(Path(options.get("db", BATCH_DB_PATH)))
+
+    if command == "add":
+        articles = find_articles(paths)
+        if not articles:
+            print("✗ 没有找到文章 (.md/.markdown/.txt)")
+            sys.exit(1)
+        params = {
+            "style": options.get("style"),
+            "auto_learn": bool(options.get("learn")),
+            "fused": True if options.get("fused") else None,
+            "compress": True if options.get("compress") else None,
+            "draft": bool(options.get("draft")),
+            "generate_images": not options.get("no-images")
+        }
+        added, skipped = store.add(articles, Path(options.get("output", BATCH_OUTPUT_DIR)), params)
+        print(f"✓ 已入队 {added} 篇" + (f"，跳过已存在的 {skipped} 篇" if skipped else ""))
+
+    elif command == "work":
+        work(store, int(options.get("workers", BATCH_WORKERS)),
+             float(options.get("lease", BATCH_LEASE_SECONDS)), bool(options.get("wait")))
+
+    elif command == "stats":
+        stats = store.stats()
+        if options.get("json"):
+            print(json.dumps(stats, ensure_ascii=False, indent=2))
+        else:
+            print_stats(stats, store.path)
+
+    elif command == "list":
+        for job in store.list(status=options.get("status"), limit=int(options.get("limit", 100))):
+            line = f"#{job['id']:<5} {job['status']:<8} {job['stage'] or '-':<9} 尝试 {job['attempts']}  {job['article_path']}"
+            print(line + (f"\n       ✗ {job['error']}" if job["error"] else ""))
+
+    elif command == "retry":
+        print(f"✓ 已重新排队 {store.retry_failed()} 个失败任务")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,4 @@
+"""
+Benchmarks - 性能基准套件
+使用本地替身提供商（不访问网络）测量各流水线阶段的吞吐、延迟与内存
+"""
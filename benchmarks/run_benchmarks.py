@@ -0,0 +1,434 @@
+"""
+Benchmark Runner - 端到端性能基准
+对 PipelineSkill、GenerateSkill.run_batch、Registry 加载/重载以及各技能的 JSON 解析路径
+进行基准测试，输出机器可读的 JSON（吞吐、延迟分位数、峰值RSS、启动时间）
+
+Usage:
+    python benchmarks/run_benchmarks.py                          # 运行全部分组
+    python benchmarks/run_benchmarks.py --groups=registry,extract
+    python benchmarks/run_benchmarks.py --output=bench.json
+    python benchmarks/run_benchmarks.py --compare=baseline.json --tolerance=0.2
+    python benchmarks/run_benchmarks.py --latency=0.05          # 模拟模型延迟（秒）
+"""
+
+import io
+import json
+import time
+import random
+import platform
+import resource
+import statistics
+import subprocess
+import tempfile
+import contextlib
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List
+from unittest import mock
+
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+GROUPS = ["startup", "registry", "extract", "generate", "pipeline"]
+
+ARTICLE_SIZES = [2_000, 10_000, 40_000]          # 合成文章字符数
+FRAMEWORK_COUNTS = [10, 100, 1_000, 10_000]      # 合成框架库规模
+CONCEPT_COUNTS = [5, 50, 200]                    # 响应中的概念数量（影响JSON体积）
+
+
+# =============================================================================
+# 合成数据
+# =============================================================================
+
+_SENTENCES_CN = [
+    "规范应当被拆分为更小的模块，以避免一次性给出过多指令。",
+    "当度量成为目标时，它就不再是好的度量。",
+    "系统会自然趋向某些稳定的状态，这就是吸引子的含义。",
+    "“约束是自由的基础”，作者在结尾这样总结。",
+    "反馈回路让写作本身成为一种思考方式。",
+]
+_SENTENCES_EN = [
+    "Avoid monolithic specs because too many directives reduce adherence.",
+    "The agent should iterate on the plan before writing any code.",
+    "A measure that becomes a target stops being a good measure.",
+    "\"Writing is thinking,\" as the author puts it in the opening section.",
+    "Each module should address exactly one focused concern.",
+]
+
+
+def make_article(n_chars: int, seed: int = 0) -> str:
+    """生成指定长度的中英混合Markdown文章"""
+    rng = random.Random(seed)
+    parts = ["# Synthetic Article\n"]
+    size = 0
+    section = 1
+    while size < n_chars:
+        if rng.random() < 0.15:
+            parts.append(f"\n## Section {section}\n")
+            section += 1
+        pool = _SENTENCES_CN if rng.random() < 0.5 else _SENTENCES_EN
+        paragraph = " ".join(rng.choice(pool) for _ in range(rng.randint(2, 6)))
+        parts.append(paragraph + "\n")
+        size += len(paragraph)
+    return "\n".join(parts)[:n_chars]
+
+
+def make_framework_library(directory: Path, count: int):
+    """在目录中写入 count 个合成框架 YAML"""
+    import yaml
+
+    directory.mkdir(parents=True, exist_ok=True)
+    for i in range(count):
+        data = {
+            "id": f"synthetic_framework_{i}",
+            "name": f"合成框架 {i} (Synthetic Framework {i})",
+            "name_en": f"Synthetic Framework {i}",
+            "origin": "Benchmark",
+            "description": "用于基准测试的合成框架",
+            "description_en": "Synthetic framework for benchmarking",
+            "keywords": ["synthetic", "benchmark", f"k{i}"],
+            "visual_elements": ["nodes", "edges"],
+            "use_when": "基准测试",
+            "canonical_chart": "network",
+            "suggested_charts": ["flowchart"]
+        }
+        with open(directory / f"synthetic_framework_{i}.yaml", "w", encoding="utf-8") as f:
+            yaml.dump(data, f, allow_unicode=True, default_flow_style=False)
+
+
+# =============================================================================
+# 测量工具
+# =============================================================================
+
+def _percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    k = (len(ordered) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def summarize(samples: List[float], units: int = 1) -> Dict:
+    """把一组耗时（秒）汇总为延迟分位数和吞吐"""
+    total = sum(samples)
+    return {
+        "iterations": len(samples),
+        "throughput_ops_s": round(len(samples) * units / total, 3) if total else None,
+        "latency_ms": {
+            "mean": round(statistics.mean(samples) * 1000, 3),
+            "p50": round(_percentile(samples, 50) * 1000, 3),
+            "p90": round(_percentile(samples, 90) * 1000, 3),
+            "p99": round(_percentile(samples, 99) * 1000, 3),
+            "max": round(max(samples) * 1000, 3),
+        }
+    }
+
+
+def measure(fn: Callable, iterations: int, units: int = 1) -> Dict:
+    """静默执行 fn 若干次并汇总耗时"""
+    samples = []
+    for _ in range(iterations):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            fn()
+            samples.append(time.perf_counter() - start)
+    return summarize(samples, units)
+
+
+def peak_rss_kb() -> int:
+    """当前进程峰值RSS（KB）"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 以字节为单位，Linux 以KB为单位
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+# =============================================================================
+# 基准分组（每组在独立子进程中运行，峰值RSS互不干扰）
+# =============================================================================
+
+def bench_startup(opts: Dict) -> List[Dict]:
+    """冷启动：导入技能模块并构造交互式Agent"""
+    code = (
+        "import sys, time; start = time.perf_counter(); "
+        f"sys.path.insert(0, {str(ROOT_DIR)!r}); "
+        "from agent import ConceptVisualizerAgent; ConceptVisualizerAgent(); "
+        "print(time.perf_counter() - start)"
+    )
+    samples = []
+    wall = []
+    for _ in range(opts["startup_runs"]):
+        start = time.perf_counter()
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=ROOT_DIR)
+        wall.append(time.perf_counter() - start)
+        if out.returncode != 0:
+            raise RuntimeError(out.stderr[-500:])
+        samples.append(float(out.stdout.strip().splitlines()[-1]))
+
+    return [
+        {"case": "startup.import_and_init", **summarize(samples)},
+        {"case": "startup.process_wall", **summarize(wall)},
+    ]
+
+
+def bench_registry(opts: Dict) -> List[Dict]:
+    """Registry 加载与重载，框架库规模 10 → 10k"""
+    from lib.registry import Registry
+
+    # lib 包导出了同名的 registry 单例，需从 sys.modules 取模块本身
+    registry_module = sys.modules["lib.registry"]
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for count in FRAMEWORK_COUNTS:
+            fw_dir = Path(tmp) / f"frameworks_{count}"
+            make_framework_library(fw_dir, count)
+            # 大规模框架库单次加载即需数秒，按规模缩减迭代次数
+            iterations = max(1, min(opts["iterations"], 2_000 // count))
+
+            with mock.patch.object(registry_module, "FRAMEWORKS_DIR", fw_dir):
+                def load():
+                    inst = object.__new__(Registry)
+                    inst._initialized = False
+                    Registry.__init__(inst)
+                    return inst
+
+                inst = load()
+                results.append({"case": "registry.load", "frameworks": count,
+                                **measure(load, iterations)})
+                results.append({"case": "registry.reload", "frameworks": count,
+                                **measure(inst.reload, iterations)})
+                results.append({"case": "registry.frameworks_for_prompt", "frameworks": count,
+                                **measure(inst.get_frameworks_for_prompt, iterations)})
+    return results
+
+
+def bench_extract(opts: Dict) -> List[Dict]:
+    """各技能的提示词组装 + JSON 解析路径"""
+    from lib.api import client
+    from skills import AnalyzeSkill, MapFrameworkSkill, DesignSkill, DiscoverSkill, LearnExampleSkill
+    from benchmarks.stub_provider import install_stub, TINY_PNG_BASE64
+    import base64
+
+    results = []
+    iterations = opts["iterations"]
+
+    for n in CONCEPT_COUNTS:
+        install_stub(client, n_concepts=n, latency=opts["latency"])
+        analyze = AnalyzeSkill()
+        analysis = analyze.run(make_article(2_000))
+        mapping = MapFrameworkSkill().run(analysis)
+
+        results.append({"case": "extract.analyze", "concepts": n,
+                        **measure(lambda: analyze.run(make_article(2_000)), iterations)})
+        results.append({"case": "extract.map", "concepts": n,
+                        **measure(lambda: MapFrameworkSkill().run(analysis), iterations)})
+        results.append({"case": "extract.design", "concepts": n,
+                        **measure(lambda: DesignSkill("blueprint").run(mapping), iterations)})
+
+    install_stub(client, latency=opts["latency"])
+    discover = DiscoverSkill(auto_save=False)
+    for size in ARTICLE_SIZES:
+        article = make_article(size)
+        results.append({"case": "extract.discover", "article_chars": size,
+                        **measure(lambda: discover.discover(article), iterations)})
+
+    learn = LearnExampleSkill(verify=False)
+    install_stub(learn.client, latency=opts["latency"])
+    with tempfile.TemporaryDirectory() as tmp:
+        images = []
+        for i in range(3):
+            path = Path(tmp) / f"image_{i}.png"
+            path.write_bytes(base64.b64decode(TINY_PNG_BASE64))
+            images.append(path)
+        article = make_article(8_000)
+        results.append({"case": "extract.learn_analyze_example", "images": len(images),
+                        **measure(lambda: learn._analyze_example(article, images), iterations)})
+        results.append({"case": "extract.learn_compare_images", "images": len(images),
+                        **measure(lambda: learn._compare_images(images, images), iterations)})
+    return results
+
+
+def bench_generate(opts: Dict) -> List[Dict]:
+    """GenerateSkill.run_batch（无请求间隔）"""
+    from lib.api import client
+    from lib.image_cache import ImageCache
+    from skills import GenerateSkill
+    from benchmarks.stub_provider import install_stub
+
+    install_stub(client, image_latency=opts["latency"])
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        uncached = GenerateSkill(str(Path(tmp) / "images"), style="blueprint", use_cache=False)
+        cached = GenerateSkill(str(Path(tmp) / "images_cached"), style="blueprint")
+        cached.cache = ImageCache(Path(tmp) / "cache")
+        for n in [5, 20]:
+            designs = [{"title": f"设计 {i}", "image_prompt": f"Technical blueprint infographic {i}. " * 40}
+                       for i in range(n)]
+            results.append({"case": "generate.run_batch", "designs": n,
+                            **measure(lambda: uncached.run_batch(designs, delay=0), opts["iterations"],
+                                      units=n)})
+            # 首次运行写入缓存，之后全部命中
+            cached.run_batch(designs, delay=0)
+            results.append({"case": "generate.run_batch_cached", "designs": n,
+                            **measure(lambda: cached.run_batch(designs, delay=0), opts["iterations"],
+                                      units=n)})
+    return results
+
+
+def bench_pipeline(opts: Dict) -> List[Dict]:
+    """PipelineSkill 端到端（文本阶段 + 批量生图），文章规模递增"""
+    from lib.api import client
+    from skills import PipelineSkill
+    from benchmarks.stub_provider import install_stub
+
+    install_stub(client, latency=opts["latency"], image_latency=opts["latency"])
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in ARTICLE_SIZES:
+            article_path = Path(tmp) / f"article_{size}.md"
+            article_path.write_text(make_article(size), encoding="utf-8")
+            counter = {"i": 0}
+
+            def run_once():
+                counter["i"] += 1
+                skill = PipelineSkill(str(Path(tmp) / f"run_{size}_{counter['i']}"),
+                                      auto_learn=True, style="blueprint", interactive_style=False)
+                # 流水线内部的生图请求间隔属于限流策略，不计入基准
+                run_batch = skill.generate.run_batch
+                skill.generate.run_batch = lambda designs, delay=0, **kw: run_batch(designs, delay=0, **kw)
+                # 每轮提示词相同，关闭图像缓存以测量完整路径
+                skill.generate.cache = None
+                result = skill.run(str(article_path))
+                if not result.get("success"):
+                    raise RuntimeError(f"pipeline failed for article of {size} chars")
+
+            results.append({"case": "pipeline.run", "article_chars": size,
+                            **measure(run_once, max(1, opts["iterations"] // 4))})
+    return results
+
+
+BENCHMARKS = {
+    "startup": bench_startup,
+    "registry": bench_registry,
+    "extract": bench_extract,
+    "generate": bench_generate,
+    "pipeline": bench_pipeline,
+}
+
+
+# =============================================================================
+# 运行与比较
+# =============================================================================
+
+def run_group(name: str, opts: Dict) -> Dict:
+    """在子进程中运行一个分组，返回其结果"""
+    cmd = [sys.executable, __file__, f"--group={name}",
+           f"--iterations={opts['iterations']}", f"--latency={opts['latency']}",
+           f"--startup-runs={opts['startup_runs']}"]
+    start = time.perf_counter()
+    out = subprocess.run(cmd, capture_output=True, text=True, cwd=ROOT_DIR)
+    if out.returncode != 0:
+        return {"group": name, "error": out.stderr[-2000:]}
+    data = json.loads(out.stdout)
+    data["wall_s"] = round(time.perf_counter() - start, 3)
+    return data
+
+
+def compare(current: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """比较两次基准的 p50 延迟，返回超出容忍度的回归项"""
+    def index(report):
+        cases = {}
+        for group in report.get("groups", []):
+            for r in group.get("results", []):
+                key = json.dumps({k: v for k, v in r.items()
+                                  if k not in ("iterations", "throughput_ops_s", "latency_ms")},
+                                 sort_keys=True)
+                cases[key] = r
+        return cases
+
+    regressions = []
+    old_cases = index(baseline)
+    for key, new in index(current).items():
+        old = old_cases.get(key)
+        if not old:
+            continue
+        old_p50 = old["latency_ms"]["p50"]
+        new_p50 = new["latency_ms"]["p50"]
+        if old_p50 > 0 and new_p50 > old_p50 * (1 + tolerance):
+            regressions.append(f"{key}: p50 {old_p50}ms → {new_p50}ms")
+    return regressions
+
+
+def main():
+    opts = {"iterations": 20, "latency": 0.0, "startup_runs": 5}
+    groups = GROUPS
+    group = None
+    output = None
+    baseline = None
+    tolerance = 0.2
+
+    for arg in sys.argv[1:]:
+        key, _, value = arg.partition("=")
+        if key == "--group":
+            group = value
+        elif key == "--groups":
+            groups = [g for g in value.split(",") if g]
+        elif key == "--iterations":
+            opts["iterations"] = int(value)
+        elif key == "--latency":
+            opts["latency"] = float(value)
+        elif key == "--startup-runs":
+            opts["startup_runs"] = int(value)
+        elif key == "--output":
+            output = value
+        elif key == "--compare":
+            baseline = value
+        elif key == "--tolerance":
+            tolerance = float(value)
+
+    # 子进程模式：只运行一个分组并把结果写到 stdout
+    if group:
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = BENCHMARKS[group](opts)
+        print(json.dumps({"group": group, "results": results, "peak_rss_kb": peak_rss_kb()}))
+        return
+
+    report = {
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "options": opts,
+        "groups": []
+    }
+    for name in groups:
+        print(f"⏱  {name} ...", file=sys.stderr)
+        report["groups"].append(run_group(name, opts))
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if output:
+        Path(output).write_text(text, encoding="utf-8")
+        print(f"✓ 基准结果已保存: {output}", file=sys.stderr)
+    else:
+        print(text)
+
+    failed = [g["group"] for g in report["groups"] if "error" in g]
+    if failed:
+        print(f"✗ 分组失败: {', '.join(failed)}", file=sys.stderr)
+        sys.exit(1)
+
+    if baseline:
+        with open(baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), tolerance)
+        if regressions:
+            print(f"✗ 发现 {len(regressions)} 项性能回归 (容忍度 {tolerance:.0%}):", file=sys.stderr)
+            for r in regressions:
+                print(f"  - {r}", file=sys.stderr)
+            sys.exit(1)
+        print("✓ 未发现性能回归", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
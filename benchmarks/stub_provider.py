@@ -0,0 +1,239 @@
+"""
+Stub Provider - 本地替身提供商
+根据提示词内容返回结构正确的合成响应，用于基准测试和离线验证
+"""
+
+import json
+import time
+import random
+import sys
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from lib.api import BaseProvider, ProviderFactory, save_image
+from lib import metrics
+
+STUB_PROVIDER_ID = "stub"
+
+# 1x1 PNG，足以让下游按真实图片文件处理
+TINY_PNG_BASE64 = (
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8z8BQ"
+    "DwAEhQGAhKmMIQAAAABJRU5ErkJggg=="
+)
+
+STUB_CONFIG = {
+    "name": "Local Stub",
+    "api_key_env": None,
+    "api_key": "stub",
+    "base_url": "",
+    "text_model": "stub-text",
+    "image_model": "stub-image",
+    "enabled": True
+}
+
+
+class StubProvider(BaseProvider):
+    """本地替身提供商（不访问网络）"""
+
+    provider_id = STUB_PROVIDER_ID
+    supports_image_size = True
+
+    def __init__(self, n_concepts: int = 6, latency: float = 0.0, image_latency: float = 0.0):
+        super().__init__(dict(STUB_CONFIG))
+        self.n_concepts = n_concepts
+        self.latency = latency
+        self.image_latency = image_latency
+        self.calls = 0
+
+    def is_available(self) -> bool:
+        return True
+
+    # =========================================================================
+    # 合成响应
+    # =========================================================================
+
+    def _concepts(self) -> List[Dict]:
+        return [
+            {
+                "id": f"concept_{i}",
+                "name": f"Concept_{i}",
+                "name_cn": f"概念{i}",
+                "description": f"第{i}个概念的描述，说明它在文章中的作用。",
+                "key_quote": f"The \"quoted\" sentence number {i} from the article.",
+                "visualization_type": "network",
+                "importance": 10 - i % 10
+            }
+            for i in range(1, self.n_concepts + 1)
+        ]
+
+    def _respond(self, prompt: str) -> Dict:
+        if "average_score" in prompt:
+            return {
+                "scores": {"visual_style": 80, "chart_type": 80,
+                           "concept_expression": 80, "overall_quality": 80},
+                "average_score": 80,
+                "passed": True,
+                "analysis": {"strengths": ["风格一致"], "weaknesses": [], "suggestions": []},
+                "verdict": "验证通过"
+            }
+        if "analysis_notes" in prompt:
+            return {
+                "frameworks": [],
+                "chart_types": [],
+                "visual_styles": [],
+                "analysis_notes": "合成示例"
+            }
+        if '"designs"' in prompt:
+            return {"designs": [
+                {
+                    "concept_id": c["id"],
+                    "title": c["name_cn"],
+                    "chart_type": "network",
+                    "layout": "split",
+                    "visual_elements": ["nodes", "edges"],
+                    "text_boxes": [{"label": "DEFINITION 定义:", "content": c["description"]}],
+                    "key_quote": c["key_quote"],
+                    "image_prompt": "Technical blueprint infographic. " + c["description"] * 8
+                }
+                for c in self._concepts()
+            ]}
+        if '"mappings"' in prompt:
+            return {"mappings": [
+                {
+                    "concept_id": c["id"],
+                    "original_name": c["name"],
+                    "framework": "agapism",
+                    "framework_name": "Agapism (爱智论)",
+                    "mapping_explanation": "映射解释",
+                    "new_title": f"THE {c['name'].upper()}",
+                    "subtitle": "subtitle",
+                    "insight": "洞察",
+                    "visual_metaphor": "magnetic field",
+                    "recommended_chart": "",
+                    "alternative_charts": []
+                }
+                for c in self._concepts()
+            ]}
+        if "discovered_frameworks" in prompt and "key_concepts" in prompt:
+            # analyze + discover 合并调用
+            return {**self._respond(prompt.replace("discovered_frameworks", "")),
+                    **self._respond(prompt.replace("key_concepts", ""))}
+        if "discovered_frameworks" in prompt:
+            return {
+                "discovered_frameworks": [{
+                    "id": "agapism",
+                    "name": "Agapism (爱智论)",
+                    "name_en": "Agapism",
+                    "is_new": False,
+                    "confidence": 0.9,
+                    "source_quote": "..."
+                }],
+                "existing_matches": [{"framework_id": "agapism", "relevance": "medium", "enrichment": ""}]
+            }
+        if "key_concepts" in prompt:
+            return {
+                "main_theme": "合成文章主题",
+                "key_concepts": self._concepts(),
+                "relationships": [
+                    {"from": "concept_1", "to": f"concept_{i}", "type": "enables"}
+                    for i in range(2, self.n_concepts + 1)
+                ]
+            }
+        return {"text": "ok"}
+
+    def _render(self, data: Dict) -> str:
+        """模拟真实模型输出：代码块包裹 + 尾随说明文字"""
+        body = json.dumps(data, ensure_ascii=False, indent=2)
+        return f"```json\n{body}\n```\n\n以上是完整结果。"
+
+    # =========================================================================
+    # BaseProvider 接口
+    # =========================================================================
+
+    def _complete(self, prompt: str, model: str = None, json_mode: bool = False) -> str:
+        self.calls += 1
+        start = time.perf_counter()
+        if self.latency:
+            time.sleep(self.latency * random.uniform(0.8, 1.2))
+        data = self._respond(prompt)
+        # 原生JSON模式不带代码块和说明文字
+        text = json.dumps(data, ensure_ascii=False) if json_mode else self._render(data)
+        metrics.record_call(
+            provider=self.provider_id, model=model or self.config["text_model"], kind="text",
+            duration_s=time.perf_counter() - start,
+            request_bytes=len(prompt.encode("utf-8")), response_bytes=len(text.encode("utf-8")),
+            usage={"input_tokens": len(prompt) // 4, "output_tokens": len(text) // 4}
+        )
+        return text
+
+    def generate_text(self, prompt: str, model: str = None) -> str:
+        return self._complete(prompt, model)
+
+    def _generate_json_text(self, prompt: str, schema: Dict = None, model: str = None) -> str:
+        return self._complete(prompt, model, json_mode=True)
+
+    def stream_text(self, prompt: str, model: str = None, json_mode: bool = False,
+                    schema: Dict = None) -> Iterator[str]:
+        """模拟流式输出：把延迟均摊到各个分块上"""
+        self.calls += 1
+        start = time.perf_counter()
+        data = self._respond(prompt)
+        text = json.dumps(data, ensure_ascii=False) if json_mode else self._render(data)
+        chunk_size = 256
+        n_chunks = max(1, -(-len(text) // chunk_size))
+        for i in range(0, len(text), chunk_size):
+            if self.latency:
+                time.sleep(self.latency * random.uniform(0.8, 1.2) / n_chunks)
+            yield text[i:i + chunk_size]
+        metrics.record_call(
+            provider=self.provider_id, model=model or self.config["text_model"], kind="text",
+            duration_s=time.perf_counter() - start,
+            request_bytes=len(prompt.encode("utf-8")), response_bytes=len(text.encode("utf-8")),
+            usage={"input_tokens": len(prompt) // 4, "output_tokens": len(text) // 4}
+        )
+
+    def generate_with_images(self, prompt: str, images: list, model: str = None) -> str:
+        return self.generate_text(prompt, model)
+
+    def generate_image(self, prompt: str, output_path: str = None, model: str = None,
+                       image_size: str = None, seed: int = None) -> Dict:
+        self.calls += 1
+        start = time.perf_counter()
+        if self.image_latency:
+            time.sleep(self.image_latency * random.uniform(0.8, 1.2))
+        metrics.record_call(
+            provider=self.provider_id, model=model or self.config["image_model"], kind="image",
+            duration_s=time.perf_counter() - start,
+            request_bytes=len(prompt.encode("utf-8")), response_bytes=len(TINY_PNG_BASE64), images=1
+        )
+
+        if output_path:
+            output_path = save_image(TINY_PNG_BASE64, "image/png", output_path)
+
+        return {
+            "success": True,
+            "image_data": TINY_PNG_BASE64,
+            "mime_type": "image/png",
+            "output_path": output_path
+        }
+
+
+def install_stub(*clients, **kwargs) -> StubProvider:
+    """
+    注册替身提供商，并让给定的客户端使用它
+
+    Args:
+        clients: 需要切换到替身的 GeminiClient 实例
+        kwargs: 传给 StubProvider 的参数
+
+    Returns:
+        替身提供商实例
+    """
+    provider = StubProvider(**kwargs)
+    ProviderFactory._instances[STUB_PROVIDER_ID] = provider
+    for c in clients:
+        c.set_text_provider(STUB_PROVIDER_ID)
+        c.set_image_provider(STUB_PROVIDER_ID)
+    return provider
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Concept Visualizer Bulk - 离线批量
+所有文章的同一阶段（analyze → map → design → generate）合并为一个批次，经提供商的批处理接口
+（Gemini batch、OpenAI Batch，价格约为交互调用的一半，通常数小时内完成）提交，完成后推进到下一阶段。
+不提供批处理接口的提供商以及 OpenAI 的图像请求由本地替身执行；--local 强制使用本地替身（测试用）。
+进度保存在 <输出目录>/bulk.json，中断后再次执行 run 即继续轮询已提交的批次。
+
+Usage:
+    python bulk.py run [<文章或目录>...] [--output=output/bulk] [--style=blueprint] [--compress] [--draft] [--no-images] [--local] [--poll=60]
+    python bulk.py status [--output=output/bulk] [--json]
+"""
+
+import sys
+import json
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+from batch import find_articles
+from skills.bulk import BulkPipeline, BULK_STAGES
+
+
+def main():
+    """CLI入口"""
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    options = dict(a[2:].split("=", 1) if "=" in a else (a[2:], True) for a in sys.argv[1:] if a.startswith("--"))
+
+    if not args or args[0] not in ("run", "status"):
+        print(__doc__)
+        sys.exit(1)
+
+    command, paths = args[0], args[1:]
+
+    if command == "run":
+        bulk = BulkPipeline(
+            options.get("output"),
+            style=options.get("style"),
+            draft=True if options.get("draft") else None,
+            compress=True if options.get("compress") else None,
+            generate_images=False if options.get("no-images") else None,
+            local=True if options.get("local") else None,
+            poll_seconds=float(options["poll"]) if "poll" in options else None
+        )
+        if paths:
+            articles = find_articles(paths)
+            if not articles:
+                print("✗ 没有找到文章 (.md/.markdown/.txt)")
+                sys.exit(1)
+            added, skipped = bulk.add(articles)
+            print(f"✓ 已添加 {added} 篇" + (f"，跳过已存在的 {skipped} 篇" if skipped else ""))
+        elif not bulk.state["articles"]:
+            print("✗ 请指定文章或目录")
+            sys.exit(1)
+
+        try:
+            result = bulk.run()
+        except KeyboardInterrupt:
+            print("\n已停止，已提交的批次继续在提供商侧执行，再次运行 run 即继续")
+            sys.exit(130)
+        sys.exit(1 if result["failures"] else 0)
+
+    elif command == "status":
+        bulk = BulkPipeline(options.get("output"))
+        status = bulk.status()
+        if options.get("json"):
+            print(json.dumps(status, ensure_ascii=False, indent=2))
+            return
+
+        print(f"📦 离线批量: {bulk.output_dir}（{status['articles']} 篇文章）")
+        for stage in BULK_STAGES:
+            print(f"  · {stage}: {status['stages'][stage]}/{status['articles']} 完成")
+        for stage, batches in status["pending"].items():
+            for batch in batches:
+                print(f"  ⏳ {stage} 批次 {batch['id']} [{batch['backend']}]: {batch.get('raw_state') or '已提交'}")
+        for article, error in status["failures"].items():
+            print(f"  ✗ {Path(article).name}: {error}")
+
+
+if __name__ == "__main__":
+    main()
@@ -84,7 +84,15 @@ PROVIDERS = {
         "base_url": "http://localhost:11434/api",
         "text_model": "llama3",
         "image_model": None,
-        "enabled": False
+        "enabled": False,
+        # 模型在最后一次请求后保持加载的时长（"30m"、"-1" 常驻），避免调用间卸载后重新加载
+        "keep_alive": os.environ.get("OLLAMA_KEEP_ALIVE", "30m"),
+        # 同时发出的请求数，与服务端 OLLAMA_NUM_PARALLEL 一致
+        "num_parallel": int(os.environ.get("OLLAMA_NUM_PARALLEL", "4")),
+        # 按提示词长度选择 num_ctx（2 的幂，介于上下限之间，另留出输出空间）
+        "num_ctx_min": 2048,
+        "num_ctx_max": int(os.environ.get("OLLAMA_NUM_CTX_MAX", "32768")),
+        "num_ctx_reserve": 2048
     }
 }
 
@@ -92,6 +100,151 @@ PROVIDERS = {
 DEFAULT_TEXT_PROVIDER = "google"
 DEFAULT_IMAGE_PROVIDER = "google"
 
+# =============================================================================
+# 分阶段模型配置
+# =============================================================================
+# 各阶段使用的文本模型，取值为 "<提供商>:<模型>"、"<提供商>"（使用其 text_model）或 "<模型>"（默认文本提供商）；
+# 未设置的阶段使用 DEFAULT_TEXT_PROVIDER 的 text_model。discover/map 等分类阶段适合便宜快速的模型
+# （flash 或本地 Ollama），design 等生成阶段用更强的模型。配置的提供商不可用时回退到默认提供商与其默认模型。
+# 环境变量 CONCEPT_VIZ_MODEL_<阶段>（如 CONCEPT_VIZ_MODEL_MAP=ollama:llama3）优先于此处设置；
+# 各阶段的调用延迟见 /models 与 metrics.json 的 models 汇总
+
+MODEL_STAGES = ("discover", "analyze", "analyze_discover", "map", "design", "learn", "learn_verify")
+
+STAGE_MODELS = {
+    # "discover": "google:gemini-3-flash-preview",
+    # "map": "ollama:llama3",
+    # "design": "anthropic:claude-sonnet-4-20250514",
+}
+for _stage in MODEL_STAGES:
+    if os.environ.get(f"CONCEPT_VIZ_MODEL_{_stage.upper()}"):
+        STAGE_MODELS[_stage] = os.environ[f"CONCEPT_VIZ_MODEL_{_stage.upper()}"]
+
+# =============================================================================
+# 成本估算 (写入 metrics.json，仅供参考，以各平台账单为准)
+# =============================================================================
+# 文本: 美元 / 百万 token；图像: 美元 / 张
+
+MODEL_PRICING = {
+    "gemini-3-flash-preview": {"input": 0.50, "cached_input": 0.05, "output": 3.00},
+    "gemini-3-pro-image-preview": {"input": 2.00, "output": 12.00, "per_image": 0.24},
+    "gpt-4o": {"input": 2.50, "cached_input": 1.25, "output": 10.00},
+    "dall-e-3": {"per_image": 0.12},
+    "claude-sonnet-4-20250514": {"input": 3.00, "cached_input": 0.30, "output": 15.00},
+    "stable-diffusion-xl-1024-v1-0": {"per_image": 0.004},
+    "llama3": {"input": 0.0, "output": 0.0},
+}
+BATCH_PRICE_FACTOR = 0.5        # 批处理接口（OpenAI Batch、Gemini batch）相对交互调用的价格
+
+# =============================================================================
+# 追踪配置
+# =============================================================================
+# 设置后将所有 span 以 JSON Lines 写入该文件（见 lib/tracing.py）
+
+TRACE_FILE = os.environ.get("CONCEPT_VIZ_TRACE_FILE", "")
+
+# =============================================================================
+# 流水线配置
+# =============================================================================
+# 开启自动学习时把 discover 与 analyze 合并为一次结构化调用（文章只上传一次），
+# 产物仍拆分为 00_discover.json 与 01_analyze.json；/pipeline --fused 可单次开启
+FUSED_ANALYZE_DISCOVER = os.environ.get("CONCEPT_VIZ_FUSED_ANALYZE", "0") == "1"
+
+# 本地抽取式压缩（lib/compress.py）：discover/analyze 之前清理 Markdown 噪声、去重，
+# 超出预算时按 TextRank 保留最重要的原句；/pipeline --compress 可单次开启
+COMPRESS_ARTICLES = os.environ.get("CONCEPT_VIZ_COMPRESS", "0") == "1"
+ARTICLE_TOKEN_BUDGET = int(os.environ.get("CONCEPT_VIZ_ARTICLE_TOKEN_BUDGET", "6000"))  # 压缩后的 token 上限（估算）
+
+# =============================================================================
+# 提示词缓存配置 (lib/prompt_cache.py)
+# =============================================================================
+# discover/map/design 的提示词以静态前缀（框架库、图表类型、样式规范、输出格式）开头，
+# Gemini 为前缀创建 cachedContents，Anthropic 在前缀上标记 cache_control；
+# 其他提供商（OpenAI 等）对相同前缀自动缓存，无需额外请求
+
+PROMPT_CACHE_ENABLED = os.environ.get("CONCEPT_VIZ_PROMPT_CACHE", "1") != "0"
+PROMPT_CACHE_TTL = int(os.environ.get("CONCEPT_VIZ_PROMPT_CACHE_TTL", "3600"))  # Gemini 缓存的存活时间（秒）
+# Gemini 显式缓存的创建按输入计费、存活期间另收存储费，前缀只用一次的单次运行反而更贵：
+# 默认只在多篇文章共用前缀的 batch.py work 与 server.py 中开启；设为 1/0 时在所有入口强制开启/关闭
+PROMPT_CACHE_EXPLICIT = {"1": True, "0": False}.get(os.environ.get("CONCEPT_VIZ_PROMPT_CACHE_EXPLICIT", ""))
+PROMPT_CACHE_MIN_TOKENS = 1024  # 前缀短于此（估算）时不创建缓存：低于提供商的最小可缓存长度
+PROMPT_CACHE_FILE = Path(os.environ.get("CONCEPT_VIZ_PROMPT_CACHE_FILE", str(OUTPUT_DIR / ".prompt_cache.json")))
+
+# =============================================================================
+# 服务模式配置 (server.py)
+# =============================================================================
+
+SERVER_HOST = os.environ.get("CONCEPT_VIZ_SERVER_HOST", "127.0.0.1")
+SERVER_PORT = int(os.environ.get("CONCEPT_VIZ_SERVER_PORT", "8765"))
+SERVER_WORKERS = int(os.environ.get("CONCEPT_VIZ_SERVER_WORKERS", "2"))      # 同时执行的流水线数
+SERVER_QUEUE_SIZE = int(os.environ.get("CONCEPT_VIZ_SERVER_QUEUE_SIZE", "32"))  # 排队上限，满时返回 429
+SERVER_JOBS_DIR = Path(os.environ.get("CONCEPT_VIZ_SERVER_JOBS_DIR", str(OUTPUT_DIR / "jobs")))
+SERVER_JOB_HISTORY = 500        # 内存中保留的已完成任务数
+HTTP_POOL_MAXSIZE = 16          # 每个提供商的 HTTP 连接池大小
+
+# =============================================================================
+# 批处理配置 (batch.py)
+# =============================================================================
+# 任务库为 SQLite 文件，多台机器共享同一文件系统时指向同一路径即可协同处理
+
+BATCH_DB_PATH = Path(os.environ.get("CONCEPT_VIZ_BATCH_DB", str(OUTPUT_DIR / "batch" / "jobs.db")))
+BATCH_OUTPUT_DIR = Path(os.environ.get("CONCEPT_VIZ_BATCH_OUTPUT_DIR", str(OUTPUT_DIR / "batch")))
+BATCH_WORKERS = int(os.environ.get("CONCEPT_VIZ_BATCH_WORKERS", "2"))       # 每个进程的工作线程数
+BATCH_LEASE_SECONDS = int(os.environ.get("CONCEPT_VIZ_BATCH_LEASE", "300"))  # 租约时长，超时未续约的任务被其他工作者接管
+BATCH_MAX_ATTEMPTS = 3          # 每篇文章最多尝试次数（含崩溃后被接管）
+BATCH_POLL_SECONDS = 5          # --wait 模式下队列为空时的轮询间隔
+BATCH_STATS_WINDOW = 600        # 吞吐量统计窗口（秒）
+
+# =============================================================================
+# 离线批量配置 (bulk.py)
+# =============================================================================
+# 同一阶段所有文章的请求合并提交到提供商的批处理接口，完成后再推进到下一阶段；
+# 不提供批处理接口的提供商（以及 OpenAI 的图像请求）由本地替身同步执行
+
+BULK_OUTPUT_DIR = Path(os.environ.get("CONCEPT_VIZ_BULK_OUTPUT_DIR", str(OUTPUT_DIR / "bulk")))
+BULK_POLL_SECONDS = int(os.environ.get("CONCEPT_VIZ_BULK_POLL", "60"))           # 批次状态的轮询间隔
+BULK_LOCAL_DELAY = float(os.environ.get("CONCEPT_VIZ_BULK_LOCAL_DELAY", "5"))   # 本地替身模拟的批次周转时间（秒）
+BULK_MAX_BATCH_BYTES = 16 * 1024 ** 2  # 单个批次的请求体上限，超出时拆为多个批次（Gemini 内联请求上限 20MB）
+
+# =============================================================================
+# 后台任务配置 (agent.py --bg)
+# =============================================================================
+AGENT_BG_WORKERS = int(os.environ.get("CONCEPT_VIZ_AGENT_WORKERS", "2"))  # 交互模式下同时执行的后台命令数
+AGENT_JOB_LOG_TAIL = 40         # /jobs log 默认显示的输出行数
+
+# =============================================================================
+# 图像生成与缓存配置
+# =============================================================================
+
+DEFAULT_ASPECT_RATIO = "16:9"   # 宽高比: "1:1", "16:9", "9:16", "4:3", "3:4"
+DEFAULT_IMAGE_SIZE = "4K"       # 输出尺寸: "1K", "2K", "4K"
+DRAFT_IMAGE_SIZE = "1K"         # 草稿模式尺寸：快速预览，确认后再以 DEFAULT_IMAGE_SIZE 定稿
+
+# 内容寻址的图像缓存：相同的 (完整提示词, 提供商, 模型, 宽高比, 尺寸) 只请求一次
+IMAGE_CACHE_ENABLED = os.environ.get("CONCEPT_VIZ_IMAGE_CACHE", "1") != "0"
+IMAGE_CACHE_DIR = Path(os.environ.get("CONCEPT_VIZ_IMAGE_CACHE_DIR", str(OUTPUT_DIR / ".image_cache")))
+IMAGE_CACHE_MAX_BYTES = int(float(os.environ.get("CONCEPT_VIZ_IMAGE_CACHE_MAX_GB", "5")) * 1024 ** 3)
+
+# /learn 多模态调用前的图片预处理（需要 Pillow，未安装时按原图上传）
+LEARN_IMAGE_MAX_EDGE = int(os.environ.get("CONCEPT_VIZ_LEARN_IMAGE_MAX_EDGE", "1536"))  # 长边像素上限
+LEARN_IMAGE_QUALITY = int(os.environ.get("CONCEPT_VIZ_LEARN_IMAGE_QUALITY", "85"))      # JPEG 质量
+IMAGE_PREP_WORKERS = 4
+IMAGE_PREP_CACHE_DIR = Path(os.environ.get("CONCEPT_VIZ_IMAGE_PREP_CACHE_DIR", str(OUTPUT_DIR / ".image_prep_cache")))
+
+# /learn 验证的本地预筛（感知哈希 + 颜色直方图，需要 Pillow）
+# 相似度与模型评分不是同一标尺、阈值也未经校准，默认只用于拒绝：相似度 <= REJECT 时不再调用多模态模型，
+# 其余一律由模型评分。显式设置 ACCEPT 后，相似度 >= ACCEPT 时也跳过模型评分直接通过
+PRESCREEN_ENABLED = os.environ.get("CONCEPT_VIZ_LEARN_PRESCREEN", "1") != "0"
+PRESCREEN_REJECT_SCORE = 35
+PRESCREEN_ACCEPT_SCORE = (float(os.environ["CONCEPT_VIZ_LEARN_PRESCREEN_ACCEPT"])
+                          if os.environ.get("CONCEPT_VIZ_LEARN_PRESCREEN_ACCEPT") else None)
+
+# /learn --batch：并发分析的文件夹数，以及所有验证共享的生图数量上限
+LEARN_BATCH_WORKERS = 4
+LEARN_BATCH_IMAGE_BUDGET = 30
+# 验证图片并发生成，已有这么多张成功时即进入比较，不再等待其余结果
+LEARN_VERIFY_MIN_IMAGES = 2
+
 # =============================================================================
 # 视觉风格配置
 # =============================================================================
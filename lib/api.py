@@ -4,22 +4,106 @@ Multi-Provider API Client
 """
 
 import os
+import re
+import time
+import threading
 import requests
+from contextlib import nullcontext
+from requests.adapters import HTTPAdapter
 import base64
 import json
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple, Iterator, Callable
 from abc import ABC, abstractmethod
 import sys
 
 sys.path.append(str(Path(__file__).parent.parent))
 
-from config import PROVIDERS, DEFAULT_TEXT_PROVIDER, DEFAULT_IMAGE_PROVIDER
+from config import (PROVIDERS, DEFAULT_TEXT_PROVIDER, DEFAULT_IMAGE_PROVIDER, STAGE_MODELS,
+                    DEFAULT_ASPECT_RATIO, DEFAULT_IMAGE_SIZE, HTTP_POOL_MAXSIZE, PROMPT_CACHE_TTL)
+from lib import metrics, tracing
+from lib.compress import estimate_tokens
+from lib.json_utils import parse_json_response, validate, JSONArrayStream
+from lib.prompt_cache import prompt_cache, split_prompt, EPHEMERAL_TTL
+
+
+class ProviderError(Exception):
+    """提供商接口返回非 200 状态"""
+
+    def __init__(self, provider: str, status_code: int, detail: str = ""):
+        super().__init__(f"{provider} API Error: {status_code} - {detail}")
+        self.status_code = status_code
+
+
+def _sse_json(line: str) -> Optional[Dict]:
+    """解析一行 SSE：返回 data 字段中的 JSON，其余行（event/注释/[DONE]）返回 None"""
+    if not line.startswith("data:"):
+        return None
+    payload = line[5:].strip()
+    if not payload or payload == "[DONE]":
+        return None
+    return json.loads(payload)
+
+
+def save_image(image_data: str, mime_type: str, output_path: str) -> str:
+    """
+    把 base64 图像写入文件（按 mime_type 替换扩展名）
+
+    Returns:
+        实际写入的路径
+    """
+    ext = "png" if "png" in mime_type else "jpg"
+    # 移除已有的图片扩展名，然后添加正确的扩展名
+    output_path = re.sub(r'\.(png|jpg|jpeg)$', '', str(output_path), flags=re.IGNORECASE)
+    output_path = f"{output_path}.{ext}"
+    # 临时文件 + 原子替换：已有的输出文件可能与图像缓存条目是同一个硬链接，原地改写会连带改掉缓存中的旧图
+    tmp = f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(base64.b64decode(image_data))
+    os.replace(tmp, output_path)
+    return output_path
+
+
+def parse_model_spec(spec: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    """
+    解析 STAGE_MODELS 的取值："<提供商>:<模型>"、"<提供商>" 或 "<模型>"（模型名本身可以含冒号，如 llama3:8b）
+
+    Returns:
+        (提供商ID, 模型)，未指定的部分为 None
+    """
+    if not spec:
+        return None, None
+    if spec in PROVIDERS:
+        return spec, None
+    provider_id, sep, model = spec.partition(":")
+    if sep and provider_id in PROVIDERS:
+        return provider_id, model or None
+    return None, spec
+
+
+def _prepend(first: str, chunks: Iterator[str]) -> Iterator[str]:
+    """在流的开头补上预填内容（首个请求成功后才产出）"""
+    started = False
+    for chunk in chunks:
+        if not started:
+            started = True
+            yield first
+        yield chunk
+
 
 
 class BaseProvider(ABC):
     """提供商基类"""
 
+    provider_id = "base"
+
+    # 400 错误信息中出现这些片段（小写）时，才认为是模型不支持原生JSON模式的参数；
+    # 其余 400（提示词过长、参数错误等）照常报错，不关闭JSON模式
+    json_mode_errors: Tuple[str, ...] = ()
+
+    # generate_image 是否按 image_size 调整输出尺寸（否则草稿与定稿成本相同，草稿模式无意义）
+    supports_image_size = False
+
     def __init__(self, config: Dict):
         self.config = config
         self.name = config.get("name", "Unknown")
@@ -32,24 +116,260 @@ class BaseProvider(ABC):
         else:
             self.api_key = config.get("api_key", "")
 
+        # 拒绝过原生JSON模式的模型（按解析后的模型名），之后直接走提示词模式
+        self._json_mode_rejected = set()
+
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self) -> requests.Session:
+        """共享的 HTTP 会话：跨调用和线程复用 keep-alive 连接（常驻进程中省去重复握手）"""
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_MAXSIZE)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    self._session = session
+        return self._session
+
     @abstractmethod
     def generate_text(self, prompt: str, model: str = None) -> str:
         """生成文本"""
         pass
 
     @abstractmethod
-    def generate_image(self, prompt: str, output_path: str = None, model: str = None) -> Dict:
-        """生成图像"""
+    def generate_image(self, prompt: str, output_path: str = None, model: str = None,
+                       image_size: str = None, seed: int = None) -> Dict:
+        """
+        生成图像
+
+        Args:
+            prompt: 图像生成提示词
+            output_path: 输出路径（不含扩展名）
+            model: 模型名称
+            image_size: 输出尺寸 "1K"/"2K"/"4K"，为 None 时使用 DEFAULT_IMAGE_SIZE（不支持的提供商忽略）
+            seed: 随机种子，相同提示词+种子可复现构图（不支持的提供商忽略）
+        """
         pass
 
     def is_available(self) -> bool:
         """检查是否可用"""
         return bool(self.api_key) and self.config.get("enabled", False)
 
+    @property
+    def max_concurrency(self) -> int:
+        """同时在途请求的建议上限（本地批次替身按此并发执行请求）"""
+        return 1
+
+    def generate_json(self, prompt: str, schema: Dict = None, model: str = None,
+                      on_item: Callable[[Any], None] = None, item_key: str = None) -> Any:
+        """
+        生成结构化JSON
+
+        优先使用提供商的原生JSON模式；不支持或被接口拒绝时，
+        回退为普通文本生成 + 提取器
+
+        Args:
+            prompt: 提示词
+            schema: 期望结构（JSON Schema 子集）
+            model: 模型名称
+            on_item: 流式回调，目标数组中每个元素完整到达时立即调用
+            item_key: 目标数组在顶层对象中的字段名
+
+        Returns:
+            解析并校验通过的 JSON 值
+        """
+        if on_item:
+            text = self._stream_json_text(prompt, schema, model, on_item, item_key)
+        else:
+            text = None
+            if self._model_name(model) not in self._json_mode_rejected:
+                text = self._generate_json_text(prompt, schema, model)
+                if text is None:
+                    self._json_mode_rejected.add(self._model_name(model))
+            if text is None:
+                metrics.incr("json_mode_fallbacks")
+                text = self.generate_text(prompt, model)
+        return parse_json_response(text, schema, repair_client=self, repair_model=model)
+
+    def _stream_json_text(self, prompt: str, schema: Dict, model: str,
+                          on_item: Callable[[Any], None], item_key: str) -> str:
+        """流式生成JSON，逐个回调已完成的数组元素，返回完整文本"""
+        item_schema = {}
+        if schema and item_key:
+            item_schema = schema.get("properties", {}).get(item_key, {}).get("items", {})
+
+        def consume(chunks: Iterator[str]) -> str:
+            stream = JSONArrayStream(item_key)
+            for chunk in chunks:
+                for item in stream.feed(chunk):
+                    # 结构不完整的元素不提前交付，留给最终解析
+                    if not item_schema or not validate(item, item_schema):
+                        on_item(item)
+            return stream.text
+
+        json_mode = self._model_name(model) not in self._json_mode_rejected
+        try:
+            return consume(self.stream_text(prompt, model, json_mode=json_mode, schema=schema))
+        except ProviderError as e:
+            if not (json_mode and self._json_mode_unsupported(e.status_code, str(e))):
+                raise
+            self._json_mode_rejected.add(self._model_name(model))
+            metrics.incr("json_mode_fallbacks")
+            return consume(self.stream_text(prompt, model))
+
+    def stream_text(self, prompt: str, model: str = None, json_mode: bool = False,
+                    schema: Dict = None) -> Iterator[str]:
+        """
+        流式生成文本，逐块产出
+
+        默认实现不支持流式：一次性产出完整结果
+
+        Args:
+            prompt: 提示词
+            model: 模型名称
+            json_mode: 是否使用原生JSON模式
+            schema: JSON模式下的期望结构
+        """
+        text = self._generate_json_text(prompt, schema, model) if json_mode else None
+        yield text if text is not None else self.generate_text(prompt, model)
+
+    def _generate_json_text(self, prompt: str, schema: Dict = None, model: str = None) -> Optional[str]:
+        """
+        以原生JSON模式生成（子类按各自接口实现）
+
+        Returns:
+            模型输出文本；返回 None 表示不支持原生JSON模式
+        """
+        return None
+
+    def _model_name(self, model: str = None) -> str:
+        """调用实际使用的文本模型名（未指定时为提供商的默认模型）"""
+        return model or self.config.get("text_model") or ""
+
+    def _json_mode_unsupported(self, status_code: int, detail: str) -> bool:
+        """错误是否表明模型不支持原生JSON模式的参数（见 json_mode_errors）"""
+        detail = detail.lower()
+        return status_code == 400 and any(marker in detail for marker in self.json_mode_errors)
+
+    def _parse_usage(self, data: Dict) -> Dict:
+        """从响应元数据中解析 token 用量（子类按各自格式实现）"""
+        return {}
+
+    def _post(self, url: str, payload: Dict, headers: Dict = None, timeout: int = 120,
+              kind: str = "text", model: str = None) -> Tuple[requests.Response, Optional[Dict]]:
+        """
+        发送请求并记录遥测
+
+        Returns:
+            (response, data)，data 为成功时解析后的 JSON，否则为 None
+        """
+        body = json.dumps(payload).encode("utf-8")
+        headers = {"Content-Type": "application/json", **(headers or {})}
+
+        with tracing.span(f"provider.{kind}", provider=self.provider_id, model=model) as sp:
+            start = time.perf_counter()
+            response = self.session.post(url, headers=headers, data=body, timeout=timeout)
+            duration = time.perf_counter() - start
+
+            data = response.json() if response.status_code == 200 else None
+            usage = self._parse_usage(data) if data else {}
+            sp.set_attribute("status", response.status_code)
+            sp.set_attribute("request_bytes", len(body))
+            sp.set_attribute("response_bytes", len(response.content))
+            for key, value in usage.items():
+                sp.set_attribute(key, value)
+
+        metrics.record_call(
+            provider=self.provider_id,
+            model=model,
+            kind=kind,
+            duration_s=duration,
+            request_bytes=len(body),
+            response_bytes=len(response.content),
+            usage=usage,
+            status=response.status_code,
+            images=1 if kind == "image" and data else 0
+        )
+        return response, data
+
+
+    def _stream(self, url: str, payload: Dict, headers: Dict = None, timeout: int = 120,
+                model: str = None, parse_line: Callable[[str, Dict], Optional[str]] = None) -> Iterator[str]:
+        """
+        发送流式请求，逐块产出文本，结束时记录遥测
+
+        Args:
+            parse_line: 从一行响应中取出文本增量，并把 token 用量写入传入的 usage 字典
+
+        Raises:
+            ProviderError: 非 200 状态（在产出任何内容之前抛出）
+        """
+        body = json.dumps(payload).encode("utf-8")
+        headers = {"Content-Type": "application/json", **(headers or {})}
+        usage: Dict = {}
+        status = None
+        received = 0
+
+        with tracing.span("provider.stream", provider=self.provider_id, model=model) as sp:
+            start = time.perf_counter()
+            try:
+                with self.session.post(url, headers=headers, data=body, timeout=timeout, stream=True) as response:
+                    status = response.status_code
+                    if status != 200:
+                        received = len(response.content)
+                        raise ProviderError(self.name, status, response.text[:200])
+
+                    # SSE 响应通常不声明 charset，requests 会误判为 ISO-8859-1
+                    response.encoding = "utf-8"
+                    for line in response.iter_lines(decode_unicode=True):
+                        received += len(line.encode("utf-8")) + 1
+                        if not line:
+                            continue
+                        chunk = parse_line(line, usage)
+                        if chunk:
+                            yield chunk
+            finally:
+                duration = time.perf_counter() - start
+                sp.set_attribute("status", status)
+                sp.set_attribute("request_bytes", len(body))
+                sp.set_attribute("response_bytes", received)
+                metrics.record_call(
+                    provider=self.provider_id,
+                    model=model,
+                    kind="text",
+                    duration_s=duration,
+                    request_bytes=len(body),
+                    response_bytes=received,
+                    usage=usage,
+                    status=status or 0
+                )
+
 
 class GoogleProvider(BaseProvider):
     """Google AI Studio 提供商"""
 
+    provider_id = "google"
+    json_mode_errors = ("responseschema", "response_schema", "responsemimetype", "response_mime_type", "json mode")
+    supports_image_size = True
+    # 创建 cachedContents 被拒绝时，表示前缀不可缓存的错误（低于最小可缓存长度、模型不支持显式缓存）
+    uncacheable_errors = ("too small", "min_total_token_count", "createcachedcontent", "not supported for caching",
+                          "does not support caching")
+    # 引用的 cachedContents 已被删除或过期（其余 400/403/404 如鉴权、权限失败不是缓存问题，重试也无用）
+    stale_cache_error = re.compile(r"cache[d_ ]?contents?\b.*\b(not found|expired|does not exist)")
+
+    def _parse_usage(self, data: Dict) -> Dict:
+        usage = data.get("usageMetadata", {})
+        return {
+            # 创建 cachedContents 的响应只有 totalTokenCount（按输入计费）
+            "input_tokens": usage.get("promptTokenCount", usage.get("totalTokenCount", 0)),
+            "output_tokens": usage.get("candidatesTokenCount", 0) + usage.get("thoughtsTokenCount", 0),
+            "cached_tokens": usage.get("cachedContentTokenCount", 0)
+        }
+
     def generate_text(self, prompt: str, model: str = None) -> str:
         model = model or self.config.get("text_model", "gemini-2.0-flash-exp")
         url = f"{self.base_url}/models/{model}:generateContent"
@@ -59,17 +379,11 @@ class GoogleProvider(BaseProvider):
             "X-goog-api-key": self.api_key
         }
 
-        payload = {
-            "contents": [{"parts": [{"text": prompt}]}]
-        }
-
-        response = requests.post(url, headers=headers, json=payload, timeout=120)
+        response, data = self._post_prompt(url, prompt, model, headers)
 
         if response.status_code != 200:
             raise Exception(f"Google API Error: {response.status_code} - {response.text[:200]}")
 
-        data = response.json()
-
         if "candidates" in data and len(data["candidates"]) > 0:
             parts = data["candidates"][0]["content"]["parts"]
             for part in parts:
@@ -78,8 +392,143 @@ class GoogleProvider(BaseProvider):
 
         return ""
 
+    def _prompt_payload(self, prompt: str, model: str, use_cache: bool = True) -> Tuple[Dict, Optional[str]]:
+        """
+        请求体中的提示词部分：前缀可缓存时引用 cachedContents 句柄，只发送其余部分
+
+        Returns:
+            (payload, 引用的缓存句柄或 None)
+        """
+        prefix, body = split_prompt(prompt) if use_cache and prompt_cache.explicit else (None, str(prompt))
+        handle = self._cached_content(prefix, model) if prefix else None
+        if not handle:
+            return {"contents": [{"parts": [{"text": str(prompt)}]}]}, None
+        return {"cachedContent": handle, "contents": [{"role": "user", "parts": [{"text": body}]}]}, handle
+
+    def _cached_content(self, prefix: str, model: str) -> Optional[str]:
+        """获取（或创建）前缀的 cachedContents 句柄"""
+
+        def create() -> Optional[Dict]:
+            url = f"{self.base_url}/cachedContents"
+            headers = {
+                "Content-Type": "application/json",
+                "X-goog-api-key": self.api_key
+            }
+            payload = {
+                "model": f"models/{model}",
+                "contents": [{"role": "user", "parts": [{"text": prefix}]}],
+                "ttl": f"{PROMPT_CACHE_TTL}s"
+            }
+            # 以发出请求的时间计算过期时间，比服务端略早
+            expires_at = time.time() + PROMPT_CACHE_TTL
+            try:
+                response, data = self._post(url, payload, headers, timeout=120, kind="cache", model=model)
+            except requests.RequestException:
+                return None
+            if self._uncacheable(response.status_code, response.text):
+                # 前缀低于模型的最小可缓存长度，或模型不支持显式缓存：到期前直接发送完整提示词
+                return {"handle": None, "expires_at": expires_at}
+            if response.status_code != 200:
+                return None
+            return {"handle": data["name"], "expires_at": expires_at}
+
+        return prompt_cache.get_or_create(self.provider_id, model, prefix, create)
+
+    def _uncacheable(self, status_code: int, detail: str) -> bool:
+        """创建缓存的错误是否表明该前缀不可缓存（见 uncacheable_errors），其余错误只是暂时失败"""
+        detail = detail.lower()
+        return status_code in (400, 404) and any(marker in detail for marker in self.uncacheable_errors)
+
+    def _stale_cache(self, status_code: int, detail: str) -> bool:
+        """错误是否因为引用的缓存已不存在（被删除或提前过期）"""
+        return status_code in (400, 403, 404) and bool(self.stale_cache_error.search(detail.lower()))
+
+    def _post_prompt(self, url: str, prompt: str, model: str, headers: Dict,
+                     extra: Dict = None) -> Tuple[requests.Response, Optional[Dict]]:
+        """发送提示词请求；引用的缓存失效时作废句柄，以完整提示词重试一次"""
+        payload, handle = self._prompt_payload(prompt, model)
+        response, data = self._post(url, {**payload, **(extra or {})}, headers, timeout=120, kind="text", model=model)
+        if handle and self._stale_cache(response.status_code, response.text):
+            prompt_cache.invalidate(handle)
+            payload, _ = self._prompt_payload(prompt, model, use_cache=False)
+            response, data = self._post(url, {**payload, **(extra or {})}, headers, timeout=120,
+                                        kind="text", model=model)
+        return response, data
+
+    @staticmethod
+    def _json_generation_config(schema: Dict = None) -> Dict:
+        generation_config = {"responseMimeType": "application/json"}
+        response_schema = _gemini_schema(schema) if schema else None
+        if response_schema:
+            generation_config["responseSchema"] = response_schema
+        return generation_config
+
+    def stream_text(self, prompt: str, model: str = None, json_mode: bool = False,
+                    schema: Dict = None) -> Iterator[str]:
+        model = model or self.config.get("text_model", "gemini-2.0-flash-exp")
+        url = f"{self.base_url}/models/{model}:streamGenerateContent?alt=sse"
+
+        headers = {
+            "Content-Type": "application/json",
+            "X-goog-api-key": self.api_key
+        }
+
+        extra = {"generationConfig": self._json_generation_config(schema)} if json_mode else {}
+        payload, handle = self._prompt_payload(prompt, model)
+
+        def parse_line(line: str, usage: Dict) -> Optional[str]:
+            data = _sse_json(line)
+            if not data:
+                return None
+            if "usageMetadata" in data:
+                usage.update(self._parse_usage(data))
+            candidates = data.get("candidates") or [{}]
+            parts = candidates[0].get("content", {}).get("parts", [])
+            return "".join(part["text"] for part in parts if "text" in part)
+
+        chunks = self._stream(url, {**payload, **extra}, headers, timeout=120, model=model, parse_line=parse_line)
+        if not handle:
+            return chunks
+
+        def uncached() -> Iterator[str]:
+            inline, _ = self._prompt_payload(prompt, model, use_cache=False)
+            return self._stream(url, {**inline, **extra}, headers, timeout=120, model=model, parse_line=parse_line)
+
+        return self._retry_uncached(chunks, handle, uncached)
+
+    def _retry_uncached(self, chunks: Iterator[str], handle: str,
+                        uncached: Callable[[], Iterator[str]]) -> Iterator[str]:
+        """流式请求引用的缓存失效时（ProviderError 在产出内容之前抛出），作废句柄并以完整提示词重试"""
+        try:
+            yield from chunks
+        except ProviderError as e:
+            if not self._stale_cache(e.status_code, str(e)):
+                raise
+            prompt_cache.invalidate(handle)
+            yield from uncached()
+
+    def _generate_json_text(self, prompt: str, schema: Dict = None, model: str = None) -> Optional[str]:
+        model = model or self.config.get("text_model", "gemini-2.0-flash-exp")
+        url = f"{self.base_url}/models/{model}:generateContent"
+
+        headers = {
+            "Content-Type": "application/json",
+            "X-goog-api-key": self.api_key
+        }
+
+        response, data = self._post_prompt(url, prompt, model, headers,
+                                           extra={"generationConfig": self._json_generation_config(schema)})
+
+        if self._json_mode_unsupported(response.status_code, response.text):
+            # 模型不支持结构化输出或 schema 不被接受
+            return None
+        if response.status_code != 200:
+            raise Exception(f"Google API Error: {response.status_code} - {response.text[:200]}")
+        return self.parse_text(data)
+
     def generate_image(self, prompt: str, output_path: str = None, model: str = None,
-                        aspect_ratio: str = "16:9") -> Dict:
+                       image_size: str = None, seed: int = None,
+                       aspect_ratio: str = DEFAULT_ASPECT_RATIO) -> Dict:
         """
         生成图像
 
@@ -87,6 +536,8 @@ class GoogleProvider(BaseProvider):
             prompt: 图像生成提示词
             output_path: 输出路径
             model: 模型名称
+            image_size: 输出尺寸，支持 "1K", "2K", "4K"
+            seed: 随机种子
             aspect_ratio: 宽高比，支持 "1:1", "16:9", "9:16", "4:3", "3:4"
         """
         model = model or self.config.get("image_model", "nano-banana-pro-preview")
@@ -97,6 +548,23 @@ class GoogleProvider(BaseProvider):
             "X-goog-api-key": self.api_key
         }
 
+        payload = self.image_payload(prompt, image_size, seed, aspect_ratio)
+        response, data = self._post(url, payload, headers, timeout=180, kind="image", model=model)
+
+        if response.status_code != 200:
+            raise Exception(f"Google API Error: {response.status_code} - {response.text[:200]}")
+
+        image = self.parse_image(data)
+        if not image:
+            return {"success": False, "error": "No image in response"}
+        if output_path:
+            output_path = save_image(image["image_data"], image["mime_type"], output_path)
+        return {"success": True, **image, "output_path": output_path}
+
+    @staticmethod
+    def image_payload(prompt: str, image_size: str = None, seed: int = None,
+                      aspect_ratio: str = DEFAULT_ASPECT_RATIO) -> Dict:
+        """生图请求体（离线批量模式复用）"""
         # 添加中文清晰度指令到prompt
         enhanced_prompt = f"{prompt}\n\nIMPORTANT: Ensure all Chinese text (简体中文) is crystal clear, sharp, and correctly rendered with proper stroke details."
 
@@ -106,44 +574,30 @@ class GoogleProvider(BaseProvider):
                 "responseModalities": ["image", "text"],
                 "imageConfig": {
                     "aspectRatio": aspect_ratio,
-                    "imageSize": "4K"
+                    "imageSize": image_size or DEFAULT_IMAGE_SIZE
                 }
             }
         }
+        if seed is not None:
+            payload["generationConfig"]["seed"] = seed
+        return payload
 
-        response = requests.post(url, headers=headers, json=payload, timeout=180)
-
-        if response.status_code != 200:
-            raise Exception(f"Google API Error: {response.status_code} - {response.text[:200]}")
-
-        data = response.json()
-
+    @staticmethod
+    def parse_image(data: Dict) -> Optional[Dict]:
+        """从 generateContent 响应中取出图像 {"image_data", "mime_type"}，没有图像时返回 None"""
         if "candidates" in data and len(data["candidates"]) > 0:
-            parts = data["candidates"][0]["content"]["parts"]
-
-            for part in parts:
+            for part in data["candidates"][0].get("content", {}).get("parts", []):
                 if "inlineData" in part:
-                    image_data = part["inlineData"]["data"]
-                    mime_type = part["inlineData"]["mimeType"]
-
-                    if output_path:
-                        ext = "png" if "png" in mime_type else "jpg"
-                        # 移除已有的图片扩展名，然后添加正确的扩展名
-                        import re
-                        output_path = re.sub(r'\.(png|jpg|jpeg)$', '', output_path, flags=re.IGNORECASE)
-                        output_path = f"{output_path}.{ext}"
+                    return {"image_data": part["inlineData"]["data"], "mime_type": part["inlineData"]["mimeType"]}
+        return None
 
-                        with open(output_path, "wb") as f:
-                            f.write(base64.b64decode(image_data))
-
-                    return {
-                        "success": True,
-                        "image_data": image_data,
-                        "mime_type": mime_type,
-                        "output_path": output_path
-                    }
-
-        return {"success": False, "error": "No image in response"}
+    @staticmethod
+    def parse_text(data: Dict) -> str:
+        """从 generateContent 响应中取出文本"""
+        if "candidates" in data and len(data["candidates"]) > 0:
+            parts = data["candidates"][0].get("content", {}).get("parts", [])
+            return "".join(part["text"] for part in parts if "text" in part)
+        return ""
 
     def generate_with_images(self, prompt: str, images: list, model: str = None) -> str:
         """多模态生成：文本+图像输入"""
@@ -169,13 +623,11 @@ class GoogleProvider(BaseProvider):
             "contents": [{"parts": parts}]
         }
 
-        response = requests.post(url, headers=headers, json=payload, timeout=180)
+        response, data = self._post(url, payload, headers, timeout=180, kind="multimodal", model=model)
 
         if response.status_code != 200:
             raise Exception(f"Google API Error: {response.status_code} - {response.text[:500]}")
 
-        data = response.json()
-
         if "candidates" in data and len(data["candidates"]) > 0:
             parts = data["candidates"][0]["content"]["parts"]
             for part in parts:
@@ -185,9 +637,63 @@ class GoogleProvider(BaseProvider):
         return ""
 
 
+def _gemini_schema(schema: Dict) -> Optional[Dict]:
+    """
+    把 JSON Schema 子集转换为 Gemini responseSchema（OpenAPI 风格，类型大写）
+
+    没有 properties 的 object 无法表达，返回 None 由上层省略
+    """
+    schema_type = schema.get("type")
+    nullable = False
+    if isinstance(schema_type, list):
+        nullable = "null" in schema_type
+        schema_type = next((t for t in schema_type if t != "null"), None)
+    if not schema_type:
+        return None
+
+    converted: Dict[str, Any] = {"type": schema_type.upper()}
+    if nullable:
+        converted["nullable"] = True
+    if "enum" in schema:
+        converted["enum"] = [str(v) for v in schema["enum"]]
+
+    if schema_type == "object":
+        properties = {}
+        for key, sub in schema.get("properties", {}).items():
+            sub_converted = _gemini_schema(sub)
+            if sub_converted:
+                properties[key] = sub_converted
+        if not properties:
+            return None
+        converted["properties"] = properties
+        required = [k for k in schema.get("required", []) if k in properties]
+        if required:
+            converted["required"] = required
+    elif schema_type == "array":
+        items = _gemini_schema(schema["items"]) if "items" in schema else None
+        if not items:
+            return None
+        converted["items"] = items
+        if "minItems" in schema:
+            converted["minItems"] = schema["minItems"]
+
+    return converted
+
+
 class OpenAIProvider(BaseProvider):
     """OpenAI 提供商"""
 
+    provider_id = "openai"
+    json_mode_errors = ("response_format",)
+
+    def _parse_usage(self, data: Dict) -> Dict:
+        usage = data.get("usage") or {}
+        return {
+            "input_tokens": usage.get("prompt_tokens", 0),
+            "output_tokens": usage.get("completion_tokens", 0),
+            "cached_tokens": (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+        }
+
     def generate_text(self, prompt: str, model: str = None) -> str:
         model = model or self.config.get("text_model", "gpt-4o")
         url = f"{self.base_url}/chat/completions"
@@ -202,15 +708,77 @@ class OpenAIProvider(BaseProvider):
             "messages": [{"role": "user", "content": prompt}]
         }
 
-        response = requests.post(url, headers=headers, json=payload, timeout=120)
+        response, data = self._post(url, payload, headers, timeout=120, kind="text", model=model)
 
         if response.status_code != 200:
             raise Exception(f"OpenAI API Error: {response.status_code} - {response.text[:200]}")
+        return data["choices"][0]["message"]["content"]
+
+    @staticmethod
+    def _response_format(schema: Dict = None) -> Dict:
+        if schema:
+            return {
+                "type": "json_schema",
+                "json_schema": {"name": "response", "schema": schema, "strict": False}
+            }
+        return {"type": "json_object"}
+
+    def stream_text(self, prompt: str, model: str = None, json_mode: bool = False,
+                    schema: Dict = None) -> Iterator[str]:
+        model = model or self.config.get("text_model", "gpt-4o")
+        url = f"{self.base_url}/chat/completions"
+
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}"
+        }
 
-        data = response.json()
+        payload = {
+            "model": model,
+            "messages": [{"role": "user", "content": prompt}],
+            "stream": True,
+            "stream_options": {"include_usage": True}
+        }
+        if json_mode:
+            payload["response_format"] = self._response_format(schema)
+
+        def parse_line(line: str, usage: Dict) -> Optional[str]:
+            data = _sse_json(line)
+            if not data:
+                return None
+            if data.get("usage"):
+                usage.update(self._parse_usage(data))
+            choices = data.get("choices") or [{}]
+            return (choices[0].get("delta") or {}).get("content")
+
+        return self._stream(url, payload, headers, timeout=120, model=model, parse_line=parse_line)
+
+    def _generate_json_text(self, prompt: str, schema: Dict = None, model: str = None) -> Optional[str]:
+        model = model or self.config.get("text_model", "gpt-4o")
+        url = f"{self.base_url}/chat/completions"
+
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}"
+        }
+
+        payload = {
+            "model": model,
+            "messages": [{"role": "user", "content": prompt}],
+            "response_format": self._response_format(schema)
+        }
+
+        response, data = self._post(url, payload, headers, timeout=120, kind="text", model=model)
+
+        if self._json_mode_unsupported(response.status_code, response.text):
+            # 模型不支持 response_format
+            return None
+        if response.status_code != 200:
+            raise Exception(f"OpenAI API Error: {response.status_code} - {response.text[:200]}")
         return data["choices"][0]["message"]["content"]
 
-    def generate_image(self, prompt: str, output_path: str = None, model: str = None) -> Dict:
+    def generate_image(self, prompt: str, output_path: str = None, model: str = None,
+                       image_size: str = None, seed: int = None) -> Dict:
         model = model or self.config.get("image_model", "dall-e-3")
         url = f"{self.base_url}/images/generations"
 
@@ -227,20 +795,14 @@ class OpenAIProvider(BaseProvider):
             "response_format": "b64_json"
         }
 
-        response = requests.post(url, headers=headers, json=payload, timeout=180)
+        response, data = self._post(url, payload, headers, timeout=180, kind="image", model=model)
 
         if response.status_code != 200:
             raise Exception(f"OpenAI API Error: {response.status_code} - {response.text[:200]}")
-
-        data = response.json()
         image_data = data["data"][0]["b64_json"]
 
         if output_path:
-            if not output_path.endswith(".png"):
-                output_path = f"{output_path}.png"
-
-            with open(output_path, "wb") as f:
-                f.write(base64.b64decode(image_data))
+            output_path = save_image(image_data, "image/png", output_path)
 
         return {
             "success": True,
@@ -253,6 +815,31 @@ class OpenAIProvider(BaseProvider):
 class AnthropicProvider(BaseProvider):
     """Anthropic Claude 提供商（仅文本）"""
 
+    provider_id = "anthropic"
+    json_mode_errors = ("prefill",)
+
+    def _parse_usage(self, data: Dict) -> Dict:
+        usage = data.get("usage") or {}
+        cache_read = usage.get("cache_read_input_tokens") or 0
+        cache_write = usage.get("cache_creation_input_tokens") or 0
+        return {
+            # Anthropic 的 input_tokens 不含缓存部分，这里统一为"含缓存"的口径
+            "input_tokens": usage.get("input_tokens", 0) + cache_read + cache_write,
+            "output_tokens": usage.get("output_tokens", 0),
+            "cached_tokens": cache_read
+        }
+
+    def _user_content(self, prompt: str, model: str):
+        """用户消息内容：前缀可缓存时拆为两个文本块，在前缀块上标记 cache_control"""
+        prefix, body = split_prompt(prompt)
+        if not prefix:
+            return str(prompt)
+        prompt_cache.touch(self.provider_id, model, prefix, EPHEMERAL_TTL)
+        return [
+            {"type": "text", "text": prefix, "cache_control": {"type": "ephemeral"}},
+            {"type": "text", "text": body}
+        ]
+
     def generate_text(self, prompt: str, model: str = None) -> str:
         model = model or self.config.get("text_model", "claude-sonnet-4-20250514")
         url = f"{self.base_url}/messages"
@@ -266,54 +853,238 @@ class AnthropicProvider(BaseProvider):
         payload = {
             "model": model,
             "max_tokens": 8192,
-            "messages": [{"role": "user", "content": prompt}]
+            "messages": [{"role": "user", "content": self._user_content(prompt, model)}]
         }
 
-        response = requests.post(url, headers=headers, json=payload, timeout=120)
+        response, data = self._post(url, payload, headers, timeout=120, kind="text", model=model)
 
         if response.status_code != 200:
             raise Exception(f"Anthropic API Error: {response.status_code} - {response.text[:200]}")
-
-        data = response.json()
         return data["content"][0]["text"]
 
-    def generate_image(self, prompt: str, output_path: str = None, model: str = None) -> Dict:
+    def stream_text(self, prompt: str, model: str = None, json_mode: bool = False,
+                    schema: Dict = None) -> Iterator[str]:
+        model = model or self.config.get("text_model", "claude-sonnet-4-20250514")
+        url = f"{self.base_url}/messages"
+
+        headers = {
+            "Content-Type": "application/json",
+            "x-api-key": self.api_key,
+            "anthropic-version": "2023-06-01"
+        }
+
+        # JSON模式：与 _generate_json_text 相同，预填 "{"
+        prefill = json_mode and (not schema or schema.get("type") == "object")
+        messages = [{"role": "user", "content": self._user_content(prompt, model)}]
+        if prefill:
+            messages.append({"role": "assistant", "content": "{"})
+
+        payload = {
+            "model": model,
+            "max_tokens": 8192,
+            "messages": messages,
+            "stream": True
+        }
+
+        def parse_line(line: str, usage: Dict) -> Optional[str]:
+            data = _sse_json(line)
+            if not data:
+                return None
+            event = data.get("type")
+            if event == "message_start":
+                usage.update(self._parse_usage(data.get("message", {})))
+            elif event == "message_delta":
+                usage["output_tokens"] = (data.get("usage") or {}).get("output_tokens", 0)
+            elif event == "content_block_delta":
+                return (data.get("delta") or {}).get("text")
+            return None
+
+        chunks = self._stream(url, payload, headers, timeout=120, model=model, parse_line=parse_line)
+        if not prefill:
+            return chunks
+        return _prepend("{", chunks)
+
+    def _generate_json_text(self, prompt: str, schema: Dict = None, model: str = None) -> Optional[str]:
+        # 没有原生JSON模式：预填 assistant 回合的开头，让模型直接续写 JSON 对象
+        if schema and schema.get("type") != "object":
+            return None
+
+        model = model or self.config.get("text_model", "claude-sonnet-4-20250514")
+        url = f"{self.base_url}/messages"
+
+        headers = {
+            "Content-Type": "application/json",
+            "x-api-key": self.api_key,
+            "anthropic-version": "2023-06-01"
+        }
+
+        payload = {
+            "model": model,
+            "max_tokens": 8192,
+            "messages": [
+                {"role": "user", "content": self._user_content(prompt, model)},
+                {"role": "assistant", "content": "{"}
+            ]
+        }
+
+        response, data = self._post(url, payload, headers, timeout=120, kind="text", model=model)
+
+        if self._json_mode_unsupported(response.status_code, response.text):
+            # 模型不支持预填 assistant 回合
+            return None
+        if response.status_code != 200:
+            raise Exception(f"Anthropic API Error: {response.status_code} - {response.text[:200]}")
+        return "{" + data["content"][0]["text"]
+
+    def generate_image(self, prompt: str, output_path: str = None, model: str = None,
+                       image_size: str = None, seed: int = None) -> Dict:
         # Claude不支持图像生成
         return {"success": False, "error": "Anthropic Claude does not support image generation"}
 
 
 class OllamaProvider(BaseProvider):
-    """Ollama 本地模型提供商"""
+    """
+    Ollama 本地模型提供商
 
-    def generate_text(self, prompt: str, model: str = None) -> str:
-        model = model or self.config.get("text_model", "llama3")
-        url = f"{self.base_url}/generate"
+    每个请求带 keep_alive，模型在调用间保持加载；num_ctx 按提示词长度选择；
+    同时在途的请求数以 num_parallel 为上限，与服务端的并行槽位一致，多出的请求在本地排队
+    """
+
+    provider_id = "ollama"
+    json_mode_errors = ("format",)
+
+    def __init__(self, config: Dict):
+        super().__init__(config)
+        self.slots = max(1, int(config.get("num_parallel", 1)))
+        self._slots = threading.BoundedSemaphore(self.slots)
+        self._num_ctx: Dict[str, int] = {}
+        self._num_ctx_lock = threading.Lock()
+
+    def is_available(self) -> bool:
+        # 本地服务无需 API Key
+        return self.config.get("enabled", False)
 
+    @property
+    def max_concurrency(self) -> int:
+        return self.slots
+
+    def _parse_usage(self, data: Dict) -> Dict:
+        return {
+            "input_tokens": data.get("prompt_eval_count", 0),
+            "output_tokens": data.get("eval_count", 0)
+        }
+
+    def _context_size(self, prompt: str, model: str) -> int:
+        """
+        按提示词长度选择 num_ctx
+
+        取能容纳提示词与输出预留的最小 2 的幂（不超过上限）。num_ctx 变化会让服务端重新加载模型，
+        因此同一模型只增不减：较短的提示词沿用已加载的窗口
+        """
+        needed = estimate_tokens(str(prompt)) + self.config.get("num_ctx_reserve", 2048)
+        size = self.config.get("num_ctx_min", 2048)
+        while size < needed:
+            size *= 2
+        size = min(size, self.config.get("num_ctx_max", 32768))
+        with self._num_ctx_lock:
+            size = max(size, self._num_ctx.get(model, 0))
+            self._num_ctx[model] = size
+        return size
+
+    def _payload(self, prompt: str, model: str, stream: bool, format_: Any = None) -> Dict:
         payload = {
             "model": model,
             "prompt": prompt,
-            "stream": False
+            "stream": stream,
+            "keep_alive": self.config.get("keep_alive", "30m"),
+            "options": {"num_ctx": self._context_size(prompt, model)}
         }
+        if format_:
+            payload["format"] = format_
+        return payload
+
+    def _acquire_slot(self):
+        """占用一个并行槽位，槽位已满时等待并计数"""
+        if not self._slots.acquire(blocking=False):
+            metrics.incr("ollama_slot_waits")
+            self._slots.acquire()
+
+    def _post(self, url: str, payload: Dict, headers: Dict = None, timeout: int = 120,
+              kind: str = "text", model: str = None) -> Tuple[requests.Response, Optional[Dict]]:
+        self._acquire_slot()
+        try:
+            return super()._post(url, payload, headers, timeout, kind, model)
+        finally:
+            self._slots.release()
+
+    def _stream(self, url: str, payload: Dict, headers: Dict = None, timeout: int = 120,
+                model: str = None, parse_line: Callable[[str, Dict], Optional[str]] = None) -> Iterator[str]:
+        # 槽位在首次取块时占用，流结束或被关闭时释放
+        self._acquire_slot()
+        try:
+            yield from super()._stream(url, payload, headers, timeout, model, parse_line)
+        finally:
+            self._slots.release()
 
-        response = requests.post(url, json=payload, timeout=300)
+    def generate_text(self, prompt: str, model: str = None) -> str:
+        model = model or self.config.get("text_model", "llama3")
+        url = f"{self.base_url}/generate"
+
+        payload = self._payload(prompt, model, stream=False)
+
+        response, data = self._post(url, payload, timeout=300, kind="text", model=model)
 
         if response.status_code != 200:
             raise Exception(f"Ollama API Error: {response.status_code} - {response.text[:200]}")
+        return data.get("response", "")
+
+    def stream_text(self, prompt: str, model: str = None, json_mode: bool = False,
+                    schema: Dict = None) -> Iterator[str]:
+        model = model or self.config.get("text_model", "llama3")
+        url = f"{self.base_url}/generate"
+
+        payload = self._payload(prompt, model, stream=True, format_=(schema or "json") if json_mode else None)
+
+        def parse_line(line: str, usage: Dict) -> Optional[str]:
+            # 每行一个 JSON 对象，最后一行 done=true 时带 token 统计
+            data = json.loads(line)
+            if data.get("done"):
+                usage.update(self._parse_usage(data))
+            return data.get("response")
+
+        return self._stream(url, payload, timeout=300, model=model, parse_line=parse_line)
+
+    def _generate_json_text(self, prompt: str, schema: Dict = None, model: str = None) -> Optional[str]:
+        model = model or self.config.get("text_model", "llama3")
+        url = f"{self.base_url}/generate"
 
-        data = response.json()
+        # 新版本支持传入 JSON Schema，旧版本只支持 "json"
+        payload = self._payload(prompt, model, stream=False, format_=schema or "json")
+
+        response, data = self._post(url, payload, timeout=300, kind="text", model=model)
+
+        if self._json_mode_unsupported(response.status_code, response.text):
+            # 旧版本不接受 JSON Schema 形式的 format
+            return None
+        if response.status_code != 200:
+            raise Exception(f"Ollama API Error: {response.status_code} - {response.text[:200]}")
         return data.get("response", "")
 
-    def generate_image(self, prompt: str, output_path: str = None, model: str = None) -> Dict:
+    def generate_image(self, prompt: str, output_path: str = None, model: str = None,
+                       image_size: str = None, seed: int = None) -> Dict:
         return {"success": False, "error": "Ollama does not support image generation"}
 
 
 class StabilityProvider(BaseProvider):
     """Stability AI 提供商（仅图像）"""
 
+    provider_id = "stability"
+
     def generate_text(self, prompt: str, model: str = None) -> str:
         return ""  # Stability AI 不支持文本生成
 
-    def generate_image(self, prompt: str, output_path: str = None, model: str = None) -> Dict:
+    def generate_image(self, prompt: str, output_path: str = None, model: str = None,
+                       image_size: str = None, seed: int = None) -> Dict:
         model = model or self.config.get("image_model", "stable-diffusion-xl-1024-v1-0")
         url = f"{self.base_url}/generation/{model}/text-to-image"
 
@@ -331,21 +1102,17 @@ class StabilityProvider(BaseProvider):
             "steps": 30,
             "samples": 1
         }
+        if seed is not None:
+            payload["seed"] = seed
 
-        response = requests.post(url, headers=headers, json=payload, timeout=180)
+        response, data = self._post(url, payload, headers, timeout=180, kind="image", model=model)
 
         if response.status_code != 200:
             raise Exception(f"Stability API Error: {response.status_code} - {response.text[:200]}")
-
-        data = response.json()
         image_data = data["artifacts"][0]["base64"]
 
         if output_path:
-            if not output_path.endswith(".png"):
-                output_path = f"{output_path}.png"
-
-            with open(output_path, "wb") as f:
-                f.write(base64.b64decode(image_data))
+            output_path = save_image(image_data, "image/png", output_path)
 
         return {
             "success": True,
@@ -456,32 +1223,76 @@ class GeminiClient:
     def image_provider(self) -> BaseProvider:
         return ProviderFactory.get_image_provider(self.image_provider_id)
 
-    def generate_text(self, prompt: str, model: str = None) -> str:
-        """生成文本"""
+    def text_provider_for(self, stage: str = None) -> Tuple[Optional[BaseProvider], Optional[str]]:
+        """
+        某阶段使用的文本提供商与模型（STAGE_MODELS）
+
+        Returns:
+            (提供商, 模型)；模型为 None 时使用提供商的 text_model。
+            配置的提供商不可用而回退到其他提供商时，配置的模型随之作废
+        """
+        provider_id, model = parse_model_spec(STAGE_MODELS.get(stage)) if stage else (None, None)
+        if provider_id:
+            provider = ProviderFactory.get_provider(provider_id)
+            if provider and provider.is_available():
+                return provider, model
+            model = None
+
+        # 未指定提供商，或指定的不可用：使用客户端的文本提供商（它本身也可能回退到其他提供商）
         provider = self.text_provider
+        if provider and provider.provider_id != self.text_provider_id:
+            model = None
+        return provider, model
+
+    def _resolve(self, stage: str = None, model: str = None) -> Tuple[BaseProvider, Optional[str]]:
+        """解析阶段的提供商与模型（显式传入的模型优先）"""
+        provider, stage_model = self.text_provider_for(stage)
         if not provider:
             raise Exception("No text provider available")
-        return provider.generate_text(prompt, model)
+        return provider, model or stage_model
+
+    @staticmethod
+    def _in_stage(stage: str = None):
+        """把调用的延迟归属到该阶段（/models 与 metrics.json 据此按阶段统计）"""
+        return metrics.in_stage(stage) if stage else nullcontext()
+
+    def generate_text(self, prompt: str, model: str = None, stage: str = None) -> str:
+        """生成文本（stage 为 STAGE_MODELS 中的阶段名，决定使用的提供商与模型）"""
+        provider, model = self._resolve(stage, model)
+        with self._in_stage(stage):
+            return provider.generate_text(prompt, model)
+
+    def generate_json(self, prompt: str, schema: Dict = None, model: str = None,
+                      on_item: Callable[[Any], None] = None, item_key: str = None, stage: str = None) -> Any:
+        """生成结构化JSON（原生JSON模式优先，否则提取器兜底；传入 on_item 时流式交付数组元素）"""
+        provider, model = self._resolve(stage, model)
+        with self._in_stage(stage):
+            return provider.generate_json(prompt, schema, model, on_item=on_item, item_key=item_key)
+
+    def stream_text(self, prompt: str, model: str = None, stage: str = None) -> Iterator[str]:
+        """流式生成文本"""
+        provider, model = self._resolve(stage, model)
+        return provider.stream_text(prompt, model)
 
-    def generate_image(self, prompt: str, output_path: str = None, model: str = None) -> Dict:
+    def generate_image(self, prompt: str, output_path: str = None, model: str = None,
+                       image_size: str = None, seed: int = None) -> Dict:
         """生成图像"""
         provider = self.image_provider
         if not provider:
             raise Exception("No image provider available")
-        return provider.generate_image(prompt, output_path, model)
+        return provider.generate_image(prompt, output_path, model, image_size=image_size, seed=seed)
 
-    def generate_with_images(self, prompt: str, images: list, model: str = None) -> str:
+    def generate_with_images(self, prompt: str, images: list, model: str = None, stage: str = None) -> str:
         """多模态生成：文本+图像输入"""
-        provider = self.text_provider
-        if not provider:
-            raise Exception("No text provider available")
-
-        # 检查是否支持多模态
-        if hasattr(provider, 'generate_with_images'):
-            return provider.generate_with_images(prompt, images, model)
-        else:
-            # 降级为纯文本
-            return provider.generate_text(prompt + "\n\n[Note: Images provided but not supported by this provider]", model)
+        provider, model = self._resolve(stage, model)
+
+        with self._in_stage(stage):
+            # 检查是否支持多模态
+            if hasattr(provider, 'generate_with_images'):
+                return provider.generate_with_images(prompt, images, model)
+            else:
+                # 降级为纯文本
+                return provider.generate_text(prompt + "\n\n[Note: Images provided but not supported by this provider]", model)
 
     def set_text_provider(self, provider_id: str):
         """设置文本提供商"""
@@ -0,0 +1,347 @@
+"""
+Batch API - 提供商批处理接口
+离线批量模式（bulk.py）把同一阶段所有文章的请求合并为一个批次提交，完成后一次取回。
+批处理接口通常在 24 小时内完成、价格约为交互调用的一半（BATCH_PRICE_FACTOR）。
+
+请求统一为中立格式，由各后端转换为提供商的格式：
+    {"id", "kind": "json", "prompt", "schema"}
+    {"id", "kind": "image", "prompt", "image_size", "seed"}
+提交后得到批次记录 {"id", "backend", "kind", "model", "bytes", "submitted_at", "state", "raw_state"}，可写入状态文件，
+进程重启后凭它继续轮询和取回；结果为 {请求ID: {"text"} | {"image_data", "mime_type"} | {"error"}}
+"""
+
+import io
+import json
+import time
+import uuid
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Tuple
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from config import BULK_LOCAL_DELAY
+from lib import metrics, tracing
+from lib.api import BaseProvider, GoogleProvider, OpenAIProvider
+
+# 批次状态
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+
+class BatchError(Exception):
+    """批次提交或取回失败"""
+
+
+class BatchBackend:
+    """批处理后端基类"""
+
+    name = "base"
+    kinds = ("json",)  # 支持的请求类型
+
+    def __init__(self, provider: BaseProvider):
+        self.provider = provider
+
+    def submit(self, requests_: List[Dict], kind: str, label: str, model: str = None) -> Dict:
+        """
+        提交一个批次（同一批次内的请求类型相同）
+
+        Args:
+            model: 使用的模型，为 None 时使用提供商的 text_model/image_model
+
+        Returns:
+            批次记录
+        """
+        raise NotImplementedError
+
+    def poll(self, batch: Dict) -> Tuple[str, str]:
+        """
+        查询批次状态
+
+        Returns:
+            (RUNNING/COMPLETED/FAILED, 提供商原始状态)
+        """
+        raise NotImplementedError
+
+    def results(self, batch: Dict) -> Dict[str, Dict]:
+        """取回已完成批次的结果 {请求ID: 结果}"""
+        raise NotImplementedError
+
+    def _model(self, kind: str) -> str:
+        return self.provider.config.get("image_model" if kind == "image" else "text_model", "")
+
+    def _batch(self, batch_id: str, kind: str, model: str, size: int) -> Dict:
+        # state/raw_state 由轮询更新，初始为已提交、尚无提供商状态
+        return {"id": batch_id, "backend": self.name, "kind": kind, "model": model,
+                "bytes": size, "submitted_at": time.time(), "state": RUNNING, "raw_state": None}
+
+    def _request(self, method: str, url: str, headers: Dict, timeout: int = 120, **kwargs) -> requests.Response:
+        """发送批处理管理请求（非 200 时抛出 BatchError）"""
+        response = self.provider.session.request(method, url, headers=headers, timeout=timeout, **kwargs)
+        if response.status_code != 200:
+            raise BatchError(f"{self.provider.name} Batch API Error: {response.status_code} - {response.text[:200]}")
+        return response
+
+    def _record(self, batch: Dict, usage: Dict, response_bytes: int, images: int = 0):
+        """记录一个批次的用量（按批处理价格计费，耗时为提交到取回的周转时间）"""
+        metrics.record_call(
+            provider=self.provider.provider_id,
+            model=batch["model"],
+            kind="batch",
+            duration_s=time.time() - batch["submitted_at"],
+            request_bytes=batch["bytes"],
+            response_bytes=response_bytes,
+            usage=usage,
+            status=200,
+            images=images
+        )
+
+
+def _add_usage(total: Dict, usage: Dict):
+    for key, value in usage.items():
+        total[key] = total.get(key, 0) + value
+
+
+class GeminiBatch(BatchBackend):
+    """Gemini batchGenerateContent（请求内联提交，结果内联或以文件返回）"""
+
+    name = "gemini"
+    kinds = ("json", "image")
+
+    @property
+    def _headers(self) -> Dict:
+        return {"Content-Type": "application/json", "X-goog-api-key": self.provider.api_key}
+
+    def submit(self, requests_: List[Dict], kind: str, label: str, model: str = None) -> Dict:
+        model = model or self._model(kind)
+        items = []
+        for req in requests_:
+            if kind == "image":
+                body = GoogleProvider.image_payload(req["prompt"], req.get("image_size"), req.get("seed"))
+            else:
+                body = {
+                    "contents": [{"parts": [{"text": str(req["prompt"])}]}],
+                    "generationConfig": GoogleProvider._json_generation_config(req.get("schema"))
+                }
+            items.append({"request": body, "metadata": {"key": req["id"]}})
+
+        payload = {"batch": {"display_name": label, "input_config": {"requests": {"requests": items}}}}
+        body = json.dumps(payload).encode("utf-8")
+        response = self._request("POST", f"{self.provider.base_url}/models/{model}:batchGenerateContent",
+                                 self._headers, timeout=300, data=body)
+        return self._batch(response.json()["name"], kind, model, len(body))
+
+    def _get(self, batch: Dict) -> Dict:
+        data = self._request("GET", f"{self.provider.base_url}/{batch['id']}", self._headers).json()
+        if "metadata" not in data:
+            return data
+        # 以长时操作返回：元数据即批次本身，完成后结果在 response 中
+        return {**data["metadata"], **({"output": data["response"]} if "response" in data else {})}
+
+    def poll(self, batch: Dict) -> Tuple[str, str]:
+        state = self._get(batch).get("state", "")
+        if state.endswith("SUCCEEDED"):
+            return COMPLETED, state
+        if state.endswith(("FAILED", "CANCELLED", "EXPIRED")):
+            return FAILED, state
+        return RUNNING, state
+
+    def results(self, batch: Dict) -> Dict[str, Dict]:
+        output = self._get(batch).get("output", {})
+        if output.get("responsesFile"):
+            url = f"{self.provider.base_url.replace('/v1beta', '/download/v1beta')}/{output['responsesFile']}:download"
+            text = self._request("GET", url, self._headers, timeout=300, params={"alt": "media"}).text
+            lines = [json.loads(line) for line in text.splitlines() if line.strip()]
+            entries = [(line.get("key"), line) for line in lines]
+        else:
+            text = json.dumps(output)
+            entries = [((e.get("metadata") or {}).get("key"), e)
+                       for e in output.get("inlinedResponses", {}).get("inlinedResponses", [])]
+
+        results, usage, images = {}, {}, 0
+        for key, entry in entries:
+            if "error" in entry:
+                results[key] = {"error": entry["error"].get("message", str(entry["error"]))}
+                continue
+            data = entry.get("response", {})
+            _add_usage(usage, self.provider._parse_usage(data))
+            image = GoogleProvider.parse_image(data)
+            if image:
+                images += 1
+                results[key] = image
+            elif batch["kind"] == "image":
+                results[key] = {"error": "No image in response"}
+            else:
+                results[key] = {"text": GoogleProvider.parse_text(data)}
+
+        self._record(batch, usage, len(text), images)
+        return results
+
+
+class OpenAIBatch(BatchBackend):
+    """OpenAI Batch API（JSONL 上传为文件，结果以文件返回；仅支持 chat/completions）"""
+
+    name = "openai"
+    kinds = ("json",)
+
+    @property
+    def _headers(self) -> Dict:
+        return {"Authorization": f"Bearer {self.provider.api_key}"}
+
+    def submit(self, requests_: List[Dict], kind: str, label: str, model: str = None) -> Dict:
+        model = model or self._model(kind)
+        lines = [json.dumps({
+            "custom_id": req["id"],
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": model,
+                "messages": [{"role": "user", "content": str(req["prompt"])}],
+                "response_format": OpenAIProvider._response_format(req.get("schema"))
+            }
+        }, ensure_ascii=False) for req in requests_]
+        body = "\n".join(lines).encode("utf-8")
+
+        upload = self._request("POST", f"{self.provider.base_url}/files", self._headers, timeout=300,
+                               data={"purpose": "batch"},
+                               files={"file": (f"{label}.jsonl", io.BytesIO(body), "application/jsonl")})
+        payload = {
+            "input_file_id": upload.json()["id"],
+            "endpoint": "/v1/chat/completions",
+            "completion_window": "24h",
+            "metadata": {"description": label}
+        }
+        response = self._request("POST", f"{self.provider.base_url}/batches",
+                                 {**self._headers, "Content-Type": "application/json"}, data=json.dumps(payload))
+        return self._batch(response.json()["id"], kind, model, len(body))
+
+    def _get(self, batch: Dict) -> Dict:
+        return self._request("GET", f"{self.provider.base_url}/batches/{batch['id']}", self._headers).json()
+
+    def poll(self, batch: Dict) -> Tuple[str, str]:
+        status = self._get(batch).get("status", "")
+        if status == "completed":
+            return COMPLETED, status
+        if status in ("failed", "expired", "cancelled"):
+            return FAILED, status
+        return RUNNING, status
+
+    def results(self, batch: Dict) -> Dict[str, Dict]:
+        data = self._get(batch)
+        text = ""
+        for file_id in (data.get("output_file_id"), data.get("error_file_id")):
+            if file_id:
+                text += self._request("GET", f"{self.provider.base_url}/files/{file_id}/content",
+                                      self._headers, timeout=300).text + "\n"
+
+        results, usage = {}, {}
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            response = entry.get("response") or {}
+            if entry.get("error") or response.get("status_code") != 200:
+                error = entry.get("error") or (response.get("body") or {}).get("error") or response
+                results[entry["custom_id"]] = {"error": str(error.get("message", error))}
+                continue
+            data = response["body"]
+            _add_usage(usage, self.provider._parse_usage(data))
+            results[entry["custom_id"]] = {"text": data["choices"][0]["message"]["content"]}
+
+        self._record(batch, usage, len(text))
+        return results
+
+
+class LocalBatch(BatchBackend):
+    """
+    本地替身：模拟批处理接口的提交/轮询/取回，批次在提交 delay 秒后的首次轮询时同步执行
+    （同时在途的请求数为提供商的 max_concurrency）。
+    用于测试，以及不提供批处理接口的提供商（Anthropic、Ollama 等）和 OpenAI 的图像请求
+    """
+
+    name = "local"
+    kinds = ("json", "image")
+
+    def __init__(self, provider: BaseProvider, root: Path, delay: float = BULK_LOCAL_DELAY):
+        super().__init__(provider)
+        self.root = Path(root)
+        self.delay = delay
+
+    def _dir(self, batch_id: str) -> Path:
+        return self.root / batch_id
+
+    def submit(self, requests_: List[Dict], kind: str, label: str, model: str = None) -> Dict:
+        batch = self._batch(f"local-{label}-{uuid.uuid4().hex[:8]}", kind, model or self._model(kind), 0)
+        directory = self._dir(batch["id"])
+        directory.mkdir(parents=True, exist_ok=True)
+        # 提示词可能是 PrefixedPrompt，落盘后只保留完整文本
+        data = {"kind": kind, "submitted_at": batch["submitted_at"],
+                "requests": [{**req, "prompt": str(req["prompt"])} for req in requests_]}
+        (directory / "requests.json").write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+        return batch
+
+    def poll(self, batch: Dict) -> Tuple[str, str]:
+        directory = self._dir(batch["id"])
+        if (directory / "results.json").exists():
+            return COMPLETED, "done"
+        try:
+            data = json.loads((directory / "requests.json").read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            return FAILED, "missing"
+        if time.time() - data["submitted_at"] < self.delay:
+            return RUNNING, "queued"
+
+        model = batch["model"] or None
+
+        def run(req: Dict) -> Dict:
+            try:
+                if data["kind"] == "image":
+                    image = self.provider.generate_image(req["prompt"], None, model,
+                                                         image_size=req.get("image_size"), seed=req.get("seed"))
+                    return ({"image_data": image["image_data"], "mime_type": image["mime_type"]}
+                            if image.get("success") else {"error": image.get("error", "生成失败")})
+                value = self.provider.generate_json(req["prompt"], req.get("schema"), model)
+                return {"text": json.dumps(value, ensure_ascii=False)}
+            except Exception as e:
+                return {"error": str(e)}
+
+        # 提供商允许并发（如 Ollama 的并行槽位）时同时执行多个请求
+        workers = max(1, min(self.provider.max_concurrency, len(data["requests"])))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="local-batch") as pool:
+            futures = {req["id"]: tracing.submit(pool, run, req) for req in data["requests"]}
+            results = {req_id: future.result() for req_id, future in futures.items()}
+
+        tmp = directory / ".results.json.tmp"
+        tmp.write_text(json.dumps(results, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(directory / "results.json")
+        return COMPLETED, "done"
+
+    def results(self, batch: Dict) -> Dict[str, Dict]:
+        # 各请求已作为普通调用记录遥测，这里不再重复记录
+        return json.loads((self._dir(batch["id"]) / "results.json").read_text(encoding="utf-8"))
+
+
+BACKENDS = {"gemini": GeminiBatch, "openai": OpenAIBatch}
+
+
+def batch_backend(provider: BaseProvider, kind: str, local_root: Path, local: bool = False,
+                  name: str = None) -> BatchBackend:
+    """
+    选择批处理后端：提供商有批处理接口且支持该请求类型时使用之，否则使用本地替身
+
+    Args:
+        provider: 文本或图像提供商
+        kind: "json" / "image"
+        local_root: 本地替身的批次目录
+        local: 强制使用本地替身
+        name: 指定后端（继续轮询已提交的批次时传入批次记录中的 backend）
+    """
+    if name is None and not local:
+        name = {GoogleProvider: "gemini", OpenAIProvider: "openai"}.get(type(provider))
+    backend_class = BACKENDS.get(name)
+    if backend_class and kind in backend_class.kinds:
+        return backend_class(provider)
+    return LocalBatch(provider, local_root)
@@ -0,0 +1,147 @@
+"""
+Image Cache - 内容寻址的图像缓存
+键为 (完整提示词, 提供商, 模型, 宽高比, 尺寸) 的哈希；命中时硬链接（或复制）到本次运行的 images/，
+按磁盘配额以最近最少使用顺序淘汰
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from config import IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES
+
+MIME_TYPES = {".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".webp": "image/webp"}
+
+
+class ImageCache:
+    """磁盘图像缓存（线程安全，多进程下依赖原子重命名）"""
+
+    def __init__(self, root: Path = IMAGE_CACHE_DIR, max_bytes: int = IMAGE_CACHE_MAX_BYTES):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._size = None  # 首次写入时统计
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(prompt: str, provider: str, model: str, aspect_ratio: str, image_size: str) -> str:
+        """计算缓存键"""
+        payload = json.dumps([prompt, provider, model, aspect_ratio, image_size], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _find(self, key: str) -> Optional[Path]:
+        folder = self.root / key[:2]
+        for ext in MIME_TYPES:
+            path = folder / f"{key}{ext}"
+            if path.exists():
+                return path
+        return None
+
+    def get(self, key: str, output_path: str) -> Optional[Dict]:
+        """
+        查找缓存，命中时把图像放到 output_path（不含扩展名）
+
+        Returns:
+            与 generate_image 相同格式的结果（带 cached=True），未命中返回 None
+        """
+        cached = self._find(key)
+        if cached is None:
+            return None
+
+        dest = Path(f"{output_path}{cached.suffix}")
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            _link_or_copy(cached, dest)
+            os.utime(cached)  # 标记为最近使用
+        except FileNotFoundError:
+            return None  # 恰好被其他进程淘汰
+
+        return {
+            "success": True,
+            "output_path": str(dest),
+            "mime_type": MIME_TYPES[cached.suffix],
+            "cached": True
+        }
+
+    def put(self, key: str, image_path: str):
+        """把新生成的图像存入缓存"""
+        src = Path(image_path)
+        if not src.exists() or src.suffix.lower() not in MIME_TYPES:
+            return
+
+        folder = self.root / key[:2]
+        target = folder / f"{key}{src.suffix.lower()}"
+        tmp = folder / f".{key}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            folder.mkdir(parents=True, exist_ok=True)
+            _link_or_copy(src, tmp)
+            os.replace(tmp, target)
+        except OSError as e:
+            # 缓存只是优化，写入失败不影响本次生成
+            print(f"⚠ 图像缓存写入失败: {e}")
+            return
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += target.stat().st_size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        for path in self.root.glob("*/*"):
+            if path.suffix in MIME_TYPES:
+                try:
+                    yield path, path.stat()
+                except FileNotFoundError:
+                    continue
+
+    def _scan_size(self) -> int:
+        return sum(st.st_size for _, st in self._entries())
+
+    def _evict(self):
+        """按最近使用时间淘汰，直到降到配额的 90%"""
+        entries = sorted(self._entries(), key=lambda e: e[1].st_mtime)
+        total = sum(st.st_size for _, st in entries)
+        target = int(self.max_bytes * 0.9)
+        for path, st in entries:
+            if total <= target:
+                break
+            try:
+                path.unlink()
+                total -= st.st_size
+            except FileNotFoundError:
+                pass
+        self._size = total
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            shutil.rmtree(self.root, ignore_errors=True)
+            self._size = 0
+
+
+def _link_or_copy(src: Path, dest: Path):
+    """
+    优先硬链接（不占额外空间），跨设备等情况下退回复制
+
+    缓存条目与输出文件可能共享同一 inode：图像写入方（lib.api.save_image）均写临时文件后原子替换，
+    重新生成同名图像时只会断开链接，不会改写缓存中的内容
+    """
+    if dest.exists():
+        dest.unlink()
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copy2(src, dest)
+
+
+# 全局缓存实例
+image_cache = ImageCache()
@@ -0,0 +1,141 @@
+"""
+Image Prep - 多模态调用前的图片预处理
+把图片缩放到长边上限并重新编码（无透明通道用 JPEG，有透明通道用 PNG），在线程池中并行处理；
+结果按 (文件内容哈希, 参数) 缓存在磁盘上，重复的 /learn 直接复用
+"""
+
+import io
+import os
+import base64
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from config import LEARN_IMAGE_MAX_EDGE, LEARN_IMAGE_QUALITY, IMAGE_PREP_WORKERS, IMAGE_PREP_CACHE_DIR
+from lib import metrics
+from lib import tracing
+from lib.image_cache import MIME_TYPES
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# 上传时支持的原图格式（不可缩放时按原样发送）
+SOURCE_MIME_TYPES = {**MIME_TYPES, ".gif": "image/gif"}
+
+
+class ImagePreparer:
+    """图片预处理器（线程安全）"""
+
+    def __init__(self, max_edge: int = LEARN_IMAGE_MAX_EDGE, quality: int = LEARN_IMAGE_QUALITY,
+                 cache_dir: Path = IMAGE_PREP_CACHE_DIR, workers: int = IMAGE_PREP_WORKERS):
+        self.max_edge = max_edge
+        self.quality = quality
+        self.cache_dir = Path(cache_dir)
+        self.workers = workers
+        self._warned = False
+        self._lock = threading.Lock()
+
+    def _cache_path(self, digest: str) -> Optional[Path]:
+        folder = self.cache_dir / digest[:2]
+        for ext in (".jpg", ".png"):
+            path = folder / f"{digest}{ext}"
+            if path.exists():
+                return path
+        return None
+
+    def _encode(self, path: Path) -> Tuple[bytes, str]:
+        """缩放并重新编码，返回 (图片字节, 扩展名)"""
+        with Image.open(path) as img:
+            img.thumbnail((self.max_edge, self.max_edge))  # 只缩小不放大
+            has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+            buf = io.BytesIO()
+            if has_alpha:
+                img.save(buf, "PNG", optimize=True)
+                return buf.getvalue(), ".png"
+            img.convert("RGB").save(buf, "JPEG", quality=self.quality, optimize=True)
+            return buf.getvalue(), ".jpg"
+
+    def prepare(self, path: Path) -> Dict:
+        """
+        预处理单张图片
+
+        Args:
+            path: 图片路径
+
+        Returns:
+            {"mime_type", "data"}（data 为 base64），可直接传给 generate_with_images
+        """
+        path = Path(path)
+        raw = path.read_bytes()
+        metrics.incr("image_prep_bytes_in", len(raw))
+
+        if Image is None:
+            with self._lock:
+                if not self._warned:
+                    print("⚠ 未安装 Pillow，图片将按原尺寸上传 (pip install Pillow)")
+                    self._warned = True
+            metrics.incr("image_prep_bytes_out", len(raw))
+            return {"mime_type": SOURCE_MIME_TYPES.get(path.suffix.lower(), "image/jpeg"),
+                    "data": base64.b64encode(raw).decode("utf-8")}
+
+        params = f"{self.max_edge}:{self.quality}".encode()
+        digest = hashlib.sha256(raw + params).hexdigest()
+
+        cached = self._cache_path(digest)
+        if cached:
+            metrics.incr("image_prep_cache_hits")
+            data, ext = cached.read_bytes(), cached.suffix
+        else:
+            data, ext = self._encode(path)
+            # 原图本来就小且编码更紧凑时保留原图
+            if len(data) >= len(raw) and path.suffix.lower() in (".jpg", ".jpeg", ".png"):
+                data, ext = raw, (".png" if path.suffix.lower() == ".png" else ".jpg")
+            self._store(digest, data, ext)
+
+        metrics.incr("image_prep_bytes_out", len(data))
+        return {"mime_type": MIME_TYPES[ext], "data": base64.b64encode(data).decode("utf-8")}
+
+    def _store(self, digest: str, data: bytes, ext: str):
+        folder = self.cache_dir / digest[:2]
+        tmp = folder / f".{digest}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            folder.mkdir(parents=True, exist_ok=True)
+            tmp.write_bytes(data)
+            os.replace(tmp, folder / f"{digest}{ext}")
+        except OSError as e:
+            # 缓存只是优化，写入失败不影响本次调用
+            print(f"⚠ 图片预处理缓存写入失败: {e}")
+
+    def prepare_many(self, paths: List[Path]) -> List[Tuple[Path, Optional[Dict], Optional[str]]]:
+        """
+        并行预处理多张图片，保持输入顺序
+
+        Returns:
+            [(路径, 图片数据或 None, 错误信息或 None), ...]
+        """
+        paths = [Path(p) for p in paths]
+        if not paths:
+            return []
+
+        with tracing.span("image_prep", count=len(paths)):
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(paths))) as pool:
+                futures = [tracing.submit(pool, self.prepare, p) for p in paths]
+
+            results = []
+            for path, future in zip(paths, futures):
+                try:
+                    results.append((path, future.result(), None))
+                except Exception as e:
+                    results.append((path, None, str(e)))
+            return results
+
+
+# 全局预处理器
+image_preparer = ImagePreparer()
@@ -0,0 +1,139 @@
+"""
+Image Similarity - 本地图像相似度（感知哈希 + 颜色直方图）
+用于 /learn 验证的预筛：明显相符或明显不符的生成结果无需多模态模型评分
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from config import PRESCREEN_ACCEPT_SCORE, PRESCREEN_REJECT_SCORE, IMAGE_PREP_WORKERS
+from lib import metrics
+from lib import tracing
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+HASH_BITS = 64
+HIST_LEVELS = 4      # 每个颜色通道的分档数，共 4^3 = 64 个直方图格
+HASH_WEIGHT = 0.35   # 结构（哈希）与配色（直方图）的权重，风格比较更看重配色
+
+
+def available() -> bool:
+    """是否可以进行本地比较（需要 Pillow）"""
+    return Image is not None
+
+
+def fingerprint(path: Path) -> Dict:
+    """
+    计算图像指纹
+
+    Returns:
+        {"dhash": int, "ahash": int, "histogram": [float, ...]}
+    """
+    with Image.open(path) as img:
+        img.draft("RGB", (256, 256))  # JPEG 解码时直接降采样
+        img = img.convert("RGB")
+
+    gray = img.convert("L")
+
+    # dHash：相邻像素亮度梯度
+    pixels = gray.resize((9, 8), Image.BILINEAR).tobytes()
+    dhash = 0
+    for row in range(8):
+        for col in range(8):
+            dhash = (dhash << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+
+    # aHash：与平均亮度比较
+    pixels = gray.resize((8, 8), Image.BILINEAR).tobytes()
+    mean = sum(pixels) / HASH_BITS
+    ahash = 0
+    for value in pixels:
+        ahash = (ahash << 1) | (value > mean)
+
+    # 颜色直方图（归一化）
+    rgb = img.resize((64, 64), Image.BILINEAR).tobytes()
+    step = 256 // HIST_LEVELS
+    counts = [0] * HIST_LEVELS ** 3
+    for i in range(0, len(rgb), 3):
+        r, g, b = rgb[i] // step, rgb[i + 1] // step, rgb[i + 2] // step
+        counts[(r * HIST_LEVELS + g) * HIST_LEVELS + b] += 1
+    total = len(rgb) // 3
+
+    return {"dhash": dhash, "ahash": ahash, "histogram": [c / total for c in counts]}
+
+
+def similarity(a: Dict, b: Dict) -> Dict:
+    """
+    比较两个指纹
+
+    Returns:
+        {"score": 0-100, "hash": 0-1, "histogram": 0-1}
+    """
+    distance = (bin(a["dhash"] ^ b["dhash"]).count("1") + bin(a["ahash"] ^ b["ahash"]).count("1")) / 2
+    hash_sim = 1 - distance / HASH_BITS
+    hist_sim = sum(min(x, y) for x, y in zip(a["histogram"], b["histogram"]))
+    score = 100 * (HASH_WEIGHT * hash_sim + (1 - HASH_WEIGHT) * hist_sim)
+    return {"score": round(score, 1), "hash": round(hash_sim, 3), "histogram": round(hist_sim, 3)}
+
+
+def fingerprint_many(paths: List[Path]) -> List[Dict]:
+    """并行计算多张图像的指纹（保持输入顺序）"""
+    paths = [Path(p) for p in paths]
+    if not paths:
+        return []
+    with ThreadPoolExecutor(max_workers=min(IMAGE_PREP_WORKERS, len(paths))) as pool:
+        futures = [tracing.submit(pool, fingerprint, p) for p in paths]
+    return [f.result() for f in futures]
+
+
+def prescreen(original_paths: List[Path], generated_paths: List[Path],
+              accept: Optional[float] = PRESCREEN_ACCEPT_SCORE, reject: float = PRESCREEN_REJECT_SCORE,
+              original_prints: List[Dict] = None) -> Optional[Dict]:
+    """
+    本地预筛：每张生成图与最相近的原图比较，取平均分
+
+    Args:
+        original_paths: 原始示例图片
+        generated_paths: 新生成的图片
+        accept: 不低于该分数直接判定通过（None 表示从不直接通过）
+        reject: 不高于该分数直接判定不通过
+        original_prints: 预先计算好的原图指纹（与 original_paths 对应）
+
+    Returns:
+        {"score", "decision": "accept" | "reject" | "uncertain", "per_image": [...]}，
+        无法比较（未安装 Pillow 或图片无法读取）时返回 None
+    """
+    if not available() or not original_paths or not generated_paths:
+        return None
+
+    generated_paths = [Path(p) for p in generated_paths]
+    with tracing.span("learn.prescreen", count=len(original_paths) + len(generated_paths)):
+        try:
+            originals = original_prints or fingerprint_many(original_paths)
+            generated = fingerprint_many(generated_paths)
+        except Exception as e:
+            print(f"  ⚠ 本地预筛失败，改用模型评分: {e}")
+            return None
+
+    per_image = []
+    for path, fp in zip(generated_paths, generated):
+        best = max((similarity(fp, o) for o in originals), key=lambda s: s["score"])
+        per_image.append({"image": path.name, **best})
+
+    score = round(sum(s["score"] for s in per_image) / len(per_image), 1)
+    if accept is not None and score >= accept:
+        decision = "accept"
+    elif score <= reject:
+        decision = "reject"
+    else:
+        decision = "uncertain"
+    metrics.incr(f"prescreen_{decision}")
+
+    return {"score": score, "decision": decision, "per_image": per_image,
+            "thresholds": {"accept": accept, "reject": reject}}
@@ -0,0 +1,313 @@
+"""
+Job Store - 持久化批处理任务库（SQLite，无需外部服务）
+每篇文章一个任务，记录各阶段状态；工作者以租约领取任务并定期续约，
+租约过期（工作者崩溃或失联）的任务会被其他工作者接管。
+多台机器共享同一文件系统时指向同一个数据库文件即可协同处理。
+"""
+
+import json
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from config import BATCH_DB_PATH, BATCH_LEASE_SECONDS, BATCH_MAX_ATTEMPTS, BATCH_STATS_WINDOW
+from lib.jobs import QUEUED, RUNNING, DONE, FAILED
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id            INTEGER PRIMARY KEY AUTOINCREMENT,
+    article_path  TEXT NOT NULL UNIQUE,
+    output_dir    TEXT NOT NULL,
+    params        TEXT NOT NULL DEFAULT '{}',
+    status        TEXT NOT NULL,
+    stage         TEXT,
+    worker        TEXT,
+    lease_expires REAL,
+    attempts      INTEGER NOT NULL DEFAULT 0,
+    reclaims      INTEGER NOT NULL DEFAULT 0,
+    error         TEXT,
+    created_at    REAL NOT NULL,
+    started_at    REAL,
+    finished_at   REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, lease_expires);
+CREATE TABLE IF NOT EXISTS stages (
+    job_id     INTEGER NOT NULL,
+    stage      TEXT NOT NULL,
+    status     TEXT NOT NULL,
+    artifact   TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (job_id, stage)
+);
+"""
+
+
+class LeaseLost(Exception):
+    """租约已被其他工作者接管（在阶段回调中抛出，停止当前工作者上的流水线）"""
+
+
+class JobStore:
+    """
+    持久化任务库（线程安全，每个线程使用独立连接）
+
+    任务状态：queued → running（持有租约）→ done / failed；
+    失败且未达到最大尝试次数的任务重新排队
+    """
+
+    def __init__(self, path: Path = BATCH_DB_PATH, max_attempts: int = BATCH_MAX_ATTEMPTS):
+        self.path = Path(path)
+        self.max_attempts = max_attempts
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # 不使用 WAL：WAL 依赖共享内存，无法跨机器工作；默认回滚日志只需要文件锁
+            conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _write(self):
+        """写事务（BEGIN IMMEDIATE：事务开始即取得写锁，领取任务时不会被并发抢占）"""
+        db = self._conn()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _row(row: sqlite3.Row) -> Dict:
+        job = dict(row)
+        job["params"] = json.loads(job["params"] or "{}")
+        return job
+
+    def add(self, article_paths: Iterable[Path], output_root: Path, params: Dict = None) -> Tuple[int, int]:
+        """
+        添加文章（同一路径只入队一次）
+
+        Args:
+            article_paths: 文章路径
+            output_root: 输出根目录，每篇文章的输出为其下的 <文件名>_<编号>
+            params: 流水线参数（style、auto_learn、draft、generate_images）
+
+        Returns:
+            (新增数, 已存在而跳过的数)
+        """
+        added = skipped = 0
+        now = time.time()
+        with self._write() as db:
+            for path in article_paths:
+                path = Path(path).resolve()
+                cursor = db.execute(
+                    "INSERT OR IGNORE INTO jobs (article_path, output_dir, params, status, created_at) "
+                    "VALUES (?, '', ?, ?, ?)",
+                    (str(path), json.dumps(params or {}, ensure_ascii=False), QUEUED, now)
+                )
+                if cursor.rowcount:
+                    output_dir = Path(output_root).resolve() / f"{path.stem}_{cursor.lastrowid:05d}"
+                    db.execute("UPDATE jobs SET output_dir = ? WHERE id = ?", (str(output_dir), cursor.lastrowid))
+                    added += 1
+                else:
+                    skipped += 1
+        return added, skipped
+
+    def lease(self, worker: str, lease_seconds: float = BATCH_LEASE_SECONDS) -> Optional[Dict]:
+        """
+        领取一个任务：排队中的任务，或租约已过期的运行中任务（接管崩溃工作者的任务）
+
+        Returns:
+            任务字典，无可领取任务时返回 None
+        """
+        with self._write() as db:
+            now = time.time()
+            # 租约过期且已用完尝试次数的任务不再接管
+            db.execute(
+                "UPDATE jobs SET status = ?, error = ?, worker = NULL, lease_expires = NULL, finished_at = ? "
+                "WHERE status = ? AND lease_expires < ? AND attempts >= ?",
+                (FAILED, f"租约过期且已达最大尝试次数 ({self.max_attempts})", now, RUNNING, now, self.max_attempts)
+            )
+            row = db.execute(
+                "SELECT * FROM jobs WHERE status = ? OR (status = ? AND lease_expires < ?) ORDER BY id LIMIT 1",
+                (QUEUED, RUNNING, now)
+            ).fetchone()
+            if not row:
+                return None
+
+            reclaimed = row["status"] == RUNNING
+            db.execute(
+                "UPDATE jobs SET status = ?, worker = ?, lease_expires = ?, attempts = attempts + 1, "
+                "reclaims = reclaims + ?, started_at = ?, error = NULL WHERE id = ?",
+                (RUNNING, worker, now + lease_seconds, int(reclaimed), now, row["id"])
+            )
+            job = self._row(db.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone())
+
+        job["reclaimed"] = reclaimed
+        if reclaimed:
+            print(f"↺ 接管任务 #{job['id']}（原工作者 {row['worker']} 租约已过期）")
+        return job
+
+    def heartbeat(self, job_id: int, worker: str, lease_seconds: float = BATCH_LEASE_SECONDS) -> bool:
+        """续约，返回 False 表示租约已失效（任务已被接管）"""
+        with self._write() as db:
+            cursor = db.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE id = ? AND worker = ? AND status = ?",
+                (time.time() + lease_seconds, job_id, worker, RUNNING)
+            )
+            return cursor.rowcount == 1
+
+    def set_stage(self, job_id: int, worker: str, stage: str):
+        """记录任务进入某个阶段"""
+        now = time.time()
+        with self._write() as db:
+            db.execute("UPDATE jobs SET stage = ? WHERE id = ? AND worker = ?", (stage, job_id, worker))
+            db.execute(
+                "INSERT INTO stages (job_id, stage, status, artifact, updated_at) VALUES (?, ?, ?, NULL, ?) "
+                "ON CONFLICT (job_id, stage) DO UPDATE SET status = excluded.status, updated_at = excluded.updated_at",
+                (job_id, stage, RUNNING, now)
+            )
+
+    def sync_stages(self, job_id: int, artifacts: Dict[str, Path]):
+        """
+        按阶段产物同步阶段状态：产物存在的阶段为 done，其余仍为 running 的阶段为 failed
+
+        Args:
+            artifacts: {阶段名: 已存在的产物路径}
+        """
+        now = time.time()
+        with self._write() as db:
+            for stage, path in artifacts.items():
+                db.execute(
+                    "INSERT INTO stages (job_id, stage, status, artifact, updated_at) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (job_id, stage) DO UPDATE SET status = excluded.status, "
+                    "artifact = excluded.artifact, updated_at = excluded.updated_at",
+                    (job_id, stage, DONE, str(path), now)
+                )
+            db.execute("UPDATE stages SET status = ?, updated_at = ? WHERE job_id = ? AND status = ?",
+                       (FAILED, now, job_id, RUNNING))
+
+    def complete(self, job_id: int, worker: str) -> bool:
+        """标记完成（租约已被接管时返回 False，不覆盖新工作者的状态）"""
+        with self._write() as db:
+            cursor = db.execute(
+                "UPDATE jobs SET status = ?, worker = NULL, lease_expires = NULL, finished_at = ? "
+                "WHERE id = ? AND worker = ? AND status = ?",
+                (DONE, time.time(), job_id, worker, RUNNING)
+            )
+            return cursor.rowcount == 1
+
+    def fail(self, job_id: int, worker: str, error: str) -> Optional[str]:
+        """
+        标记本次尝试失败：未达到最大尝试次数时重新排队
+
+        Returns:
+            任务的新状态（queued / failed），租约已被接管时返回 None
+        """
+        now = time.time()
+        with self._write() as db:
+            row = db.execute("SELECT attempts FROM jobs WHERE id = ? AND worker = ? AND status = ?",
+                             (job_id, worker, RUNNING)).fetchone()
+            if not row:
+                return None
+            status = FAILED if row["attempts"] >= self.max_attempts else QUEUED
+            db.execute(
+                "UPDATE jobs SET status = ?, error = ?, worker = NULL, lease_expires = NULL, finished_at = ? "
+                "WHERE id = ?",
+                (status, error, now if status == FAILED else None, job_id)
+            )
+            return status
+
+    def release(self, job_id: int, worker: str) -> bool:
+        """主动归还租约（进程正常退出时），不计入尝试次数"""
+        with self._write() as db:
+            cursor = db.execute(
+                "UPDATE jobs SET status = ?, worker = NULL, lease_expires = NULL, attempts = attempts - 1 "
+                "WHERE id = ? AND worker = ? AND status = ?",
+                (QUEUED, job_id, worker, RUNNING)
+            )
+            return cursor.rowcount == 1
+
+    def retry_failed(self) -> int:
+        """把失败的任务重新排队（尝试次数清零），返回数量"""
+        with self._write() as db:
+            cursor = db.execute(
+                "UPDATE jobs SET status = ?, attempts = 0, error = NULL, finished_at = NULL WHERE status = ?",
+                (QUEUED, FAILED)
+            )
+            return cursor.rowcount
+
+    def get(self, job_id: int) -> Optional[Dict]:
+        """获取任务及其阶段状态"""
+        db = self._conn()
+        row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if not row:
+            return None
+        job = self._row(row)
+        job["stages"] = {r["stage"]: {"status": r["status"], "artifact": r["artifact"]}
+                         for r in db.execute("SELECT * FROM stages WHERE job_id = ?", (job_id,))}
+        return job
+
+    def list(self, status: str = None, limit: int = 100) -> List[Dict]:
+        """列出任务（可按状态过滤）"""
+        db = self._conn()
+        if status:
+            rows = db.execute("SELECT * FROM jobs WHERE status = ? ORDER BY id LIMIT ?", (status, limit))
+        else:
+            rows = db.execute("SELECT * FROM jobs ORDER BY id LIMIT ?", (limit,))
+        return [self._row(r) for r in rows]
+
+    def stats(self, window: float = BATCH_STATS_WINDOW) -> Dict:
+        """
+        队列统计
+
+        Returns:
+            各状态数量、队列深度（排队 + 租约过期待接管）、活跃工作者、
+            最近 window 秒的吞吐量（篇/分钟）、平均耗时、预计剩余时间、各阶段完成数
+        """
+        now = time.time()
+        db = self._conn()
+
+        counts = {status: 0 for status in (QUEUED, RUNNING, DONE, FAILED)}
+        for row in db.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status"):
+            counts[row["status"]] = row["n"]
+
+        expired = db.execute("SELECT COUNT(*) FROM jobs WHERE status = ? AND lease_expires < ?",
+                             (RUNNING, now)).fetchone()[0]
+        workers = [r[0] for r in db.execute(
+            "SELECT DISTINCT worker FROM jobs WHERE status = ? AND lease_expires >= ?", (RUNNING, now))]
+        recent = db.execute("SELECT COUNT(*) FROM jobs WHERE status = ? AND finished_at >= ?",
+                            (DONE, now - window)).fetchone()[0]
+        avg_duration = db.execute("SELECT AVG(finished_at - started_at) FROM jobs WHERE status = ?",
+                                  (DONE,)).fetchone()[0]
+        reclaims = db.execute("SELECT COALESCE(SUM(reclaims), 0) FROM jobs").fetchone()[0]
+
+        stages = {}
+        for row in db.execute("SELECT stage, status, COUNT(*) AS n FROM stages GROUP BY stage, status"):
+            stages.setdefault(row["stage"], {})[row["status"]] = row["n"]
+
+        queue_depth = counts[QUEUED] + expired
+        throughput = recent / (window / 60)
+        return {
+            **counts,
+            "queue_depth": queue_depth,
+            "expired_leases": expired,
+            "active_workers": workers,
+            "reclaims": reclaims,
+            "throughput_per_min": round(throughput, 2),
+            "window_s": window,
+            "avg_job_s": round(avg_duration, 1) if avg_duration else None,
+            "eta_s": round(queue_depth / throughput * 60) if throughput else None,
+            "stages": stages
+        }
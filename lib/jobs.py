@@ -0,0 +1,276 @@
+"""
+Jobs - 进程内任务队列
+有界队列 + 固定数量的工作线程，供 server.py、agent.py 的后台任务等执行流水线任务
+"""
+
+import io
+import time
+import uuid
+import queue
+import threading
+import traceback
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, TextIO
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from config import SERVER_WORKERS, SERVER_QUEUE_SIZE, SERVER_JOB_HISTORY
+
+# 任务状态
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+
+
+class QueueFull(Exception):
+    """排队任务已达上限"""
+
+
+class JobCancelled(Exception):
+    """运行中的任务被取消（在阶段回调中抛出）"""
+
+
+# 当前线程的输出去向（任务的 capture_output 缓冲或 route_output 指定的目标，经 tracing.submit 传播到子线程）
+_job_output: ContextVar[Optional[TextIO]] = ContextVar("concept_viz_job_output", default=None)
+
+
+class _OutputRouter:
+    """stdout 代理（全局唯一）：设置了输出去向的上下文写入各自的目标，其余照常输出"""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text: str) -> int:
+        buffer = _job_output.get()
+        return (buffer if buffer is not None else self.stream).write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def _install_output_router():
+    if not isinstance(sys.stdout, _OutputRouter):
+        sys.stdout = _OutputRouter(sys.stdout)
+
+
+@contextmanager
+def route_output(target: TextIO):
+    """
+    当前上下文（及经 tracing.submit 派生的线程）的 stdout 输出写入 target
+
+    Args:
+        target: 具有 write() 的对象
+    """
+    _install_output_router()
+    token = _job_output.set(target)
+    try:
+        yield
+    finally:
+        _job_output.reset(token)
+
+
+def current_output() -> TextIO:
+    """当前上下文输出的实际去向（所属任务的缓冲或控制台），不经过 stdout 代理"""
+    target = _job_output.get()
+    if target is not None:
+        return target
+    return sys.stdout.stream if isinstance(sys.stdout, _OutputRouter) else sys.stdout
+
+
+class JobQueue:
+    """
+    有界任务队列（线程安全）
+
+    handler(job_id, params, on_stage) 在工作线程中执行，返回结果字典；
+    抛出异常时任务标记为 failed。运行中的任务被取消后，下一次调用 on_stage 时抛出 JobCancelled；
+    不调用 on_stage 的任务提交时须声明 cancellable=False，开始运行后不接受取消
+    """
+
+    def __init__(self, handler: Callable[[str, Dict, Callable[[str], None]], Dict],
+                 workers: int = SERVER_WORKERS, max_pending: int = SERVER_QUEUE_SIZE,
+                 history: int = SERVER_JOB_HISTORY, capture_output: bool = False,
+                 on_finish: Callable[[Dict], None] = None):
+        """
+        Args:
+            handler: 任务处理函数
+            workers: 工作线程数
+            max_pending: 排队上限
+            history: 保留的已结束任务数
+            capture_output: 任务的 stdout 输出写入各自的日志（用 log() 读取），不打印到控制台
+            on_finish: 任务结束（完成/失败/取消）后的回调，参数为任务快照
+        """
+        self.handler = handler
+        self.workers = workers
+        self.history = history
+        self.max_pending = max_pending
+        self.capture_output = capture_output
+        self.on_finish = on_finish
+        self.started_at = time.time()
+        self._pending = queue.Queue()
+        self._jobs: "OrderedDict[str, Dict]" = OrderedDict()
+        self._logs: Dict[str, io.StringIO] = {}
+        self._lock = threading.Lock()
+        if capture_output:
+            _install_output_router()
+        self._threads = [
+            threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, params: Dict, cancellable: bool = True) -> Dict:
+        """
+        提交任务
+
+        Args:
+            params: 任务参数
+            cancellable: 处理函数是否在阶段之间调用 on_stage（否则运行中的任务无法取消）
+
+        Raises:
+            QueueFull: 排队任务已满
+        """
+        job = {
+            "id": uuid.uuid4().hex[:12],
+            "status": QUEUED,
+            "stage": None,
+            "params": params,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "error": None,
+            "cancellable": cancellable,
+            "cancel_requested": False
+        }
+        with self._lock:
+            queued = sum(1 for j in self._jobs.values() if j["status"] == QUEUED)
+            if queued >= self.max_pending:
+                raise QueueFull(f"排队任务已满 ({self.max_pending})")
+            self._jobs[job["id"]] = job
+        self._pending.put(job["id"])
+        return dict(job)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """获取任务快照"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def list(self) -> List[Dict]:
+        """列出所有任务（不含结果详情）"""
+        with self._lock:
+            return [{k: v for k, v in job.items() if k not in ("params", "result")}
+                    for job in self._jobs.values()]
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        取消任务：排队中的任务立即取消；运行中的任务在下一个阶段开始时停止
+
+        Returns:
+            是否已取消或已请求取消（任务已结束、或运行中且不可取消时返回 False）
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job or job["status"] not in (QUEUED, RUNNING):
+                return False
+            if job["status"] == RUNNING:
+                if not job["cancellable"]:
+                    return False
+                job["cancel_requested"] = True
+                return True
+            job["status"] = CANCELLED
+            job["finished_at"] = time.time()
+            return True
+
+    def log(self, job_id: str) -> Optional[str]:
+        """任务的输出（仅 capture_output 时记录）"""
+        with self._lock:
+            buffer = self._logs.get(job_id)
+            return buffer.getvalue() if buffer is not None else None
+
+    def stats(self) -> Dict:
+        """队列统计"""
+        with self._lock:
+            counts = {status: 0 for status in (QUEUED, RUNNING, DONE, FAILED, CANCELLED)}
+            for job in self._jobs.values():
+                counts[job["status"]] += 1
+        return {
+            **counts,
+            "workers": self.workers,
+            "queue_capacity": self.max_pending,
+            "uptime_s": round(time.time() - self.started_at, 1)
+        }
+
+    def _update(self, job_id: str, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+
+    def _prune(self):
+        """只保留最近 history 个已结束的任务"""
+        finished = [job_id for job_id, job in self._jobs.items() if job["status"] in (DONE, FAILED, CANCELLED)]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self._jobs[job_id]
+            self._logs.pop(job_id, None)
+
+    def _work(self):
+        while True:
+            job_id = self._pending.get()
+            if job_id is None:
+                break
+
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if not job or job["status"] != QUEUED:
+                    continue
+                job["status"] = RUNNING
+                job["started_at"] = time.time()
+                params = job["params"]
+                log = self._logs[job_id] = io.StringIO() if self.capture_output else None
+
+            token = _job_output.set(log)
+            try:
+                result = self.handler(job_id, params, lambda stage: self._on_stage(job_id, stage))
+                self._update(job_id, status=DONE, result=result, finished_at=time.time())
+            except JobCancelled:
+                self._update(job_id, status=CANCELLED, finished_at=time.time())
+            except Exception as e:
+                traceback.print_exc(file=log)
+                self._update(job_id, status=FAILED, error=str(e), finished_at=time.time())
+            finally:
+                _job_output.reset(token)
+
+            if self.on_finish:
+                self.on_finish(self.get(job_id))
+
+            with self._lock:
+                self._prune()
+
+    def _on_stage(self, job_id: str, stage: str):
+        """阶段进度回调：记录阶段，已请求取消时中止任务"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job:
+                return
+            if job["cancel_requested"]:
+                raise JobCancelled(job_id)
+            job["stage"] = stage
+
+    def shutdown(self, wait: bool = True):
+        """停止工作线程（尚未开始的任务标记为已取消，运行中的任务执行完毕）"""
+        with self._lock:
+            for job in self._jobs.values():
+                if job["status"] == QUEUED:
+                    job["status"] = CANCELLED
+                    job["finished_at"] = time.time()
+        for _ in self._threads:
+            self._pending.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
@@ -0,0 +1,460 @@
+"""
+JSON Utils - 模型输出的 JSON 提取、修复与校验
+所有技能共用：一次扫描定位最外层 JSON 值，修复常见缺陷，按 schema 校验，
+失败时只把出错的输出发回模型做一次低成本修复，而不是重跑整个阶段
+"""
+
+import re
+import json
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from lib import metrics
+
+
+class JSONExtractionError(ValueError):
+    """无法从模型输出中得到符合要求的 JSON"""
+
+    def __init__(self, message: str, raw_response: str = None):
+        super().__init__(message)
+        self.raw_response = raw_response
+
+
+REPAIR_PROMPT = '''你是一个JSON修复工具。下面这段模型输出本应是JSON，但无法解析或不符合期望结构。
+
+**问题：**
+{errors}
+
+**期望结构（JSON Schema）：**
+```json
+{schema}
+```
+
+**原始输出：**
+```
+{response}
+```
+
+请只修复格式与结构问题，保留原有内容，不要增删信息。
+请直接输出修复后的JSON，不要有任何其他文字。
+'''
+
+# 修复调用最多携带的原始输出长度（字符）
+REPAIR_MAX_CHARS = 60000
+
+_DECODER = json.JSONDecoder()
+_STRING_CHUNK = re.compile(r'[^"\\\x00-\x1f]+')
+# 字符串外的裸词（含中文说明文字）：除字面量外原样保留，该候选随之失败，
+# 退回到裸词前的最后一个完整元素或下一个起点
+_WORD = re.compile(r'\w+')
+_PY_LITERALS = {"True": "true", "False": "false", "None": "null"}
+_JSON_WORDS = {"true", "false", "null", "NaN", "Infinity"}
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+# =============================================================================
+# 提取
+# =============================================================================
+
+def extract_json(text: str, expect: str = None) -> Any:
+    """
+    从模型输出中提取最外层 JSON 值
+
+    先尝试在第一个 {/[ 处直接解码（忽略前后的说明文字和代码块标记）；
+    失败时逐字符扫描并在同一遍中修复：字符串内未转义的引号和换行、
+    尾随逗号、// 注释、Python 字面量 True/False/None、被截断的结尾
+
+    Args:
+        text: 模型输出
+        expect: 期望的起始字符 "{" 或 "["，为 None 时两者皆可
+
+    Returns:
+        解析后的 JSON 值
+
+    Raises:
+        JSONExtractionError: 无法提取
+    """
+    if not text or not text.strip():
+        raise JSONExtractionError("模型输出为空")
+
+    openers = expect or "{["
+    start = 0
+    fence = text.find("```json")
+    if fence != -1:
+        start = fence + len("```json")
+
+    last_error = "未找到 JSON 对象或数组"
+    for _ in range(5):
+        idx = _find_opener(text, openers, start)
+        if idx == -1 and start > 0:
+            # 代码块之后没有，再从头找一次
+            start = 0
+            idx = _find_opener(text, openers, 0)
+        if idx == -1:
+            break
+
+        try:
+            value, _ = _DECODER.raw_decode(text, idx)
+            return value
+        except json.JSONDecodeError:
+            pass
+
+        for candidate in _repair_candidates(text, idx):
+            try:
+                return json.loads(candidate)
+            except json.JSONDecodeError as e:
+                last_error = f"JSON解析失败: {e}"
+
+        start = idx + 1
+
+    raise JSONExtractionError(last_error)
+
+
+def _find_opener(text: str, openers: str, start: int) -> int:
+    positions = [p for p in (text.find(c, start) for c in openers) if p != -1]
+    return min(positions) if positions else -1
+
+
+def _repair_candidates(text: str, start: int) -> List[str]:
+    """从 start 处扫描一个 JSON 值，返回修复后的候选文本（按优先级）"""
+    out: List[str] = []
+    stack: List[str] = []
+    safe_point: Optional[Tuple[int, List[str]]] = None
+    # 第一个裸词之前的最后一个完整元素：值内夹杂说明文字时退回到此处
+    garbage_point: Optional[Tuple[int, List[str]]] = None
+    garbage = False
+    in_string = False
+    i = start
+    n = len(text)
+
+    while i < n:
+        ch = text[i]
+
+        if in_string:
+            m = _STRING_CHUNK.match(text, i)
+            if m:
+                out.append(m.group())
+                i = m.end()
+                continue
+            if ch == "\\":
+                out.append(text[i:i + 2])
+                i += 2
+                continue
+            if ch == '"':
+                # 只有后面紧跟结构字符时才视为字符串结束，否则是未转义的引号
+                j = i + 1
+                while j < n and text[j] in " \t\r\n":
+                    j += 1
+                if j >= n or text[j] in ",:}]":
+                    in_string = False
+                    out.append('"')
+                else:
+                    out.append('\\"')
+                i += 1
+                continue
+            # 字符串中的控制字符
+            out.append({"\n": "\\n", "\r": "\\r", "\t": "\\t"}.get(ch, f"\\u{ord(ch):04x}"))
+            i += 1
+            continue
+
+        if ch == '"':
+            in_string = True
+            out.append(ch)
+        elif ch in "{[":
+            stack.append(ch)
+            out.append(ch)
+        elif ch in "}]":
+            _strip_trailing_comma(out)
+            if stack:
+                out.append(_CLOSERS[stack.pop()])
+            if not stack:
+                candidates = ["".join(out)]
+                if garbage_point:
+                    candidates.append(_close(out[:garbage_point[0]], garbage_point[1]))
+                return candidates
+        elif ch == ",":
+            safe_point = (len(out), list(stack))
+            out.append(ch)
+        elif ch == "/" and text.startswith("//", i):
+            end = text.find("\n", i)
+            i = n if end == -1 else end
+            continue
+        elif ch.isalpha() or ch == "_":
+            word = _WORD.match(text, i).group()
+            word = _PY_LITERALS.get(word, word)
+            if word not in _JSON_WORDS and not garbage:
+                garbage, garbage_point = True, safe_point
+            out.append(word)
+            i += len(word)
+            continue
+        else:
+            out.append(ch)
+        i += 1
+
+    # 输出被截断：补全字符串与括号；若仍无效则退回到最后一个完整元素
+    if in_string:
+        out.append('"')
+    candidates = [_close(out, stack)]
+    if garbage_point:
+        candidates.append(_close(out[:garbage_point[0]], garbage_point[1]))
+    if safe_point:
+        candidates.append(_close(out[:safe_point[0]], safe_point[1]))
+    return candidates
+
+
+def _strip_trailing_comma(out: List[str]):
+    k = len(out) - 1
+    while k >= 0 and out[k].isspace():
+        k -= 1
+    if k >= 0 and out[k] == ",":
+        del out[k]
+
+
+def _close(out: List[str], stack: List[str]) -> str:
+    text = "".join(out).rstrip()
+    if text.endswith(","):
+        text = text[:-1]
+    elif text.endswith(":"):
+        text += " null"
+    return text + "".join(_CLOSERS[c] for c in reversed(stack))
+
+
+class JSONArrayStream:
+    """
+    增量解析流式输出：每当目标数组中的一个对象元素完整到达，就立即取出
+
+    用法：
+        stream = JSONArrayStream("designs")
+        for chunk in chunks:
+            for item in stream.feed(chunk):
+                ...
+        full_text = stream.text
+    """
+
+    def __init__(self, key: str = None):
+        """
+        Args:
+            key: 顶层对象中目标数组的字段名；为 None 时目标是顶层数组本身
+        """
+        self.key = key
+        self.text = ""
+        self._pos = 0
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_key = None
+        self._array_depth = None
+        self._item_start = None
+        self._done = False
+
+    def feed(self, chunk: str) -> List[Any]:
+        """追加一段输出，返回本次新完成的数组元素"""
+        self.text += chunk
+        if self._done:
+            return []
+
+        items = []
+        text = self.text
+        stack = self._stack
+        i = self._pos
+        n = len(text)
+
+        while i < n:
+            ch = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if len(stack) == 1 and self._array_depth is None:
+                        self._last_key = text[self._string_start + 1:i]
+                i += 1
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i
+            elif ch in "{[":
+                stack.append(ch)
+                depth = len(stack)
+                if self._array_depth is None:
+                    if ch == "[" and self._is_target(depth):
+                        self._array_depth = depth
+                elif depth == self._array_depth + 1:
+                    self._item_start = i
+            elif ch in "}]":
+                depth = len(stack)
+                if self._array_depth is not None:
+                    if depth == self._array_depth + 1 and self._item_start is not None:
+                        try:
+                            items.append(json.loads(text[self._item_start:i + 1]))
+                        except json.JSONDecodeError:
+                            pass  # 留给最终的完整解析/修复
+                        self._item_start = None
+                    elif depth == self._array_depth:
+                        self._done = True
+                        i += 1
+                        break
+                if stack:
+                    stack.pop()
+            i += 1
+
+        self._pos = i
+        return items
+
+    def _is_target(self, depth: int) -> bool:
+        if self.key is None:
+            return depth == 1
+        return depth == 2 and self._stack[0] == "{" and self._last_key == self.key
+
+
+# =============================================================================
+# 校验
+# =============================================================================
+
+def validate(data: Any, schema: Dict) -> List[str]:
+    """
+    按 JSON Schema 子集（type / required / properties / items / enum / minItems）校验，
+    并就地把可无损转换的标量（如 "8" → 8）转换为 schema 要求的类型
+
+    Returns:
+        错误列表，空列表表示通过
+    """
+    errors: List[str] = []
+    _check(data, schema, "$", errors)
+    return errors
+
+
+def _coerce(value: Any, expected: str) -> Tuple[bool, Any]:
+    if expected == "object":
+        return isinstance(value, dict), value
+    if expected == "array":
+        return isinstance(value, list), value
+    if expected == "string":
+        if isinstance(value, str):
+            return True, value
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return True, str(value)
+        return False, value
+    if expected in ("integer", "number"):
+        if isinstance(value, bool):
+            return False, value
+        if isinstance(value, int) or (expected == "number" and isinstance(value, float)):
+            return True, value
+        if isinstance(value, float) and value.is_integer():
+            return True, int(value)
+        if isinstance(value, str):
+            try:
+                number = float(value.strip())
+            except ValueError:
+                return False, value
+            if expected == "integer":
+                return number.is_integer(), int(number) if number.is_integer() else value
+            return True, number
+        return False, value
+    if expected == "boolean":
+        if isinstance(value, bool):
+            return True, value
+        if isinstance(value, str) and value.lower() in ("true", "false"):
+            return True, value.lower() == "true"
+        return False, value
+    if expected == "null":
+        return value is None, value
+    return True, value
+
+
+def _check(value: Any, schema: Dict, path: str, errors: List[str]) -> Any:
+    expected = schema.get("type")
+    if expected:
+        types = expected if isinstance(expected, list) else [expected]
+        for t in types:
+            ok, coerced = _coerce(value, t)
+            if ok:
+                value = coerced
+                break
+        else:
+            errors.append(f"{path}: 期望 {'/'.join(types)}，实际为 {type(value).__name__}")
+            return value
+
+    if "enum" in schema and value not in schema["enum"]:
+        errors.append(f"{path}: 取值 {value!r} 不在 {schema['enum']} 中")
+
+    if isinstance(value, dict):
+        for key in schema.get("required", []):
+            if key not in value:
+                errors.append(f"{path}: 缺少字段 {key}")
+        for key, sub in schema.get("properties", {}).items():
+            if key in value:
+                value[key] = _check(value[key], sub, f"{path}.{key}", errors)
+
+    if isinstance(value, list):
+        if len(value) < schema.get("minItems", 0):
+            errors.append(f"{path}: 至少需要 {schema['minItems']} 项")
+        if "items" in schema:
+            for i, item in enumerate(value):
+                value[i] = _check(item, schema["items"], f"{path}[{i}]", errors)
+
+    return value
+
+
+# =============================================================================
+# 统一入口
+# =============================================================================
+
+def parse_json_response(text: str, schema: Dict = None, repair_client=None, repair_model: str = None) -> Any:
+    """
+    解析模型输出：提取 → 校验 → （失败时）一次低成本修复调用
+
+    Args:
+        text: 模型输出
+        schema: 期望结构（JSON Schema 子集），为 None 时只做提取
+        repair_client: 提供 generate_text 的客户端；为 None 时不做修复调用
+        repair_model: 修复调用使用的模型（与原调用一致，按阶段分配的模型不会退回提供商默认模型）
+
+    Returns:
+        解析并校验通过的 JSON 值
+
+    Raises:
+        JSONExtractionError: 提取或校验失败（包括修复后仍失败）
+    """
+    expect = None
+    if schema and schema.get("type") in ("object", "array"):
+        expect = "{" if schema["type"] == "object" else "["
+
+    try:
+        data = extract_json(text, expect)
+        errors = validate(data, schema) if schema else []
+    except JSONExtractionError as e:
+        errors = [str(e)]
+
+    if not errors:
+        return data
+
+    if repair_client is None:
+        raise JSONExtractionError("; ".join(errors[:5]), raw_response=text)
+
+    print(f"  ↻ JSON有误，发起修复调用 ({errors[0]})")
+    metrics.incr("json_repair_calls")
+
+    prompt = REPAIR_PROMPT.format(
+        errors="\n".join(f"- {e}" for e in errors[:20]),
+        schema=json.dumps(schema or {}, ensure_ascii=False, indent=2),
+        response=text[:REPAIR_MAX_CHARS]
+    )
+    fixed = repair_client.generate_text(prompt, repair_model)
+
+    try:
+        data = extract_json(fixed, expect)
+        errors = validate(data, schema) if schema else []
+    except JSONExtractionError as e:
+        errors = [str(e)]
+    if errors:
+        metrics.incr("json_repair_failures")
+        raise JSONExtractionError("修复后仍不符合结构: " + "; ".join(errors[:5]), raw_response=text)
+    return data
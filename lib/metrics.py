@@ -0,0 +1,278 @@
+"""
+Run Metrics - 运行遥测
+记录每个阶段与每次模型调用的耗时、数据量、token 用量、缓存命中和成本估算
+"""
+
+import json
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Dict, List, Optional
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from config import MODEL_PRICING, BATCH_PRICE_FACTOR
+
+# 当前运行的收集器与阶段（按线程/任务上下文隔离）
+_current_run: ContextVar[Optional["RunMetrics"]] = ContextVar("concept_viz_run_metrics", default=None)
+_current_stage: ContextVar[Optional[str]] = ContextVar("concept_viz_stage", default=None)
+
+# 进程内最近的模型调用（不论有无收集器），供 /models 查看各阶段的延迟
+_recent_calls: deque = deque(maxlen=1000)
+
+
+def estimate_cost(model: str, usage: Dict, images: int = 0) -> float:
+    """
+    按 MODEL_PRICING 估算一次调用的成本（美元）
+
+    Args:
+        model: 模型名称
+        usage: 标准化后的 token 用量
+        images: 生成的图片数量
+
+    Returns:
+        成本估算，未知模型返回 0
+    """
+    pricing = MODEL_PRICING.get(model)
+    if not pricing:
+        return 0.0
+
+    if images and pricing.get("per_image") is not None:
+        return round(images * pricing["per_image"], 6)
+
+    input_tokens = usage.get("input_tokens", 0)
+    cached_tokens = usage.get("cached_tokens", 0)
+    output_tokens = usage.get("output_tokens", 0)
+    input_price = pricing.get("input", 0.0)
+    cached_price = pricing.get("cached_input", input_price)
+
+    cost = ((input_tokens - cached_tokens) * input_price
+            + cached_tokens * cached_price
+            + output_tokens * pricing.get("output", 0.0)) / 1_000_000
+    return round(cost, 6)
+
+
+class RunMetrics:
+    """单次运行的遥测数据（线程安全）"""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.stages: List[Dict] = []
+        self.calls: List[Dict] = []
+        self.counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        """记录一个阶段的耗时，阶段内的模型调用会归属到该阶段"""
+        record = {"stage": name, "started_at": time.time(), "duration_s": None, "status": "running"}
+        with self._lock:
+            self.stages.append(record)
+
+        token = _current_stage.set(name)
+        start = time.perf_counter()
+        try:
+            yield record
+            record["status"] = "ok"
+        except BaseException:
+            record["status"] = "error"
+            raise
+        finally:
+            record["duration_s"] = round(time.perf_counter() - start, 3)
+            _current_stage.reset(token)
+
+    def record_call(self, provider: str, model: str, kind: str, duration_s: float,
+                    request_bytes: int = 0, response_bytes: int = 0,
+                    usage: Dict = None, status: int = 200, images: int = 0) -> Dict:
+        """记录一次模型调用"""
+        call = self.make_call(provider, model, kind, duration_s, request_bytes, response_bytes, usage, status, images)
+        with self._lock:
+            self.calls.append(call)
+        return call
+
+    @staticmethod
+    def make_call(provider: str, model: str, kind: str, duration_s: float,
+                  request_bytes: int = 0, response_bytes: int = 0,
+                  usage: Dict = None, status: int = 200, images: int = 0) -> Dict:
+        """一次模型调用的记录（归属到上下文中的当前阶段）"""
+        usage = usage or {}
+        return {
+            "stage": _current_stage.get(),
+            "provider": provider,
+            "model": model,
+            "kind": kind,
+            "status": status,
+            "duration_s": round(duration_s, 3),
+            "request_bytes": request_bytes,
+            "response_bytes": response_bytes,
+            "input_tokens": usage.get("input_tokens", 0),
+            "output_tokens": usage.get("output_tokens", 0),
+            "cached_tokens": usage.get("cached_tokens", 0),
+            "images": images,
+            "cost_usd": round(estimate_cost(model, usage, images) * (BATCH_PRICE_FACTOR if kind == "batch" else 1), 6)
+        }
+
+    def incr(self, name: str, n: int = 1):
+        """累加计数器（缓存命中、重试等）"""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def summary(self) -> Dict:
+        """按阶段汇总"""
+        by_stage: Dict[str, Dict] = {}
+        for s in self.stages:
+            entry = by_stage.setdefault(s["stage"], {
+                "duration_s": 0.0, "calls": 0, "errors": 0,
+                "input_tokens": 0, "output_tokens": 0, "cached_tokens": 0,
+                "request_bytes": 0, "response_bytes": 0, "images": 0, "cost_usd": 0.0
+            })
+            entry["duration_s"] = round(entry["duration_s"] + (s["duration_s"] or 0), 3)
+
+        totals = {"calls": 0, "errors": 0, "input_tokens": 0, "output_tokens": 0,
+                  "cached_tokens": 0, "request_bytes": 0, "response_bytes": 0,
+                  "images": 0, "cost_usd": 0.0}
+        for c in self.calls:
+            targets = [totals]
+            if c["stage"] in by_stage:
+                targets.append(by_stage[c["stage"]])
+            for t in targets:
+                t["calls"] += 1
+                t["errors"] += 0 if c["status"] == 200 else 1
+                for key in ("input_tokens", "output_tokens", "cached_tokens",
+                            "request_bytes", "response_bytes", "images"):
+                    t[key] += c[key]
+                t["cost_usd"] = round(t["cost_usd"] + c["cost_usd"], 6)
+
+        totals["duration_s"] = round(time.time() - self.started_at, 3)
+        return {"totals": totals, "stages": by_stage, "models": model_latency(self.calls),
+                "counters": dict(self.counters)}
+
+    def to_dict(self) -> Dict:
+        return {
+            "started_at": self.started_at,
+            "summary": self.summary(),
+            "stages": self.stages,
+            "calls": self.calls
+        }
+
+    def save(self, path: Path):
+        """写入 metrics.json"""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+
+    def format_markdown(self) -> List[str]:
+        """生成报告中的遥测摘要"""
+        summary = self.summary()
+        totals = summary["totals"]
+        lines = [
+            "## ⏱ Run Metrics",
+            "",
+            "| Stage | Duration (s) | Calls | Input tokens | Output tokens | Cached tokens | Est. cost (USD) |",
+            "|-------|-------------|-------|--------------|---------------|---------------|-----------------|",
+        ]
+        for name, s in summary["stages"].items():
+            lines.append(f"| {name} | {s['duration_s']:.1f} | {s['calls']} | {s['input_tokens']} | "
+                         f"{s['output_tokens']} | {s['cached_tokens']} | {s['cost_usd']:.4f} |")
+        lines.append(f"| **total** | {totals['duration_s']:.1f} | {totals['calls']} | {totals['input_tokens']} | "
+                     f"{totals['output_tokens']} | {totals['cached_tokens']} | {totals['cost_usd']:.4f} |")
+        lines.append("")
+        if summary["models"]:
+            lines.extend([
+                "| Stage | Model | Calls | Avg (s) | p95 (s) | Output tokens/s |",
+                "|-------|-------|-------|---------|---------|-----------------|",
+            ])
+            for m in summary["models"]:
+                lines.append(f"| {m['stage'] or '-'} | {m['provider']}:{m['model']} | {m['calls']} | "
+                             f"{m['avg_s']:.2f} | {m['p95_s']:.2f} | {m['output_tokens_per_s']:.1f} |")
+            lines.append("")
+        if summary["counters"]:
+            lines.append("- Counters: " + ", ".join(f"{k}={v}" for k, v in summary["counters"].items()))
+        lines.append(f"- Data transferred: {totals['request_bytes'] / 1024:.0f} KB sent, "
+                     f"{totals['response_bytes'] / 1024:.0f} KB received")
+        lines.append("")
+        return lines
+
+
+def model_latency(calls: List[Dict]) -> List[Dict]:
+    """
+    按（阶段、提供商、模型）汇总调用延迟，用于调整 STAGE_MODELS（不含创建缓存与批处理调用）
+
+    Returns:
+        [{"stage", "provider", "model", "calls", "errors", "avg_s", "p50_s", "p95_s", "max_s",
+          "output_tokens_per_s", "cost_usd"}]
+    """
+    groups: Dict[tuple, List[Dict]] = {}
+    for c in calls:
+        if c["kind"] not in ("cache", "batch"):
+            groups.setdefault((c["stage"], c["provider"], c["model"]), []).append(c)
+
+    rows = []
+    for (stage, provider, model), group in groups.items():
+        durations = sorted(c["duration_s"] for c in group)
+        total = sum(durations)
+        rows.append({
+            "stage": stage,
+            "provider": provider,
+            "model": model,
+            "calls": len(group),
+            "errors": sum(1 for c in group if c["status"] != 200),
+            "avg_s": round(total / len(group), 3),
+            "p50_s": durations[len(durations) // 2],
+            "p95_s": durations[min(len(durations) - 1, int(len(durations) * 0.95))],
+            "max_s": durations[-1],
+            "output_tokens_per_s": round(sum(c["output_tokens"] for c in group) / total, 1) if total else 0.0,
+            "cost_usd": round(sum(c["cost_usd"] for c in group), 6)
+        })
+    return rows
+
+
+def recent_latency() -> List[Dict]:
+    """本进程最近调用的分阶段延迟（见 model_latency）"""
+    return model_latency(list(_recent_calls))
+
+
+# =============================================================================
+# 模块级接口：没有活动收集器时全部为空操作
+# =============================================================================
+
+@contextmanager
+def collect(metrics: RunMetrics = None):
+    """在当前上下文中激活一个收集器"""
+    metrics = metrics or RunMetrics()
+    token = _current_run.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current_run.reset(token)
+
+
+@contextmanager
+def in_stage(name: str):
+    """把上下文中的调用归属到某个阶段（不单独计时，用于提前在后台开始的工作）"""
+    token = _current_stage.set(name)
+    try:
+        yield
+    finally:
+        _current_stage.reset(token)
+
+
+def current() -> Optional[RunMetrics]:
+    """获取当前上下文的收集器"""
+    return _current_run.get()
+
+
+def record_call(**kwargs):
+    """记录一次模型调用（无收集器时只计入进程内的延迟统计）"""
+    metrics = current()
+    _recent_calls.append(metrics.record_call(**kwargs) if metrics else RunMetrics.make_call(**kwargs))
+
+
+def incr(name: str, n: int = 1):
+    """累加计数器（无收集器时忽略）"""
+    metrics = current()
+    if metrics:
+        metrics.incr(name, n)
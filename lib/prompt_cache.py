@@ -0,0 +1,207 @@
+"""
+Prompt Cache - 提供商侧提示词缓存的本地登记
+discover/map/design 的提示词拆为静态前缀（框架库、图表类型、样式规范、输出格式）与动态部分（文章、概念、映射）；
+Gemini 为前缀创建 cachedContents 并在之后的请求中引用其句柄，Anthropic 在前缀上标记 cache_control。
+本模块记录句柄及其过期时间（写入 PROMPT_CACHE_FILE，跨进程复用），避免重复创建
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from config import PROMPT_CACHE_ENABLED, PROMPT_CACHE_EXPLICIT, PROMPT_CACHE_MIN_TOKENS, PROMPT_CACHE_FILE
+from lib import metrics
+from lib.compress import estimate_tokens
+
+EXPIRY_MARGIN = 60  # 距过期不足这么多秒的句柄不再使用，避免请求途中过期
+EPHEMERAL_TTL = 300  # Anthropic ephemeral 缓存的存活时间，每次命中后重置
+
+
+class PrefixedPrompt(str):
+    """
+    带静态前缀的提示词
+
+    值为完整提示词（前缀 + 动态部分），不支持显式缓存的提供商当作普通字符串使用；
+    支持的提供商通过 prefix / body 分别发送两部分
+    """
+
+    prefix: str
+    body: str
+
+    def __new__(cls, prefix: str, body: str):
+        prompt = super().__new__(cls, prefix + body)
+        prompt.prefix = prefix
+        prompt.body = body
+        return prompt
+
+
+def split_prompt(prompt: str) -> Tuple[Optional[str], str]:
+    """
+    拆分提示词
+
+    Returns:
+        (可缓存的前缀, 其余部分)；普通字符串、未启用缓存或前缀过短时前缀为 None，其余部分为完整提示词
+    """
+    prefix = getattr(prompt, "prefix", None)
+    if not PROMPT_CACHE_ENABLED or not prefix or estimate_tokens(prefix) < PROMPT_CACHE_MIN_TOKENS:
+        return None, str(prompt)
+    return prefix, prompt.body
+
+
+class PromptCache:
+    """缓存句柄登记表（线程安全，多进程下依赖原子重命名，最坏情况是重复创建）"""
+
+    def __init__(self, path: Path = PROMPT_CACHE_FILE):
+        self.path = Path(path)
+        self._entries: Optional[Dict[str, Dict]] = None  # 首次使用时从文件加载
+        self._lock = threading.Lock()
+        self._creating: Dict[str, threading.Lock] = {}
+        # 是否创建显式缓存（Gemini cachedContents），默认关闭，见 enable_explicit()
+        self.explicit = bool(PROMPT_CACHE_EXPLICIT)
+
+    def enable_explicit(self):
+        """多篇文章共用前缀的入口（batch.py work、server.py）开启显式缓存，配置中明确关闭时除外"""
+        if PROMPT_CACHE_EXPLICIT is not False:
+            self.explicit = True
+
+    @staticmethod
+    def make_key(provider: str, model: str, prefix: str) -> str:
+        """计算缓存键"""
+        payload = json.dumps([provider, model, prefix], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+    def get_or_create(self, provider: str, model: str, prefix: str,
+                      create: Callable[[], Optional[Dict]]) -> Optional[str]:
+        """
+        查找前缀的缓存句柄，没有或已过期时调用 create 创建（同一前缀同时只创建一次）
+
+        Args:
+            create: 创建缓存，返回 {"handle": 句柄, "expires_at": 过期时间戳}；
+                    handle 为 None 表示该前缀不可缓存（到期前不再尝试），返回 None 表示暂时失败
+
+        Returns:
+            缓存句柄；不可缓存或创建失败时返回 None
+        """
+        key = self.make_key(provider, model, prefix)
+        with self._lock:
+            key_lock = self._creating.setdefault(key, threading.Lock())
+
+        with key_lock:
+            entry = self._lookup(key, reload=True)
+            if entry:
+                if entry["handle"]:
+                    metrics.incr("prompt_cache_hits")
+                return entry["handle"]
+
+            entry = create()
+            if entry is None:
+                return None
+            self._store(key, {
+                "provider": provider,
+                "model": model,
+                "handle": entry["handle"],
+                "tokens": estimate_tokens(prefix),
+                "created_at": time.time(),
+                "expires_at": entry["expires_at"]
+            })
+            if entry["handle"]:
+                metrics.incr("prompt_cache_writes")
+            return entry["handle"]
+
+    def touch(self, provider: str, model: str, prefix: str, ttl: float) -> bool:
+        """
+        记录一次隐式缓存（Anthropic cache_control）的使用：提供商在每次命中后重置存活时间
+
+        Returns:
+            本次请求前缓存是否仍在有效期内（即预计命中）
+        """
+        key = self.make_key(provider, model, prefix)
+        entry = self._lookup(key)
+        warm = entry is not None
+        now = time.time()
+        self._store(key, {
+            "provider": provider,
+            "model": model,
+            "handle": "ephemeral",
+            "tokens": estimate_tokens(prefix),
+            "created_at": entry["created_at"] if warm else now,
+            "expires_at": now + ttl
+        })
+        metrics.incr("prompt_cache_hits" if warm else "prompt_cache_writes")
+        return warm
+
+    def invalidate(self, handle: str):
+        """作废句柄（提供商报告缓存不存在或已过期时调用）"""
+        with self._lock:
+            entries = self._load()
+            for key in [k for k, e in entries.items() if e["handle"] == handle]:
+                del entries[key]
+            self._save()
+        metrics.incr("prompt_cache_invalidations")
+
+    def list(self) -> List[Dict]:
+        """列出有效的缓存（不含不可缓存的前缀）"""
+        now = time.time()
+        with self._lock:
+            return [dict(e) for e in self._load().values() if e["handle"] and e["expires_at"] > now]
+
+    def clear(self):
+        """清空本地登记（提供商侧的缓存到期后自动删除）"""
+        with self._lock:
+            self._entries = {}
+            self._save()
+
+    def _lookup(self, key: str, reload: bool = False) -> Optional[Dict]:
+        """有效的缓存条目；reload 时先合并其他进程写入的条目"""
+        with self._lock:
+            entry = self._load().get(key)
+            if reload and not self._valid(entry):
+                self._entries.update(self._read())
+                entry = self._entries.get(key)
+            return dict(entry) if self._valid(entry) else None
+
+    def _store(self, key: str, entry: Dict):
+        with self._lock:
+            self._load()[key] = entry
+            self._save()
+
+    @staticmethod
+    def _valid(entry: Optional[Dict]) -> bool:
+        return entry is not None and entry["expires_at"] - EXPIRY_MARGIN > time.time()
+
+    def _load(self) -> Dict[str, Dict]:
+        if self._entries is None:
+            self._entries = self._read()
+        return self._entries
+
+    def _read(self) -> Dict[str, Dict]:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                entries = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+        return {k: e for k, e in entries.items() if self._valid(e)}
+
+    def _save(self):
+        """写入文件（调用方持有锁），顺带清理已过期的条目"""
+        self._entries = {k: e for k, e in self._entries.items() if self._valid(e)}
+        tmp = self.path.with_name(f".{self.path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            # 登记只是优化，写入失败时本进程内仍然有效
+            print(f"⚠ 提示词缓存登记写入失败: {e}")
+
+
+# 全局实例
+prompt_cache = PromptCache()
@@ -3,8 +3,12 @@ Registry - 开放式注册系统
 管理理论框架、图表类型和模型提供商的动态加载
 """
 
+import os
 import yaml
+import threading
 import json
+import hashlib
+from collections import ChainMap
 from pathlib import Path
 from typing import Dict, Any, Optional
 import sys
@@ -16,10 +20,17 @@ from config import (
     DEFAULT_FRAMEWORKS, DEFAULT_CHART_TYPES, PROVIDERS,
     VISUAL_STYLES, DEFAULT_VISUAL_STYLE
 )
+from lib.tracing import traced
 
 
 class Registry:
-    """统一的注册管理器"""
+    """
+    统一的注册管理器
+
+    多个流水线可能在不同线程中同时读取和学习（服务模式、batch.py --learn、agent --bg）。
+    修改在锁内以写时复制进行：先复制字典再整体替换，正在遍历旧字典的读取方不受影响，
+    YAML 文件的写入也在同一把锁内串行
+    """
 
     _instance = None
 
@@ -37,6 +48,7 @@ class Registry:
         self.chart_types: Dict[str, Any] = {}
         self.providers: Dict[str, Any] = {}
         self.visual_styles: Dict[str, Any] = {}
+        self._lock = threading.RLock()
 
         self._load_all()
         self._initialized = True
@@ -70,32 +82,58 @@ class Registry:
 
         return items
 
+    @traced("registry.load")
     def _load_all(self):
         """加载所有配置"""
-        # 加载框架：先加载默认，再加载自定义（自定义覆盖默认）
-        self.frameworks = DEFAULT_FRAMEWORKS.copy()
-        custom_frameworks = self._load_yaml_files(FRAMEWORKS_DIR)
-        self.frameworks.update(custom_frameworks)
-
-        # 加载图表类型
-        self.chart_types = DEFAULT_CHART_TYPES.copy()
-        custom_charts = self._load_yaml_files(CHART_TYPES_DIR)
-        self.chart_types.update(custom_charts)
-
-        # 加载提供商配置
-        self.providers = PROVIDERS.copy()
-        custom_providers = self._load_yaml_files(PROVIDERS_DIR)
-        self.providers.update(custom_providers)
-
-        # 加载视觉风格
-        self.visual_styles = VISUAL_STYLES.copy()
-        custom_styles = self._load_yaml_files(VISUAL_STYLES_DIR)
-        self.visual_styles.update(custom_styles)
+        # 先在局部组装完整的字典再替换，其他线程看不到加载到一半的内容
+        # 框架：先加载默认，再加载自定义（自定义覆盖默认）
+        frameworks = {**DEFAULT_FRAMEWORKS, **self._load_yaml_files(FRAMEWORKS_DIR)}
+        chart_types = {**DEFAULT_CHART_TYPES, **self._load_yaml_files(CHART_TYPES_DIR)}
+        providers = {**PROVIDERS, **self._load_yaml_files(PROVIDERS_DIR)}
+        visual_styles = {**VISUAL_STYLES, **self._load_yaml_files(VISUAL_STYLES_DIR)}
+
+        with self._lock:
+            self.frameworks = frameworks
+            self.chart_types = chart_types
+            self.providers = providers
+            self.visual_styles = visual_styles
+
+    def _update(self, kind: str, items: Dict[str, Any] = None, remove: str = None):
+        """写时复制地更新一类条目（调用方持有锁）"""
+        store = dict(getattr(self, kind))
+        store.update(items or {})
+        if remove is not None:
+            store.pop(remove, None)
+        setattr(self, kind, store)
+
+    @staticmethod
+    def _persist(directory: Path, item_id: str, data: Dict):
+        """写入临时文件后重命名，读取方不会读到写了一半的 YAML（调用方持有锁）"""
+        directory.mkdir(parents=True, exist_ok=True)
+        tmp = directory / f".{item_id}.yaml.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                yaml.dump(data, f, allow_unicode=True, default_flow_style=False)
+            os.replace(tmp, directory / f"{item_id}.yaml")
+        finally:
+            tmp.unlink(missing_ok=True)
 
     def reload(self):
         """重新加载所有配置"""
         self._load_all()
 
+    def fingerprint(self, *kinds: str) -> str:
+        """
+        注册表内容指纹，用于判断依赖注册表的流水线阶段是否需要重跑
+
+        Args:
+            kinds: 参与计算的类别（frameworks / chart_types / visual_styles / providers）
+        """
+        with self._lock:
+            data = {kind: dict(getattr(self, kind)) for kind in kinds}
+        text = json.dumps(data, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
     # =========================================================================
     # 框架相关方法
     # =========================================================================
@@ -117,26 +155,27 @@ class Registry:
             framework_data: 框架数据
             persist: 是否持久化到文件
         """
-        self.frameworks[framework_id] = framework_data
-
-        if persist:
-            file_path = FRAMEWORKS_DIR / f"{framework_id}.yaml"
-            with open(file_path, "w", encoding="utf-8") as f:
-                yaml.dump(framework_data, f, allow_unicode=True, default_flow_style=False)
+        with self._lock:
+            if persist:
+                self._persist(FRAMEWORKS_DIR, framework_id, framework_data)
+            self._update("frameworks", {framework_id: framework_data})
 
     def remove_framework(self, framework_id: str):
         """移除框架"""
-        if framework_id in self.frameworks:
-            del self.frameworks[framework_id]
-            # 也删除文件
-            file_path = FRAMEWORKS_DIR / f"{framework_id}.yaml"
-            if file_path.exists():
-                file_path.unlink()
+        with self._lock:
+            if framework_id in self.frameworks:
+                self._update("frameworks", remove=framework_id)
+                # 也删除文件
+                file_path = FRAMEWORKS_DIR / f"{framework_id}.yaml"
+                if file_path.exists():
+                    file_path.unlink()
 
     def get_frameworks_for_prompt(self) -> str:
         """生成供LLM使用的框架描述"""
         lines = []
-        for fid, f in self.frameworks.items():
+        # 取一次引用：遍历期间其他线程的修改会替换字典而不是改动它
+        frameworks = self.frameworks
+        for fid, f in frameworks.items():
             lines.append(f"### {f.get('name', fid)} (ID: {fid})")
             lines.append(f"- 描述: {f.get('description', 'N/A')}")
             lines.append(f"- 关键词: {', '.join(f.get('keywords', []))}")
@@ -198,17 +237,16 @@ class Registry:
 
     def add_chart_type(self, chart_id: str, chart_data: Dict, persist: bool = False):
         """添加新图表类型"""
-        self.chart_types[chart_id] = chart_data
-
-        if persist:
-            file_path = CHART_TYPES_DIR / f"{chart_id}.yaml"
-            with open(file_path, "w", encoding="utf-8") as f:
-                yaml.dump(chart_data, f, allow_unicode=True, default_flow_style=False)
+        with self._lock:
+            if persist:
+                self._persist(CHART_TYPES_DIR, chart_id, chart_data)
+            self._update("chart_types", {chart_id: chart_data})
 
     def get_chart_types_for_prompt(self) -> str:
         """生成供LLM使用的图表类型描述"""
         lines = []
-        for cid, c in self.chart_types.items():
+        chart_types = self.chart_types
+        for cid, c in chart_types.items():
             lines.append(f"- **{cid}** ({c.get('name', cid)}): {c.get('description', 'N/A')}")
             lines.append(f"  适用于: {', '.join(c.get('best_for', []))}")
         return "\n".join(lines)
@@ -231,15 +269,18 @@ class Registry:
 
     def enable_provider(self, provider_id: str, api_key: str = None):
         """启用提供商"""
-        if provider_id in self.providers:
-            self.providers[provider_id]["enabled"] = True
-            if api_key:
-                self.providers[provider_id]["api_key"] = api_key
+        with self._lock:
+            if provider_id in self.providers:
+                config = dict(self.providers[provider_id], enabled=True)
+                if api_key:
+                    config["api_key"] = api_key
+                self._update("providers", {provider_id: config})
 
     def disable_provider(self, provider_id: str):
         """禁用提供商"""
-        if provider_id in self.providers:
-            self.providers[provider_id]["enabled"] = False
+        with self._lock:
+            if provider_id in self.providers:
+                self._update("providers", {provider_id: dict(self.providers[provider_id], enabled=False)})
 
     # =========================================================================
     # 视觉风格相关方法
@@ -256,12 +297,50 @@ class Registry:
 
     def add_visual_style(self, style_id: str, style_data: Dict, persist: bool = False):
         """添加新视觉风格"""
-        self.visual_styles[style_id] = style_data
+        with self._lock:
+            if persist:
+                self._persist(VISUAL_STYLES_DIR, style_id, style_data)
+            self._update("visual_styles", {style_id: style_data})
 
-        if persist:
-            file_path = VISUAL_STYLES_DIR / f"{style_id}.yaml"
-            with open(file_path, "w", encoding="utf-8") as f:
-                yaml.dump(style_data, f, allow_unicode=True, default_flow_style=False)
+    def add_many(self, frameworks: Dict = None, chart_types: Dict = None, visual_styles: Dict = None):
+        """
+        批量添加并持久化
+
+        先把所有条目写入临时文件，全部成功后再统一重命名为正式文件；
+        任一写入失败时清理临时文件并抛出异常，不会留下只写了一半的学习结果
+
+        Args:
+            frameworks: {框架ID: 框架数据}
+            chart_types: {图表ID: 图表数据}
+            visual_styles: {风格ID: 风格数据}
+        """
+        groups = [
+            ("frameworks", FRAMEWORKS_DIR, frameworks or {}),
+            ("chart_types", CHART_TYPES_DIR, chart_types or {}),
+            ("visual_styles", VISUAL_STYLES_DIR, visual_styles or {}),
+        ]
+
+        with self._lock:
+            staged = []
+            try:
+                for _, directory, items in groups:
+                    if items:
+                        directory.mkdir(parents=True, exist_ok=True)
+                    for item_id, data in items.items():
+                        tmp = directory / f".{item_id}.yaml.{os.getpid()}.tmp"
+                        staged.append((tmp, directory / f"{item_id}.yaml"))
+                        with open(tmp, "w", encoding="utf-8") as f:
+                            yaml.dump(data, f, allow_unicode=True, default_flow_style=False)
+            except Exception:
+                for tmp, _ in staged:
+                    tmp.unlink(missing_ok=True)
+                raise
+
+            for tmp, target in staged:
+                os.replace(tmp, target)
+            for kind, _, items in groups:
+                if items:
+                    self._update(kind, items)
 
     # =========================================================================
     # 导出/导入
@@ -269,27 +348,132 @@ class Registry:
 
     def export_all(self, output_path: str):
         """导出所有配置"""
-        data = {
-            "frameworks": self.frameworks,
-            "chart_types": self.chart_types,
-            "visual_styles": self.visual_styles
-        }
+        with self._lock:
+            data = {
+                "frameworks": dict(self.frameworks),
+                "chart_types": dict(self.chart_types),
+                "visual_styles": dict(self.visual_styles)
+            }
         with open(output_path, "w", encoding="utf-8") as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
 
-    def import_frameworks(self, file_path: str):
-        """从文件导入框架"""
+    @staticmethod
+    def _read_frameworks(file_path: str) -> Dict[str, Any]:
+        """读取待导入的框架文件（YAML 或 JSON），内容不是字典时返回空字典"""
         with open(file_path, "r", encoding="utf-8") as f:
             if file_path.endswith(".yaml") or file_path.endswith(".yml"):
                 data = yaml.safe_load(f)
             else:
                 data = json.load(f)
 
-        if isinstance(data, dict):
-            if "frameworks" in data:
-                self.frameworks.update(data["frameworks"])
-            else:
-                self.frameworks.update(data)
+        if not isinstance(data, dict):
+            return {}
+        return data["frameworks"] if "frameworks" in data else data
+
+    def import_frameworks(self, file_path: str):
+        """从文件导入框架"""
+        frameworks = self._read_frameworks(file_path)
+        if frameworks:
+            with self._lock:
+                self._update("frameworks", frameworks)
+
+
+
+class RegistryOverlay(Registry):
+    """
+    注册表的写时复制视图
+
+    读取时先查本层、再查底层注册表；写入只落在本层，底层注册表保持不变。
+    每个视图各自独立，可在 /learn 验证等场景下与其他任务并发使用，无需加锁或事后清理；
+    确认无误后用 commit() 把本层内容一次性写入底层注册表
+    """
+
+    def __new__(cls, base: Registry = None):
+        # 不参与 Registry 的单例
+        return object.__new__(cls)
+
+    def __init__(self, base: Registry = None):
+        self.base = base or registry
+        self._lock = self.base._lock
+        self._layers: Dict[str, Dict[str, Any]] = {
+            "frameworks": {}, "chart_types": {}, "providers": {}, "visual_styles": {}
+        }
+        self._initialized = True
+
+    # 底层注册表 reload 时会替换字典对象，因此每次访问都重新组装视图
+    @property
+    def frameworks(self) -> ChainMap:
+        return ChainMap(self._layers["frameworks"], self.base.frameworks)
+
+    @property
+    def chart_types(self) -> ChainMap:
+        return ChainMap(self._layers["chart_types"], self.base.chart_types)
+
+    @property
+    def providers(self) -> ChainMap:
+        return ChainMap(self._layers["providers"], self.base.providers)
+
+    @property
+    def visual_styles(self) -> ChainMap:
+        return ChainMap(self._layers["visual_styles"], self.base.visual_styles)
+
+    def reload(self):
+        """丢弃本层的所有修改"""
+        for layer in self._layers.values():
+            layer.clear()
+
+    def _add(self, kind: str, item_id: str, data: Dict, persist: bool):
+        if persist:
+            raise ValueError("RegistryOverlay 只在内存中生效，请通过 commit() 持久化")
+        self._layers[kind][item_id] = data
+
+    def add_framework(self, framework_id: str, framework_data: Dict, persist: bool = False):
+        """添加框架（仅本层）"""
+        self._add("frameworks", framework_id, framework_data, persist)
+
+    def add_chart_type(self, chart_id: str, chart_data: Dict, persist: bool = False):
+        """添加图表类型（仅本层）"""
+        self._add("chart_types", chart_id, chart_data, persist)
+
+    def add_visual_style(self, style_id: str, style_data: Dict, persist: bool = False):
+        """添加视觉风格（仅本层）"""
+        self._add("visual_styles", style_id, style_data, persist)
+
+    def add_many(self, frameworks: Dict = None, chart_types: Dict = None, visual_styles: Dict = None):
+        """批量添加（仅本层）"""
+        self._layers["frameworks"].update(frameworks or {})
+        self._layers["chart_types"].update(chart_types or {})
+        self._layers["visual_styles"].update(visual_styles or {})
+
+    def import_frameworks(self, file_path: str):
+        """从文件导入框架（仅本层）"""
+        self._layers["frameworks"].update(self._read_frameworks(file_path))
+
+    def remove_framework(self, framework_id: str):
+        """移除本层添加的框架（底层框架不受影响）"""
+        self._layers["frameworks"].pop(framework_id, None)
+
+    def enable_provider(self, provider_id: str, api_key: str = None):
+        """启用提供商（复制一份到本层再修改）"""
+        if provider_id in self.providers:
+            config = dict(self.providers[provider_id], enabled=True)
+            if api_key:
+                config["api_key"] = api_key
+            self._layers["providers"][provider_id] = config
+
+    def disable_provider(self, provider_id: str):
+        """禁用提供商（复制一份到本层再修改）"""
+        if provider_id in self.providers:
+            self._layers["providers"][provider_id] = dict(self.providers[provider_id], enabled=False)
+
+    def commit(self):
+        """把本层的框架、图表类型和视觉风格持久化到底层注册表，并清空本层"""
+        self.base.add_many(
+            frameworks=self._layers["frameworks"],
+            chart_types=self._layers["chart_types"],
+            visual_styles=self._layers["visual_styles"]
+        )
+        self.reload()
 
 
 # 单例实例
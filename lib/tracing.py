@@ -0,0 +1,266 @@
+"""
+Tracing - 可插拔的追踪与性能剖析钩子
+默认空操作；可替换为本地文件导出器、OpenTelemetry 适配器或自定义后端
+"""
+
+import json
+import time
+import uuid
+import functools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from config import TRACE_FILE
+
+
+class Span:
+    """一次被追踪的操作"""
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "attributes",
+                 "start_time", "end_time", "duration_s", "cpu_s", "status", "error",
+                 "thread", "backend_span")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Dict):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = dict(attributes)
+        self.start_time = time.time()
+        self.end_time = None
+        self.duration_s = None
+        self.cpu_s = None
+        self.status = "ok"
+        self.error = None
+        self.thread = threading.current_thread().name
+        self.backend_span = None  # 供适配器保存后端自己的 span 对象
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def to_dict(self) -> Dict:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "duration_s": self.duration_s,
+            "cpu_s": self.cpu_s,
+            "status": self.status,
+            "error": self.error,
+            "thread": self.thread,
+            "attributes": self.attributes
+        }
+
+
+class _NoopSpan:
+    """空操作 span（未启用追踪时使用，避免任何分配开销）"""
+
+    trace_id = None
+    span_id = None
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+# =============================================================================
+# 追踪器
+# =============================================================================
+
+class Tracer:
+    """追踪器基类：所有钩子默认为空操作，子类按需覆盖"""
+
+    enabled = False
+
+    def on_start(self, span: Span):
+        """span 开始时调用"""
+        pass
+
+    def on_end(self, span: Span):
+        """span 结束时调用（已包含耗时与CPU时间）"""
+        pass
+
+
+class FileExporter(Tracer):
+    """把结束的 span 以 JSON Lines 追加写入本地文件，便于离线分析"""
+
+    enabled = True
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def on_end(self, span: Span):
+        line = json.dumps(span.to_dict(), ensure_ascii=False, default=str)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+class CompositeTracer(Tracer):
+    """同时分发给多个追踪器"""
+
+    enabled = True
+
+    def __init__(self, *tracers: Tracer):
+        self.tracers = [t for t in tracers if t.enabled]
+
+    def on_start(self, span: Span):
+        for t in self.tracers:
+            t.on_start(span)
+
+    def on_end(self, span: Span):
+        for t in self.tracers:
+            t.on_end(span)
+
+
+class OpenTelemetryTracer(Tracer):
+    """OpenTelemetry 适配器（需要安装 opentelemetry-api）"""
+
+    enabled = True
+
+    def __init__(self, service_name: str = "concept-viz-agent"):
+        from opentelemetry import trace as otel_trace
+
+        self._otel = otel_trace
+        self._tracer = otel_trace.get_tracer(service_name)
+
+    def on_start(self, span: Span):
+        parent = _current_span.get()
+        context = None
+        if parent is not None and getattr(parent, "backend_span", None) is not None:
+            context = self._otel.set_span_in_context(parent.backend_span)
+        span.backend_span = self._tracer.start_span(span.name, context=context,
+                                                    attributes=_otel_attributes(span.attributes))
+
+    def on_end(self, span: Span):
+        backend = span.backend_span
+        if backend is None:
+            return
+        backend.set_attributes(_otel_attributes(span.attributes))
+        backend.set_attribute("cpu_s", span.cpu_s or 0.0)
+        if span.status == "error":
+            backend.set_status(self._otel.Status(self._otel.StatusCode.ERROR, span.error))
+        backend.end()
+
+
+def _otel_attributes(attributes: Dict) -> Dict:
+    """OpenTelemetry 只接受基础类型属性"""
+    return {k: v if isinstance(v, (str, bool, int, float)) else str(v)
+            for k, v in attributes.items() if v is not None}
+
+
+# =============================================================================
+# 模块级接口
+# =============================================================================
+
+_tracer: Tracer = Tracer()
+_current_span: ContextVar[Optional[Span]] = ContextVar("concept_viz_span", default=None)
+
+
+def set_tracer(tracer: Optional[Tracer]):
+    """安装全局追踪器（传入 None 恢复为空操作）"""
+    global _tracer
+    _tracer = tracer or Tracer()
+
+
+def get_tracer() -> Tracer:
+    """获取当前追踪器"""
+    return _tracer
+
+
+def current_trace_id() -> Optional[str]:
+    """当前上下文的 trace id（未启用追踪时为 None）"""
+    span = _current_span.get()
+    return span.trace_id if span else None
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    追踪一个操作
+
+    Args:
+        name: span 名称，如 "provider.text"、"skill.analyze"
+        attributes: 附加属性
+
+    Yields:
+        Span（未启用追踪时为空操作对象）
+    """
+    tracer = _tracer
+    if not tracer.enabled:
+        yield _NOOP_SPAN
+        return
+
+    parent = _current_span.get()
+    s = Span(
+        name,
+        trace_id=parent.trace_id if parent else uuid.uuid4().hex,
+        parent_id=parent.span_id if parent else None,
+        attributes=attributes
+    )
+    tracer.on_start(s)
+    token = _current_span.set(s)
+    start = time.perf_counter()
+    cpu_start = time.thread_time()
+    try:
+        yield s
+    except BaseException as e:
+        s.status = "error"
+        s.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        s.duration_s = round(time.perf_counter() - start, 6)
+        s.cpu_s = round(time.thread_time() - cpu_start, 6)
+        s.end_time = time.time()
+        _current_span.reset(token)
+        tracer.on_end(s)
+
+
+def traced(name: str = None):
+    """装饰器：追踪函数的每次调用"""
+    def decorator(fn: Callable) -> Callable:
+        span_name = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def submit(executor, fn: Callable, *args, **kwargs):
+    """
+    向线程池提交任务，并携带当前上下文（trace id、遥测收集器等）
+
+    concurrent.futures 不会自动传播 contextvars，所有并发路径都应通过此函数提交
+    """
+    return executor.submit(copy_context().run, fn, *args, **kwargs)
+
+
+def bind_context(fn: Callable) -> Callable:
+    """把当前上下文绑定到函数上，用于 threading.Thread 等手动创建的线程"""
+    ctx = copy_context()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        return ctx.copy().run(fn, *args, **kwargs)
+    return wrapper
+
+
+# 通过环境变量启用本地文件导出
+if TRACE_FILE:
+    set_tracer(FileExporter(TRACE_FILE))
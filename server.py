@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Concept Visualizer Server - 常驻服务模式
+进程常驻，注册表、HTTP 连接池和图像缓存保持热状态；通过本地 HTTP/JSON 接口提交文章、查询任务、获取产物
+
+Usage:
+    python server.py [--host=127.0.0.1] [--port=8765] [--workers=2]
+
+API:
+    POST   /jobs                          提交任务 {"article": "...", "style": "blueprint", ...}
+    GET    /jobs                          列出任务
+    GET    /jobs/<id>                     任务状态与结果
+    DELETE /jobs/<id>                     取消任务（运行中的任务在下一个阶段开始时停止）
+    GET    /jobs/<id>/artifacts           产物列表
+    GET    /jobs/<id>/artifacts/<路径>    下载产物
+    GET    /health                        健康检查与队列统计
+"""
+
+import sys
+import json
+import mimetypes
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Dict
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+from config import (SERVER_HOST, SERVER_PORT, SERVER_WORKERS, SERVER_QUEUE_SIZE, SERVER_JOBS_DIR,
+                    VISUAL_STYLES)
+from lib.registry import registry
+from lib.jobs import JobQueue, QueueFull
+from lib.prompt_cache import prompt_cache
+from skills import PipelineSkill
+
+MAX_BODY_BYTES = 10 * 1024 * 1024
+
+
+def run_job(job_id: str, params: Dict, on_stage: Callable[[str], None]) -> Dict:
+    """
+    执行一个流水线任务（在工作线程中调用）
+
+    Args:
+        job_id: 任务ID，同时作为输出目录名
+        params: 提交时的参数
+        on_stage: 阶段进度回调
+
+    Returns:
+        任务结果摘要
+    """
+    job_dir = SERVER_JOBS_DIR / job_id
+    job_dir.mkdir(parents=True, exist_ok=True)
+
+    if params.get("article"):
+        article_path = job_dir / "article.md"
+        article_path.write_text(params["article"], encoding="utf-8")
+    else:
+        article_path = Path(params["article_path"])
+
+    skill = PipelineSkill(
+        str(job_dir / "run"),
+        auto_learn=params.get("auto_learn", True),
+        style=params.get("style"),
+        interactive_style=False,
+        draft=bool(params.get("draft")),
+        fused=params.get("fused"),
+        compress=params.get("compress")
+    )
+    result = skill.run(str(article_path), generate_images=params.get("generate_images", True),
+                       on_stage=on_stage)
+
+    error = PipelineSkill.error_message(result)
+    if error:
+        raise RuntimeError(error)
+
+    images = result["steps"].get("generate") or []
+    return {
+        "output_dir": result["output_dir"],
+        "images": [{"title": r.get("title"), "success": r.get("success"), "path": r.get("output_path")}
+                   for r in images],
+        "metrics": skill.metrics.summary()["totals"]
+    }
+
+
+def validate_job(params: Dict) -> str:
+    """校验提交参数，返回错误信息（合法时返回空字符串）"""
+    if not isinstance(params, dict):
+        return "请求体必须是 JSON 对象"
+    if not params.get("article") and not params.get("article_path"):
+        return "需要提供 article（文章文本）或 article_path（服务器本地路径）"
+    if params.get("article") and not isinstance(params["article"], str):
+        return "article 必须是字符串"
+    if params.get("article_path") and not Path(params["article_path"]).is_file():
+        return f"文件不存在: {params['article_path']}"
+    style = params.get("style")
+    if style and style not in VISUAL_STYLES and style not in registry.visual_styles:
+        return f"未知样式: {style}"
+    return ""
+
+
+class APIHandler(BaseHTTPRequestHandler):
+    """HTTP/JSON 接口"""
+
+    server_version = "ConceptViz/1.0"
+
+    @property
+    def jobs(self) -> JobQueue:
+        return self.server.jobs
+
+    def _send_json(self, status: int, data):
+        body = json.dumps(data, ensure_ascii=False, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status: int, message: str):
+        self._send_json(status, {"error": message})
+
+    def _route(self) -> list:
+        return [part for part in self.path.split("?", 1)[0].split("/") if part]
+
+    def do_GET(self):
+        parts = self._route()
+
+        if parts == ["health"]:
+            return self._send_json(200, {"status": "ok", **self.jobs.stats()})
+
+        if parts == ["jobs"]:
+            return self._send_json(200, {"jobs": self.jobs.list()})
+
+        if len(parts) >= 2 and parts[0] == "jobs":
+            job = self.jobs.get(parts[1])
+            if not job:
+                return self._send_error(404, f"任务不存在: {parts[1]}")
+
+            if len(parts) == 2:
+                job.pop("params", None)
+                return self._send_json(200, job)
+
+            if parts[2] == "artifacts":
+                return self._send_artifact(parts[1], parts[3:])
+
+        self._send_error(404, f"未知路径: {self.path}")
+
+    def _send_artifact(self, job_id: str, rel_parts: list):
+        """产物列表或单个产物（限制在任务输出目录内）"""
+        run_dir = (SERVER_JOBS_DIR / job_id / "run").resolve()
+        if not run_dir.exists():
+            return self._send_error(404, "任务尚未产生输出")
+
+        if not rel_parts:
+            files = sorted(str(p.relative_to(run_dir)) for p in run_dir.rglob("*") if p.is_file())
+            return self._send_json(200, {"artifacts": files})
+
+        target = run_dir.joinpath(*rel_parts).resolve()
+        if run_dir not in target.parents or not target.is_file():
+            return self._send_error(404, "产物不存在")
+
+        data = target.read_bytes()
+        self.send_response(200)
+        self.send_header("Content-Type", mimetypes.guess_type(target.name)[0] or "application/octet-stream")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        if self._route() != ["jobs"]:
+            return self._send_error(404, f"未知路径: {self.path}")
+
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_BYTES:
+            return self._send_error(413, f"请求体超过 {MAX_BODY_BYTES} 字节")
+        try:
+            params = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError as e:
+            return self._send_error(400, f"JSON 无效: {e}")
+
+        error = validate_job(params)
+        if error:
+            return self._send_error(400, error)
+
+        try:
+            job = self.jobs.submit(params)
+        except QueueFull as e:
+            return self._send_error(429, str(e))
+
+        job.pop("params", None)
+        self._send_json(202, job)
+
+    def do_DELETE(self):
+        parts = self._route()
+        if len(parts) != 2 or parts[0] != "jobs":
+            return self._send_error(404, f"未知路径: {self.path}")
+        if not self.jobs.get(parts[1]):
+            return self._send_error(404, f"任务不存在: {parts[1]}")
+        if not self.jobs.cancel(parts[1]):
+            return self._send_error(409, "任务已结束")
+        self._send_json(200, self.jobs.get(parts[1]))
+
+
+def create_server(host: str = SERVER_HOST, port: int = SERVER_PORT, workers: int = SERVER_WORKERS,
+                  max_pending: int = SERVER_QUEUE_SIZE) -> ThreadingHTTPServer:
+    """创建服务（调用方负责 serve_forever / shutdown）"""
+    httpd = ThreadingHTTPServer((host, port), APIHandler)
+    httpd.daemon_threads = True
+    httpd.jobs = JobQueue(run_job, workers=workers, max_pending=max_pending)
+    return httpd
+
+
+def main():
+    """CLI入口"""
+    options = {"host": SERVER_HOST, "port": SERVER_PORT, "workers": SERVER_WORKERS}
+    for arg in sys.argv[1:]:
+        if arg.startswith("--") and "=" in arg:
+            key, value = arg[2:].split("=", 1)
+            if key in options:
+                options[key] = value if key == "host" else int(value)
+                continue
+        print(__doc__)
+        sys.exit(1)
+
+    prompt_cache.enable_explicit()
+    httpd = create_server(options["host"], options["port"], options["workers"])
+    print(f"🚀 Concept Visualizer 服务已启动: http://{options['host']}:{options['port']} "
+          f"({options['workers']} 个工作线程，排队上限 {SERVER_QUEUE_SIZE})")
+
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        print("\n正在停止，等待运行中的任务完成...")
+    finally:
+        httpd.server_close()
+        httpd.jobs.shutdown(wait=True)
+
+
+if __name__ == "__main__":
+    main()
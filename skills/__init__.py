@@ -8,7 +8,9 @@ from .design import DesignSkill
 from .generate import GenerateSkill
 from .pipeline import PipelineSkill
 from .discover import DiscoverSkill
+from .analyze_discover import AnalyzeDiscoverSkill
 from .learn_example import LearnExampleSkill
+from .bulk import BulkPipeline
 
 __all__ = [
     "AnalyzeSkill",
@@ -17,5 +19,7 @@ __all__ = [
     "GenerateSkill",
     "PipelineSkill",
     "DiscoverSkill",
-    "LearnExampleSkill"
+    "AnalyzeDiscoverSkill",
+    "LearnExampleSkill",
+    "BulkPipeline"
 ]
@@ -3,12 +3,13 @@ Skill: /analyze - 分析文章提取要点
 从文章中提取核心概念、关键引文和层级关系
 """
 
-import json
 import sys
 from pathlib import Path
 sys.path.append(str(Path(__file__).parent.parent))
 
 from lib.api import client
+from lib.tracing import traced
+from lib.json_utils import JSONExtractionError
 
 
 ANALYZE_PROMPT = '''你是一个概念分析专家。请分析以下文章，提取核心要点。
@@ -61,6 +62,41 @@ ANALYZE_PROMPT = '''你是一个概念分析专家。请分析以下文章，提
 请直接输出JSON，不要有任何其他文字。
 '''
 
+ANALYZE_SCHEMA = {
+    "type": "object",
+    "required": ["key_concepts"],
+    "properties": {
+        "main_theme": {"type": "string"},
+        "key_concepts": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "required": ["id", "name"],
+                "properties": {
+                    "id": {"type": "string"},
+                    "name": {"type": "string"},
+                    "name_cn": {"type": "string"},
+                    "description": {"type": "string"},
+                    "key_quote": {"type": "string"},
+                    "visualization_type": {"type": "string"},
+                    "importance": {"type": "integer"}
+                }
+            }
+        },
+        "relationships": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "from": {"type": "string"},
+                    "to": {"type": "string"},
+                    "type": {"type": "string"}
+                }
+            }
+        }
+    }
+}
+
 
 class AnalyzeSkill:
     """分析文章提取要点的技能"""
@@ -72,12 +108,14 @@ class AnalyzeSkill:
     def __init__(self):
         self.client = client
 
-    def run(self, article: str) -> dict:
+    @traced("skill.analyze")
+    def run(self, article: str, on_item=None) -> dict:
         """
         分析文章
 
         Args:
             article: 文章内容或文件路径
+            on_item: 每提取出一个概念时的回调（流式），为 None 时不流式
 
         Returns:
             分析结果字典
@@ -88,29 +126,25 @@ class AnalyzeSkill:
             if path.exists():
                 article = path.read_text(encoding='utf-8')
 
-        prompt = ANALYZE_PROMPT.format(article=article[:15000])  # 限制长度
+        prompt = self.build_prompt(article)
 
         print("🔍 正在分析文章...")
 
-        response = self.client.generate_text(prompt)
-
-        # 提取JSON
+        # 生成结构化JSON
         try:
-            # 尝试找到JSON块
-            if "```json" in response:
-                json_str = response.split("```json")[1].split("```")[0]
-            elif "```" in response:
-                json_str = response.split("```")[1].split("```")[0]
-            else:
-                json_str = response
-
-            result = json.loads(json_str.strip())
+            result = self.client.generate_json(prompt, ANALYZE_SCHEMA, on_item=on_item, item_key="key_concepts",
+                                               stage="analyze")
             print(f"✓ 提取了 {len(result.get('key_concepts', []))} 个核心概念")
             return result
 
-        except json.JSONDecodeError as e:
+        except JSONExtractionError as e:
             print(f"⚠ JSON解析失败: {e}")
-            return {"raw_response": response, "error": str(e)}
+            return {"raw_response": e.raw_response, "error": str(e)}
+
+    @staticmethod
+    def build_prompt(article: str) -> str:
+        """分析提示词（离线批量模式也由此构建）"""
+        return ANALYZE_PROMPT.format(article=article[:15000])  # 限制长度
 
     def format_output(self, result: dict) -> str:
         """格式化输出结果"""
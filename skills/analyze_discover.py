@@ -0,0 +1,168 @@
+"""
+Skill: Analyze + Discover - 分析与框架发现合并调用
+一次结构化调用同时提取核心概念和理论框架，文章只上传一次；
+结果拆分为与 AnalyzeSkill / DiscoverSkill 相同的结构（00_discover.json、01_analyze.json）
+"""
+
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from lib.api import client
+from lib.tracing import traced
+from lib.json_utils import JSONExtractionError
+from lib.prompt_cache import PrefixedPrompt
+from .analyze import ANALYZE_SCHEMA
+from .discover import DiscoverSkill, DISCOVER_SCHEMA
+
+
+# 静态前缀在前（任务说明、已知框架库与输出格式，可由提供商缓存），文章在后
+ANALYZE_DISCOVER_PREFIX = '''你是一位博学的跨学科学者和概念分析专家，精通哲学、科学方法论、系统论、认知科学、社会学等领域。
+请对以下文章同时完成两项任务。
+
+**任务一：概念分析**
+1. 识别文章的核心主题和论点
+2. 提取5-8个关键概念
+3. 为每个概念找出文章中最有力的原文引文
+4. 识别概念之间的层级关系或逻辑关系
+5. 为每个概念推荐适合的可视化类型：
+   hierarchy（层级/优先级）、comparison（二元对比）、network（系统/关系）、
+   flowchart（过程/决策）、terrain（优化/权衡）、attractor（吸引/趋向）
+
+**任务二：理论框架发现**
+识别文章中涉及或暗含的理论框架、方法论、思维模型（哲学概念、科学方法论、系统论概念、
+心理学/认知科学模型、社会学/经济学理论、工程/设计模式，或任何有名称、有解释力、可复用的思维工具）。
+
+**已知框架库（用于对比）：**
+{known_frameworks}
+
+**输出格式（必须是有效JSON，先输出任务一的字段）：**
+```json
+{{
+  "main_theme": "文章主题的一句话总结",
+  "key_concepts": [
+    {{
+      "id": "concept_1",
+      "name": "概念名称（简短英文）",
+      "name_cn": "概念中文名称",
+      "description": "概念描述（1-2句话）",
+      "key_quote": "原文引文（英文）",
+      "visualization_type": "hierarchy|comparison|network|flowchart|terrain|attractor",
+      "importance": 1-10
+    }}
+  ],
+  "relationships": [
+    {{
+      "from": "concept_id",
+      "to": "concept_id",
+      "type": "contains|constrains|enables|contrasts"
+    }}
+  ],
+  "discovered_frameworks": [
+    {{
+      "id": "framework_id_snake_case",
+      "name": "框架名称 (英文名)",
+      "name_en": "English Name",
+      "origin": "来源（人名/领域/书籍）",
+      "description": "框架描述（中文，1-2句话）",
+      "description_en": "English description",
+      "keywords": ["keyword1", "keyword2", "keyword3"],
+      "visual_elements": ["suggested visual element 1", "suggested visual element 2"],
+      "use_when": "适用场景（中文）",
+      "canonical_chart": "推荐的图表类型（如 pyramid, flowchart, network, cycle, terrain, attractor, comparison, venn, matrix, timeline）",
+      "suggested_charts": ["备选图表类型1", "备选图表类型2"],
+      "is_new": true,
+      "confidence": 0.9,
+      "source_quote": "文章中提到该框架的原文片段"
+    }}
+  ],
+  "existing_matches": [
+    {{
+      "framework_id": "已存在的框架ID",
+      "relevance": "high/medium/low",
+      "enrichment": "可以补充到现有框架的新信息（如果有）"
+    }}
+  ]
+}}
+```
+
+**框架发现注意：**
+1. is_new=true 表示不在已知框架库中的新框架，is_new=false 表示与已知框架相似或相同
+2. confidence 表示你对这个框架识别的确信度 (0-1)
+3. 不要发明框架，只识别文章中明确提到或强烈暗示的
+4. 如果框架已存在但文章提供了新视角，放入 existing_matches 的 enrichment
+'''
+
+ANALYZE_DISCOVER_PROMPT = '''
+**文章内容：**
+---
+{article}
+---
+
+请直接输出JSON，不要有任何其他文字。
+'''
+
+ANALYZE_KEYS = tuple(ANALYZE_SCHEMA["properties"])
+DISCOVER_KEYS = tuple(DISCOVER_SCHEMA["properties"])
+
+ANALYZE_DISCOVER_SCHEMA = {
+    "type": "object",
+    "required": ANALYZE_SCHEMA["required"] + DISCOVER_SCHEMA["required"],
+    "properties": {**ANALYZE_SCHEMA["properties"], **DISCOVER_SCHEMA["properties"]}
+}
+
+
+class AnalyzeDiscoverSkill:
+    """分析与框架发现合并调用的技能"""
+
+    name = "analyze_discover"
+    description = "一次调用同时分析文章和发现理论框架"
+
+    def __init__(self, discover: DiscoverSkill = None):
+        """
+        Args:
+            discover: 用于已知框架摘要和学习（写入框架库）的 DiscoverSkill
+        """
+        self.client = client
+        self.discover = discover or DiscoverSkill()
+
+    @traced("skill.analyze_discover")
+    def run(self, article: str, on_item=None, learn: bool = True) -> tuple:
+        """
+        分析文章并发现框架，随后按 DiscoverSkill 的规则学习
+
+        Args:
+            article: 文章内容
+            on_item: 每提取出一个概念时的回调（流式）
+            learn: 是否立即学习；为 False 时返回未学习的发现结果，由调用方随后调用 discover.complete()
+
+        Returns:
+            (分析结果, 发现与学习结果)，结构分别与 AnalyzeSkill.run、DiscoverSkill.run 相同
+        """
+        # 两项任务共用一份文章，取两者中较大的长度限制
+        prompt = PrefixedPrompt(
+            ANALYZE_DISCOVER_PREFIX.format(known_frameworks=self.discover._get_known_frameworks_summary()),
+            ANALYZE_DISCOVER_PROMPT.format(article=article[:20000])
+        )
+
+        print("🔍 正在分析文章并发现理论框架（合并调用）...")
+
+        try:
+            result = self.client.generate_json(prompt, ANALYZE_DISCOVER_SCHEMA, on_item=on_item,
+                                               item_key="key_concepts", stage="analyze_discover")
+        except JSONExtractionError as e:
+            print(f"⚠ JSON解析失败: {e}")
+            error = {"raw_response": e.raw_response, "error": str(e)}
+            return dict(error), error
+
+        analysis, discovery = self.split(result)
+        print(f"✓ 提取了 {len(analysis.get('key_concepts', []))} 个核心概念")
+        self.discover.report_discovery(discovery)
+        return analysis, (self.discover.complete(discovery) if learn else discovery)
+
+    @staticmethod
+    def split(result: dict) -> tuple:
+        """把合并结果拆分为 (分析结果, 发现结果)"""
+        analysis = {k: result[k] for k in ANALYZE_KEYS if k in result}
+        discovery = {k: result[k] for k in DISCOVER_KEYS if k in result}
+        return analysis, discovery
@@ -0,0 +1,404 @@
+"""
+Skill: 离线批量 - 按阶段批量提交
+N 篇文章的 analyze → map → design → generate 逐阶段推进：每个阶段收集所有文章的请求，
+经提供商的批处理接口（Gemini batch、OpenAI Batch）一次提交，轮询完成后把结果分发回各文章的输出目录，
+再进入下一阶段。产物与 manifest.json 与 /pipeline 完全一致，之后可直接用 /pipeline 增量重跑。
+进度保存在 <输出目录>/bulk.json，进程退出后再次运行即继续轮询已提交的批次。
+"""
+
+import json
+import time
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List
+sys.path.append(str(Path(__file__).parent.parent))
+
+from .analyze import ANALYZE_SCHEMA
+from .map_framework import MAP_SCHEMA
+from .design import DESIGN_SCHEMA
+from .pipeline import PipelineSkill, STAGE_ARTIFACTS, UPSTREAM
+from lib import metrics
+from lib.api import client
+from lib.batch_api import batch_backend, BatchError, RUNNING, COMPLETED, FAILED
+from lib.compress import compress_article
+from lib.json_utils import parse_json_response, JSONExtractionError
+from lib.metrics import RunMetrics
+from config import BULK_OUTPUT_DIR, BULK_POLL_SECONDS, BULK_MAX_BATCH_BYTES
+
+STATE_FILE = "bulk.json"
+
+# 按顺序推进的阶段（discover 会修改共享的框架库，不参与离线批量）
+BULK_STAGES = ("analyze", "map", "design", "generate")
+
+STAGE_SCHEMAS = {"analyze": ANALYZE_SCHEMA, "map": MAP_SCHEMA, "design": DESIGN_SCHEMA}
+
+
+class BulkPipeline:
+    """离线批量流水线"""
+
+    def __init__(self, output_dir: str = None, style: str = None, draft: bool = None, compress: bool = None,
+                 generate_images: bool = None, local: bool = None, poll_seconds: float = None):
+        """
+        Args:
+            output_dir: 输出根目录（默认 BULK_OUTPUT_DIR），每篇文章的输出为其下的 <文件名>_<编号>
+            style: 视觉风格ID
+            draft: 草稿模式
+            compress: analyze 之前在本地压缩文章（默认 COMPRESS_ARTICLES）
+            generate_images: 是否生成图像
+            local: 强制使用本地替身代替提供商的批处理接口
+            poll_seconds: 批次状态的轮询间隔（默认 BULK_POLL_SECONDS）
+
+        以上选项为 None 时沿用 bulk.json 中保存的值
+        """
+        from config import DEFAULT_VISUAL_STYLE, COMPRESS_ARTICLES
+
+        self.output_dir = Path(output_dir or BULK_OUTPUT_DIR)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.state = self._load_state()
+
+        defaults = {"style": DEFAULT_VISUAL_STYLE, "draft": False, "compress": COMPRESS_ARTICLES,
+                    "generate_images": True, "local": False}
+        given = {"style": style, "draft": draft, "compress": compress,
+                 "generate_images": generate_images, "local": local}
+        options = self.state["options"]
+        for key, value in given.items():
+            if value is not None:
+                options[key] = value
+            options.setdefault(key, defaults[key])
+
+        self.poll_seconds = BULK_POLL_SECONDS if poll_seconds is None else poll_seconds
+        self._skills: Dict[int, PipelineSkill] = {}
+        self.metrics = RunMetrics()
+
+    # =========================================================================
+    # 状态
+    # =========================================================================
+
+    def _load_state(self) -> dict:
+        try:
+            return json.loads((self.output_dir / STATE_FILE).read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            return {"version": 1, "options": {}, "articles": [], "pending": {}, "failures": {}}
+
+    def _save_state(self):
+        PipelineSkill._write_json(self.output_dir / STATE_FILE, self.state)
+
+    def add(self, article_paths: List[Path]) -> tuple:
+        """
+        添加文章（同一路径只添加一次）
+
+        Returns:
+            (新增数, 已存在而跳过的数)
+        """
+        known = {a["path"] for a in self.state["articles"]}
+        added = skipped = 0
+        for path in article_paths:
+            path = Path(path).resolve()
+            if str(path) in known:
+                skipped += 1
+                continue
+            known.add(str(path))
+            number = len(self.state["articles"]) + 1
+            self.state["articles"].append({"path": str(path), "dir": str(self.output_dir / f"{path.stem}_{number:05d}")})
+            added += 1
+        self._save_state()
+        return added, skipped
+
+    def _skill(self, index: int) -> PipelineSkill:
+        """某篇文章的流水线（只用其增量重跑与产物写入，不执行阶段）"""
+        if index not in self._skills:
+            options = self.state["options"]
+            self._skills[index] = PipelineSkill(self.state["articles"][index]["dir"], auto_learn=False,
+                                                style=options["style"], interactive_style=False,
+                                                draft=options["draft"], compress=options["compress"])
+        return self._skills[index]
+
+    def _fail(self, index: int, stage: str, error: str):
+        article = self.state["articles"][index]["path"]
+        self.state["failures"][article] = f"{stage}: {error}"
+        print(f"✗ {Path(article).name} [{stage}]: {error}")
+
+    # =========================================================================
+    # 执行
+    # =========================================================================
+
+    def run(self) -> dict:
+        """
+        逐阶段推进全部文章，直到所有阶段完成
+
+        Returns:
+            {"articles", "failures", "metrics"}
+        """
+        stages = [s for s in BULK_STAGES if s != "generate" or self.state["options"]["generate_images"]]
+        # 上次失败的文章重新尝试（已完成的阶段按 manifest.json 复用）
+        self.state["failures"] = {}
+        print("=" * 60)
+        print(f"📦 离线批量: {len(self.state['articles'])} 篇文章 · 输出 {self.output_dir}")
+        print("=" * 60)
+
+        with metrics.collect(self.metrics):
+            try:
+                for stage in stages:
+                    print("\n" + "-" * 40)
+                    print(f"阶段 {stage}")
+                    print("-" * 40)
+                    with self.metrics.stage(stage):
+                        pending = self.state["pending"].get(stage) or self._collect(stage)
+                        if pending is None:
+                            print("✓ 无需执行（全部复用或上游未完成）")
+                            continue
+                        self._wait(stage, pending)
+                        self._apply(stage, pending)
+                    del self.state["pending"][stage]
+                    self._save_state()
+            finally:
+                self.metrics.save(self.output_dir / "metrics.json")
+
+        failures = self.state["failures"]
+        totals = self.metrics.summary()["totals"]
+        print("\n" + "=" * 60)
+        print(f"✓ 离线批量完成: {len(self.state['articles']) - len(failures)}/{len(self.state['articles'])} 篇成功")
+        for article, error in failures.items():
+            print(f"  ✗ {Path(article).name}: {error}")
+        print(f"⏱ 调用 {totals['calls']} 次 · tokens {totals['input_tokens']}/{totals['output_tokens']} · "
+              f"估算成本 ${totals['cost_usd']:.4f}")
+        print("=" * 60)
+        return {"articles": self.state["articles"], "failures": failures, "metrics": self.metrics.summary()}
+
+    def _collect(self, stage: str):
+        """
+        收集各文章本阶段的请求并提交（输入未变化的文章复用已有产物，上游未完成的文章跳过）
+
+        Returns:
+            待完成的阶段记录 {"kind", "batches", "articles": {序号: {...}}}；没有需要执行的文章时返回 None
+        """
+        kind = "image" if stage == "generate" else "json"
+        articles, requests_ = {}, []
+
+        for index, article in enumerate(self.state["articles"]):
+            if article["path"] in self.state["failures"]:
+                continue
+            skill = self._skill(index)
+            if stage == "analyze":
+                text = self._article_text(index, skill)
+                if text is None:
+                    continue
+                inputs = skill._inputs(stage, text)
+            else:
+                upstream = skill._stage_dir(UPSTREAM[stage]) / STAGE_ARTIFACTS[UPSTREAM[stage]]
+                if not upstream.exists():
+                    continue
+                inputs = skill._inputs(stage)
+            if skill._reuse(stage, inputs) is not None:
+                continue
+
+            entry = {"inputs": inputs, "requests": []}
+            if stage == "analyze":
+                prompts = [skill.analyze.build_prompt(text)]
+            elif stage == "map":
+                prompts = [skill.map_framework.build_prompt(json.loads(upstream.read_text(encoding="utf-8")))]
+            elif stage == "design":
+                prompts = [skill.design.build_prompt(json.loads(upstream.read_text(encoding="utf-8")))]
+            else:
+                prompts = []
+                entry["images"] = self._collect_images(skill, json.loads(upstream.read_text(encoding="utf-8")))
+                for image in entry["images"]:
+                    prompt = image.pop("prompt")  # 只提交，不写入状态文件
+                    if image["result"] is None:
+                        request_id = f"{stage}-{index}-{image['index']}"
+                        entry["requests"].append(request_id)
+                        requests_.append({"id": request_id, "kind": kind, "prompt": prompt,
+                                          "image_size": image["request"]["image_size"],
+                                          "seed": image["request"]["seed"]})
+
+            for prompt in prompts:
+                request_id = f"{stage}-{index}"
+                entry["requests"].append(request_id)
+                requests_.append({"id": request_id, "kind": kind, "prompt": prompt, "schema": STAGE_SCHEMAS[stage]})
+            articles[str(index)] = entry
+
+        if not articles:
+            return None
+
+        pending = {"kind": kind, "batches": [], "articles": articles}
+        if requests_:
+            backend = self._backend(stage, kind)
+            model = self._provider(stage)[1]
+            chunks = self._chunks(requests_)
+            for n, chunk in enumerate(chunks, 1):
+                batch = backend.submit(chunk, kind, f"{stage}-{n}", model)
+                pending["batches"].append(batch)
+                print(f"📤 已提交批次 {n}/{len(chunks)}: {len(chunk)} 个请求 → {batch['backend']} ({batch['id']})")
+        self.state["pending"][stage] = pending
+        self._save_state()
+        return pending
+
+    def _article_text(self, index: int, skill: PipelineSkill):
+        """读取文章（按设置在本地压缩，写入 article.compressed.md）；读取失败时返回 None"""
+        try:
+            text = Path(self.state["articles"][index]["path"]).read_text(encoding="utf-8")
+        except OSError as e:
+            self._fail(index, "analyze", f"读取文章失败: {e}")
+            return None
+        if self.state["options"]["compress"]:
+            text = compress_article(text)["text"]
+            (skill.output_dir / "article.compressed.md").write_text(text, encoding="utf-8")
+        return text
+
+    @staticmethod
+    def _collect_images(skill: PipelineSkill, design_result: dict) -> list:
+        """各设计的图像请求；图像缓存命中的直接放到输出目录"""
+        generate = skill.generate
+        images = []
+        for i, design in enumerate(generate._design_list(design_result), 1):
+            prompt, title, output_name = generate.prepare_design(design, i)
+            request = generate.image_request(prompt)
+            result = None
+            if request["cache_key"]:
+                cached = generate.cache.get(request["cache_key"], str(generate.output_dir / output_name))
+                if cached:
+                    metrics.incr("image_cache_hits")
+                    result = {**cached, "image_size": request["image_size"], "seed": request["seed"],
+                              "draft": request["draft"]}
+                else:
+                    metrics.incr("image_cache_misses")
+            images.append({"index": i, "title": title, "output_name": output_name, "prompt": request.pop("prompt"),
+                           "request": request, "result": result})
+        return images
+
+    @staticmethod
+    def _provider(stage: str) -> tuple:
+        """阶段使用的提供商与模型（文本阶段按 STAGE_MODELS 解析，模型为 None 时使用提供商的默认模型）"""
+        provider, model = (client.image_provider, None) if stage == "generate" else client.text_provider_for(stage)
+        if not provider:
+            raise BatchError(f"No {'image' if stage == 'generate' else 'text'} provider available")
+        return provider, model
+
+    def _backend(self, stage: str, kind: str, name: str = None):
+        """批处理后端（name 为已提交批次记录中的 backend）"""
+        return batch_backend(self._provider(stage)[0], kind, self.output_dir / "local_batches",
+                             self.state["options"]["local"], name=name)
+
+    @staticmethod
+    def _chunks(requests_: list) -> list:
+        """按请求体大小拆分批次（单个批次不超过 BULK_MAX_BATCH_BYTES）"""
+        chunks, size = [[]], 0
+        for req in requests_:
+            req_size = len(str(req["prompt"]).encode("utf-8")) + 1024
+            if chunks[-1] and size + req_size > BULK_MAX_BATCH_BYTES:
+                chunks.append([])
+                size = 0
+            chunks[-1].append(req)
+            size += req_size
+        return chunks
+
+    def _wait(self, stage: str, pending: dict):
+        """轮询本阶段的批次直到全部结束（完成或失败）"""
+        waiting = [b for b in pending["batches"] if b.get("state") not in (COMPLETED, FAILED)]
+        while waiting:
+            for batch in waiting:
+                backend = self._backend(stage, pending["kind"], batch["backend"])
+                try:
+                    batch["state"], batch["raw_state"] = backend.poll(batch)
+                except (BatchError, OSError) as e:
+                    # 网络或接口的临时错误：下一轮继续轮询
+                    print(f"⚠ 查询批次 {batch['id']} 失败: {e}")
+                    continue
+                if batch["state"] != RUNNING:
+                    mark = "✓" if batch["state"] == COMPLETED else "✗"
+                    print(f"{mark} 批次 {batch['id']}: {batch.get('raw_state') or '-'} "
+                          f"（{time.time() - batch['submitted_at']:.0f}s）")
+            self._save_state()
+            waiting = [b for b in waiting if b.get("state") not in (COMPLETED, FAILED)]
+            if waiting:
+                print(f"⏳ {stage}: 等待 {len(waiting)} 个批次（{', '.join(b.get('raw_state') or '-' for b in waiting)}），"
+                      f"{self.poll_seconds}s 后再次查询")
+                time.sleep(self.poll_seconds)
+
+    def _apply(self, stage: str, pending: dict):
+        """取回本阶段的结果并写入各文章的输出目录"""
+        results = {}
+        for batch in pending["batches"]:
+            if batch.get("state") == COMPLETED:
+                results.update(self._backend(stage, pending["kind"], batch["backend"]).results(batch))
+        failed = {b["id"]: b.get("raw_state") or "-" for b in pending["batches"] if b.get("state") == FAILED}
+
+        done = 0
+        for index, entry in pending["articles"].items():
+            index = int(index)
+            skill = self._skill(index)
+            outcomes = {rid: results.get(rid) or {"error": f"批次未完成: {', '.join(failed.values()) or '结果缺失'}"}
+                        for rid in entry["requests"]}
+
+            if stage == "generate":
+                generated = []
+                for image in entry["images"]:
+                    result = image["result"]
+                    if result is None:
+                        outcome = outcomes[f"{stage}-{index}-{image['index']}"]
+                        result = (skill.generate.store_image(outcome, image["request"], image["output_name"])
+                                  if "image_data" in outcome else {"success": False, "error": outcome["error"]})
+                    generated.append({**result, "title": image["title"], "index": image["index"]})
+                # 与 /pipeline 一致：部分失败也写入产物，下次运行时只要有失败就重跑本阶段
+                skill._save_json(stage, generated, entry["inputs"])
+                failures = [r for r in generated if not r.get("success")]
+                if failures:
+                    self._fail(index, stage, f"{len(failures)}/{len(generated)} 张图像生成失败: {failures[0].get('error')}")
+                else:
+                    done += 1
+                continue
+
+            outcome = outcomes[entry["requests"][0]]
+            if "error" in outcome:
+                self._fail(index, stage, outcome["error"])
+                continue
+            try:
+                provider, model = self._provider(stage)
+                data = parse_json_response(outcome["text"], STAGE_SCHEMAS[stage],
+                                           repair_client=provider, repair_model=model)
+            except JSONExtractionError as e:
+                self._fail(index, stage, f"JSON解析失败: {e}")
+                continue
+
+            if stage == "map":
+                data = skill.map_framework.complete(data)
+            skill._save_json(stage, data, entry["inputs"])
+            if stage == "design":
+                with open(skill.output_dir / "prompts.md", "w", encoding="utf-8") as f:
+                    f.write(skill._format_prompts_markdown(data))
+            done += 1
+
+        print(f"✓ {stage}: {done}/{len(pending['articles'])} 篇完成")
+
+    # =========================================================================
+    # 查询
+    # =========================================================================
+
+    def status(self) -> dict:
+        """
+        各阶段的完成情况与待完成批次的状态（会查询一次提供商）
+
+        Returns:
+            {"articles", "stages": {阶段: 已有产物的文章数}, "pending": {阶段: [批次记录]}, "failures"}
+        """
+        stages = {stage: sum(1 for a in self.state["articles"] if (Path(a["dir"]) / STAGE_ARTIFACTS[stage]).exists())
+                  for stage in BULK_STAGES}
+        pending = {}
+        for stage, entry in self.state["pending"].items():
+            for batch in entry["batches"]:
+                # 本地替身在轮询时执行批次，这里只报告记录的状态
+                if batch.get("state") not in (COMPLETED, FAILED) and batch["backend"] != "local":
+                    backend = self._backend(stage, entry["kind"], batch["backend"])
+                    try:
+                        batch["state"], batch["raw_state"] = backend.poll(batch)
+                    except (BatchError, OSError) as e:
+                        batch["raw_state"] = f"查询失败: {e}"
+            pending[stage] = entry["batches"]
+        return {
+            "articles": len(self.state["articles"]),
+            "stages": stages,
+            "pending": pending,
+            "failures": self.state["failures"],
+            "updated_at": datetime.now().isoformat(timespec="seconds")
+        }
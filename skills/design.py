@@ -9,11 +9,15 @@ from pathlib import Path
 sys.path.append(str(Path(__file__).parent.parent))
 
 from lib.api import client
-from lib.registry import registry
+from lib.registry import Registry, registry as default_registry
+from lib.tracing import traced
+from lib.json_utils import JSONExtractionError
+from lib.prompt_cache import PrefixedPrompt
 from config import DEFAULT_VISUAL_STYLE
 
 
-DESIGN_PROMPT = '''你是一位专业的技术文档设计师，擅长创建 Intuition Machine 风格的技术简报图。
+# 静态前缀在前（样式规范、图表类型、规则与示例，同一风格下不变，可由提供商缓存），映射结果在后
+DESIGN_PREFIX = '''你是一位专业的技术文档设计师，擅长创建 Intuition Machine 风格的技术简报图。
 
 **⚠️⚠️⚠️ 核心风格：技术简报演示文稿 ⚠️⚠️⚠️**
 这是学术/技术简报风格，不是艺术3D渲染！
@@ -37,11 +41,6 @@ DESIGN_PROMPT = '''你是一位专业的技术文档设计师，擅长创建 Int
 2. **备选**：如果 recommended_chart 不适合内容，从 `alternative_charts` 中选择
 3. **自由选择**：只有在没有推荐或推荐不适合时，才从完整图表库自由选择
 
-**输入的映射结果：**
-```json
-{mappings}
-```
-
 **任务：**
 为每个概念设计 Intuition Machine 风格的图像提示词（英文）。
 
@@ -105,11 +104,52 @@ DESIGN_PROMPT = '''你是一位专业的技术文档设计师，擅长创建 Int
 
 **示例 prompt（注意丰富的文章内容和视觉元素）：**
 "Technical blueprint infographic. Title: '[必然性需求格栅]' in dark maroon ALL CAPS in brackets at top, with English subtitle 'THE ANANCIC LATTICE OF SPECIFICATION' below. Main diagram: isometric 3D technical illustration of an interlocking lattice structure made of teal steel beams and brown wooden connectors, representing structured requirements. Multiple text boxes with article content: Box 1 - 'DEFINITION 定义: 通过规则和约束实现控制', Box 2 - 'KEY INSIGHT 核心洞察: 硬性规则确保一致性但牺牲灵活性', Box 3 - 'EXAMPLE 案例: 代码规范如同建筑蓝图', Box 4 - 'KEY QUOTE 关键引文: 约束是自由的基础'. Bilingual callout labels point to key parts: 'STRUCTURAL CONSTRAINTS 结构约束', 'LOGIC FLOW 逻辑导向', 'CORE DOMAIN 核心领域'. Background: aged cream blueprint paper (#F5F0E1) with subtle texture and light creases. Faded flowchart patterns in background related to process logic. Colors: teal #2F337, warm brown #8B7355, maroon titles. All text in Simplified Chinese (简体中文). Chinese characters must be crystal clear, perfectly formed. Clean corners with no title blocks or stamps. 4K ultra-high resolution. Technical blueprint aesthetic."
+'''
+
+DESIGN_PROMPT = '''
+**输入的映射结果：**
+```json
+{mappings}
+```
 
 请直接输出JSON，不要有任何其他文字。
 '''
 
 
+DESIGN_SCHEMA = {
+    "type": "object",
+    "required": ["designs"],
+    "properties": {
+        "designs": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "required": ["concept_id", "image_prompt"],
+                "properties": {
+                    "concept_id": {"type": "string"},
+                    "title": {"type": "string"},
+                    "chart_type": {"type": "string"},
+                    "layout": {"type": "string"},
+                    "visual_elements": {"type": "array", "items": {"type": "string"}},
+                    "text_boxes": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "label": {"type": "string"},
+                                "content": {"type": "string"}
+                            }
+                        }
+                    },
+                    "key_quote": {"type": "string"},
+                    "image_prompt": {"type": "string"}
+                }
+            }
+        }
+    }
+}
+
+
 class DesignSkill:
     """可视化设计技能"""
 
@@ -117,9 +157,14 @@ class DesignSkill:
     description = "设计图像提示词和视觉方案"
     usage = "/design <map结果JSON>"
 
-    def __init__(self, style: str = None):
+    def __init__(self, style: str = None, registry: Registry = None):
+        """
+        Args:
+            style: 视觉风格ID
+            registry: 使用的注册表（默认全局单例，可传入 RegistryOverlay 等隔离视图）
+        """
         self.client = client
-        self.registry = registry
+        self.registry = registry or default_registry
         self.style_id = style or DEFAULT_VISUAL_STYLE
 
     def _get_chart_types_desc(self) -> str:
@@ -136,52 +181,46 @@ class DesignSkill:
         # 优先使用 style_prefix，否则使用 template
         return style.get("style_prefix", style.get("template", ""))
 
-    def run(self, mappings: list | dict) -> dict:
+    @traced("skill.design")
+    def run(self, mappings: list | dict, on_item=None) -> dict:
         """
         设计可视化方案
 
         Args:
             mappings: map skill的输出
+            on_item: 每完成一个设计时的回调（流式），为 None 时不流式
 
         Returns:
             设计结果字典
         """
-        if isinstance(mappings, dict):
-            if "mappings" in mappings:
-                mappings = mappings["mappings"]
-
-        if isinstance(mappings, str):
-            mappings = json.loads(mappings)
-
-        style = self._get_style()
-        style_prefix = self._get_style_prefix()
-
-        prompt = DESIGN_PROMPT.format(
-            style_prefix=style_prefix,
-            chart_types=self._get_chart_types_desc(),
-            mappings=json.dumps(mappings, ensure_ascii=False, indent=2)
-        )
+        prompt = self.build_prompt(mappings)
 
         print("🎨 正在设计可视化方案...")
 
-        response = self.client.generate_text(prompt)
-
-        # 提取JSON
+        # 生成结构化JSON
         try:
-            if "```json" in response:
-                json_str = response.split("```json")[1].split("```")[0]
-            elif "```" in response:
-                json_str = response.split("```")[1].split("```")[0]
-            else:
-                json_str = response
-
-            result = json.loads(json_str.strip())
+            result = self.client.generate_json(prompt, DESIGN_SCHEMA, on_item=on_item, item_key="designs",
+                                               stage="design")
             print(f"✓ 完成 {len(result.get('designs', []))} 个可视化设计")
             return result
 
-        except json.JSONDecodeError as e:
+        except JSONExtractionError as e:
             print(f"⚠ JSON解析失败: {e}")
-            return {"raw_response": response, "error": str(e)}
+            return {"raw_response": e.raw_response, "error": str(e)}
+
+    def build_prompt(self, mappings: list | dict | str) -> PrefixedPrompt:
+        """设计提示词（离线批量模式也由此构建）"""
+        if isinstance(mappings, dict):
+            if "mappings" in mappings:
+                mappings = mappings["mappings"]
+
+        if isinstance(mappings, str):
+            mappings = json.loads(mappings)
+
+        return PrefixedPrompt(
+            DESIGN_PREFIX.format(style_prefix=self._get_style_prefix(), chart_types=self._get_chart_types_desc()),
+            DESIGN_PROMPT.format(mappings=json.dumps(mappings, ensure_ascii=False, indent=2))
+        )
 
     def format_output(self, result: dict) -> str:
         """格式化输出结果"""
@@ -4,17 +4,20 @@ Skill: Framework Discovery - 理论框架发现与学习
 让Agent成为海纳百川的博学家
 """
 
-import json
 import sys
 from pathlib import Path
 from datetime import datetime
 sys.path.append(str(Path(__file__).parent.parent))
 
 from lib.api import client
-from lib.registry import registry
+from lib.registry import Registry, registry as default_registry
+from lib.tracing import traced
+from lib.json_utils import JSONExtractionError
+from lib.prompt_cache import PrefixedPrompt
 
 
-DISCOVER_PROMPT = '''你是一位博学的跨学科学者，精通哲学、科学方法论、系统论、认知科学、社会学等领域。
+# 静态前缀在前（任务说明、已知框架库与输出格式，可由提供商缓存），文章在后
+DISCOVER_PREFIX = '''你是一位博学的跨学科学者，精通哲学、科学方法论、系统论、认知科学、社会学等领域。
 
 **任务：**
 分析以下文章，识别其中涉及或暗含的理论框架、方法论、思维模型。
@@ -31,11 +34,6 @@ DISCOVER_PROMPT = '''你是一位博学的跨学科学者，精通哲学、科
 **已知框架库（用于对比）：**
 {known_frameworks}
 
-**文章内容：**
----
-{article}
----
-
 **请识别文章中的理论框架，输出JSON格式：**
 
 ```json
@@ -75,6 +73,13 @@ DISCOVER_PROMPT = '''你是一位博学的跨学科学者，精通哲学、科
 4. 不要发明框架，只识别文章中明确提到或强烈暗示的
 5. 优先识别有学术/实践价值、可复用的框架
 6. 如果框架已存在但文章提供了新视角，放入 existing_matches 的 enrichment
+'''
+
+DISCOVER_PROMPT = '''
+**文章内容：**
+---
+{article}
+---
 
 请直接输出JSON，不要有任何其他文字。
 '''
@@ -111,6 +116,49 @@ ENRICH_PROMPT = '''你是一位博学的学者，负责完善理论框架的定
 '''
 
 
+DISCOVER_SCHEMA = {
+    "type": "object",
+    "required": ["discovered_frameworks"],
+    "properties": {
+        "discovered_frameworks": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "required": ["id", "name"],
+                "properties": {
+                    "id": {"type": "string"},
+                    "name": {"type": "string"},
+                    "name_en": {"type": "string"},
+                    "origin": {"type": "string"},
+                    "description": {"type": "string"},
+                    "description_en": {"type": "string"},
+                    "keywords": {"type": "array", "items": {"type": "string"}},
+                    "visual_elements": {"type": "array", "items": {"type": "string"}},
+                    "use_when": {"type": "string"},
+                    "canonical_chart": {"type": "string"},
+                    "suggested_charts": {"type": "array", "items": {"type": "string"}},
+                    "is_new": {"type": "boolean"},
+                    "confidence": {"type": "number"},
+                    "source_quote": {"type": "string"}
+                }
+            }
+        },
+        "existing_matches": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "required": ["framework_id"],
+                "properties": {
+                    "framework_id": {"type": "string"},
+                    "relevance": {"type": "string"},
+                    "enrichment": {"type": "string"}
+                }
+            }
+        }
+    }
+}
+
+
 class DiscoverSkill:
     """理论框架发现与学习技能"""
 
@@ -118,9 +166,9 @@ class DiscoverSkill:
     description = "从文章中发现新的理论框架并扩充知识库"
     usage = "/discover <文章路径或文本>"
 
-    def __init__(self, auto_save: bool = True, min_confidence: float = 0.7):
+    def __init__(self, auto_save: bool = True, min_confidence: float = 0.7, registry: Registry = None):
         self.client = client
-        self.registry = registry
+        self.registry = registry or default_registry
         self.auto_save = auto_save
         self.min_confidence = min_confidence
 
@@ -133,6 +181,7 @@ class DiscoverSkill:
             lines.append(f"- {fid}: {f.get('name', fid)} [{keywords}]")
         return "\n".join(lines)
 
+    @traced("skill.discover")
     def discover(self, article: str) -> dict:
         """
         从文章中发现理论框架
@@ -149,40 +198,33 @@ class DiscoverSkill:
             if path.exists():
                 article = path.read_text(encoding='utf-8')
 
-        prompt = DISCOVER_PROMPT.format(
-            known_frameworks=self._get_known_frameworks_summary(),
-            article=article[:20000]  # 限制长度
+        prompt = PrefixedPrompt(
+            DISCOVER_PREFIX.format(known_frameworks=self._get_known_frameworks_summary()),
+            DISCOVER_PROMPT.format(article=article[:20000])  # 限制长度
         )
 
         print("🔬 正在分析文章中的理论框架...")
 
-        response = self.client.generate_text(prompt)
-
-        # 解析JSON
+        # 生成结构化JSON
         try:
-            if "```json" in response:
-                json_str = response.split("```json")[1].split("```")[0]
-            elif "```" in response:
-                json_str = response.split("```")[1].split("```")[0]
-            else:
-                json_str = response
-
-            result = json.loads(json_str.strip())
-
-            # 统计
-            new_frameworks = [f for f in result.get("discovered_frameworks", [])
-                           if f.get("is_new") and f.get("confidence", 0) >= self.min_confidence]
-            existing = result.get("existing_matches", [])
-
-            print(f"✓ 发现 {len(new_frameworks)} 个新框架")
-            print(f"✓ 匹配 {len(existing)} 个已有框架")
-
+            result = self.client.generate_json(prompt, DISCOVER_SCHEMA, stage="discover")
+            self.report_discovery(result)
             return result
 
-        except json.JSONDecodeError as e:
+        except JSONExtractionError as e:
             print(f"⚠ JSON解析失败: {e}")
-            return {"raw_response": response, "error": str(e)}
+            return {"raw_response": e.raw_response, "error": str(e)}
+
+    def report_discovery(self, result: dict):
+        """打印发现结果的统计"""
+        new_frameworks = [f for f in result.get("discovered_frameworks", [])
+                          if f.get("is_new") and f.get("confidence", 0) >= self.min_confidence]
+        existing = result.get("existing_matches", [])
 
+        print(f"✓ 发现 {len(new_frameworks)} 个新框架")
+        print(f"✓ 匹配 {len(existing)} 个已有框架")
+
+    @traced("skill.discover_learn")
     def learn(self, discovery_result: dict) -> dict:
         """
         从发现结果中学习，更新框架库
@@ -291,6 +333,18 @@ class DiscoverSkill:
         if "error" in discovery:
             return discovery
 
+        return self.complete(discovery)
+
+    def complete(self, discovery: dict) -> dict:
+        """
+        从发现结果学习并汇总（run() 的后半部分，AnalyzeDiscoverSkill 合并调用后也由此完成学习）
+
+        Args:
+            discovery: discover() 的返回结果
+
+        Returns:
+            完整结果
+        """
         # 学习
         learning = self.learn(discovery)
 
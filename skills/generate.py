@@ -3,15 +3,26 @@ Skill: /generate - 图像生成
 使用Google AI Studio API生成图像
 """
 
+import os
 import json
 import time
+import hashlib
 import sys
 from pathlib import Path
 sys.path.append(str(Path(__file__).parent.parent))
 
-from lib.api import client
-from lib.registry import registry
-from config import DEFAULT_VISUAL_STYLE, VISUAL_STYLES
+from lib.api import client, save_image
+from lib.registry import Registry, registry as default_registry
+from lib.tracing import traced
+from lib.image_cache import image_cache, ImageCache
+from lib import metrics
+from config import (DEFAULT_VISUAL_STYLE, VISUAL_STYLES, DEFAULT_ASPECT_RATIO, DEFAULT_IMAGE_SIZE,
+                    DRAFT_IMAGE_SIZE, IMAGE_CACHE_ENABLED)
+
+
+def derive_seed(prompt: str) -> int:
+    """由完整提示词派生稳定的随机种子，使草稿与定稿保持同一构图"""
+    return int(hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8], 16) % (2 ** 31)
 
 
 class GenerateSkill:
@@ -19,14 +30,27 @@ class GenerateSkill:
 
     name = "generate"
     description = "使用AI生成概念图"
-    usage = "/generate <prompt> [output_path]"
+    usage = "/generate <prompt> [output_path] [--draft]"
 
-    def __init__(self, output_dir: str = "output", style: str = None):
+    def __init__(self, output_dir: str = "output", style: str = None, use_cache: bool = True,
+                 draft: bool = False, registry: Registry = None):
+        """
+        Args:
+            output_dir: 图像输出目录
+            style: 视觉风格ID
+            use_cache: 是否使用图像缓存
+            draft: 草稿模式，以 DRAFT_IMAGE_SIZE 快速出图，确认后用 finalize() 定稿
+            registry: 使用的注册表（默认全局单例，可传入 RegistryOverlay 等隔离视图）
+        """
         self.client = client
+        self.registry = registry or default_registry
+        self.draft = draft
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(exist_ok=True)
         self.style_id = style or DEFAULT_VISUAL_STYLE
         self.style_prefix = self._get_style_prefix()
+        self.cache = image_cache if (use_cache and IMAGE_CACHE_ENABLED) else None
+        self._draft_warned = False
 
     def _get_style_prefix(self) -> str:
         """获取统一样式前缀"""
@@ -35,10 +59,39 @@ class GenerateSkill:
             style = VISUAL_STYLES[self.style_id]
             return style.get("style_prefix", "")
         # 否则从 registry 获取
-        style = registry.get_visual_style(self.style_id)
+        style = self.registry.get_visual_style(self.style_id)
         return style.get("style_prefix", style.get("template", ""))
 
-    def run(self, prompt: str, output_name: str = None, use_style_prefix: bool = True) -> dict:
+    def use_draft(self, draft: bool = None) -> bool:
+        """
+        是否以草稿尺寸生成
+
+        Args:
+            draft: 为 None 时沿用实例设置
+
+        Returns:
+            图像提供商不支持指定输出尺寸时总是 False（草稿与定稿成本相同，按正常尺寸生成并提示一次）
+        """
+        draft = self.draft if draft is None else draft
+        provider = self.client.image_provider
+        if draft and provider and not provider.supports_image_size:
+            if not self._draft_warned:
+                self._draft_warned = True
+                print(f"⚠ 图像提供商 {provider.provider_id} 不支持指定输出尺寸，草稿模式无效，按 {DEFAULT_IMAGE_SIZE} 生成")
+            return False
+        return draft
+
+    def _cache_key(self, full_prompt: str, image_size: str) -> str:
+        """计算图像缓存键（无可用图像提供商时返回 None）"""
+        provider = self.client.image_provider
+        if not provider:
+            return None
+        return ImageCache.make_key(full_prompt, provider.provider_id, provider.config.get("image_model"),
+                                   DEFAULT_ASPECT_RATIO, image_size)
+
+    @traced("skill.generate")
+    def run(self, prompt: str, output_name: str = None, use_style_prefix: bool = True,
+            draft: bool = None) -> dict:
         """
         生成单张图像
 
@@ -46,6 +99,7 @@ class GenerateSkill:
             prompt: 图像生成提示词
             output_name: 输出文件名（不含扩展名）
             use_style_prefix: 是否添加统一样式前缀
+            draft: 是否以草稿尺寸生成，为 None 时沿用实例设置
 
         Returns:
             生成结果字典
@@ -55,71 +109,166 @@ class GenerateSkill:
 
         output_path = str(self.output_dir / output_name)
 
-        # 添加统一样式前缀
-        if use_style_prefix and self.style_prefix:
-            full_prompt = f"{self.style_prefix}\n\n=== IMAGE CONTENT ===\n{prompt}"
-        else:
-            full_prompt = prompt
+        request = self.image_request(prompt, use_style_prefix, draft)
+        full_prompt, image_size, seed = request["prompt"], request["image_size"], request["seed"]
+        render = {"image_size": image_size, "seed": seed, "draft": request["draft"]}
+
+        # 相同提示词/模型/尺寸已经生成过：直接复用，不访问网络
+        cache_key = request["cache_key"]
+        if cache_key:
+            cached = self.cache.get(cache_key, output_path)
+            if cached:
+                metrics.incr("image_cache_hits")
+                print(f"✓ 命中图像缓存: {cached['output_path']}")
+                return {**cached, **render}
+            metrics.incr("image_cache_misses")
 
-        print(f"🖼️ 正在生成图像: {output_name}")
+        print(f"🖼️ 正在生成{'草稿' if request['draft'] else '图像'} ({image_size}): {output_name}")
 
         try:
-            result = self.client.generate_image(full_prompt, output_path)
+            result = self.client.generate_image(full_prompt, output_path, image_size=image_size, seed=seed)
 
             if result.get("success"):
                 print(f"✓ 图像已保存: {result.get('output_path')}")
+                if cache_key and result.get("output_path"):
+                    self.cache.put(cache_key, result["output_path"])
             else:
                 print(f"✗ 生成失败: {result.get('error')}")
 
-            return result
+            return {**result, **render}
 
         except Exception as e:
             print(f"✗ 错误: {e}")
             return {"success": False, "error": str(e)}
 
-    def run_batch(self, designs: list | dict, delay: float = 2.0) -> list:
+    def image_request(self, prompt: str, use_style_prefix: bool = True, draft: bool = None) -> dict:
+        """
+        单张图像的请求参数（离线批量模式也由此构建）
+
+        Returns:
+            {"prompt": 加统一样式前缀后的完整提示词, "image_size", "seed", "draft", "cache_key"(未启用缓存时为 None)}
+        """
+        # 添加统一样式前缀
+        if use_style_prefix and self.style_prefix:
+            full_prompt = f"{self.style_prefix}\n\n=== IMAGE CONTENT ===\n{prompt}"
+        else:
+            full_prompt = prompt
+
+        draft = self.use_draft(draft)
+        image_size = DRAFT_IMAGE_SIZE if draft else DEFAULT_IMAGE_SIZE
+        return {
+            "prompt": full_prompt,
+            "image_size": image_size,
+            "seed": derive_seed(full_prompt),
+            "draft": draft,
+            "cache_key": self._cache_key(full_prompt, image_size) if self.cache else None
+        }
+
+    def store_image(self, image: dict, request: dict, output_name: str) -> dict:
+        """
+        保存在别处生成的图像（离线批量模式取回的结果），并写入图像缓存
+
+        Args:
+            image: {"image_data": base64, "mime_type"}
+            request: image_request() 的返回值
+            output_name: 输出文件名（不含扩展名）
+
+        Returns:
+            与 run() 相同格式的结果（不含 image_data）
+        """
+        output_path = save_image(image["image_data"], image["mime_type"], str(self.output_dir / output_name))
+        if request.get("cache_key"):
+            self.cache.put(request["cache_key"], output_path)
+        return {
+            "success": True,
+            "mime_type": image["mime_type"],
+            "output_path": output_path,
+            "image_size": request["image_size"],
+            "seed": request["seed"],
+            "draft": request["draft"]
+        }
+
+    def prepare_design(self, design, index: int, draft: bool = None) -> tuple:
+        """从设计中取出提示词、标题和输出文件名（草稿带 _draft 后缀，定稿不会覆盖草稿）"""
+        if isinstance(design, dict):
+            prompt = design.get("image_prompt") or design.get("prompt")
+            title = design.get("title", f"image_{index:02d}")
+        else:
+            prompt = design
+            title = f"image_{index:02d}"
+
+        # 清理文件名
+        safe_title = "".join(c if c.isalnum() or c in "._-" else "_" for c in title)
+        draft = self.use_draft(draft)
+        suffix = "_draft" if draft else ""
+        return prompt, title, f"{index:02d}_{safe_title}{suffix}"
+
+    def run_design(self, design, index: int, draft: bool = None) -> dict:
+        """
+        生成单个设计的图像（文件名与 run_batch 一致）
+
+        Args:
+            design: 单个设计或提示词
+            index: 序号（从1开始）
+            draft: 是否以草稿尺寸生成，为 None 时沿用实例设置
+
+        Returns:
+            生成结果字典
+        """
+        draft = self.use_draft(draft)
+        prompt, title, output_name = self.prepare_design(design, index, draft)
+        result = self.run(prompt, output_name, draft=draft)
+        result["title"] = title
+        result["index"] = index
+        return result
+
+    @traced("skill.generate_batch")
+    def run_batch(self, designs: list | dict, delay: float = 2.0, prestarted: dict = None,
+                  draft: bool = None) -> list:
         """
         批量生成图像
 
         Args:
             designs: design skill的输出，或包含prompt的列表
             delay: 请求间隔（秒）
+            prestarted: 已提前开始生成的图像 {提示词: Future}（如设计阶段流式返回时），
+                        按提示词与最终设计匹配并复用其结果；未匹配上的尚未开始则取消
+            draft: 是否以草稿尺寸生成，为 None 时沿用实例设置
 
         Returns:
             生成结果列表
         """
-        if isinstance(designs, dict):
-            if "designs" in designs:
-                designs = designs["designs"]
-
-        if isinstance(designs, str):
-            designs = json.loads(designs)
+        prestarted = dict(prestarted or {})
+        draft = self.use_draft(draft)
+        designs = self._design_list(designs)
 
         results = []
         total = len(designs)
 
+        # 最终设计中已不存在的提前生成（校验失败或被修复调用改写的条目）不再开始
+        prompts = {self.prepare_design(design, i, draft)[0] for i, design in enumerate(designs, 1)}
+        for prompt in [p for p in prestarted if p not in prompts]:
+            prestarted[prompt].cancel()
+        early = list(prestarted.values())
+
         print(f"📦 批量生成 {total} 张图像...")
         print("=" * 50)
 
         for i, design in enumerate(designs, 1):
-            # 提取提示词和标题
-            if isinstance(design, dict):
-                prompt = design.get("image_prompt") or design.get("prompt")
-                title = design.get("title", f"image_{i:02d}")
-            else:
-                prompt = design
-                title = f"image_{i:02d}"
-
-            # 清理文件名
-            safe_title = "".join(c if c.isalnum() or c in "._-" else "_" for c in title)
-            output_name = f"{i:02d}_{safe_title}"
-
+            prompt, title, output_name = self.prepare_design(design, i, draft)
+
+            started = prestarted.pop(prompt, None)
+            if started and not started.cancelled():
+                print(f"\n[{i}/{total}] {title} (已提前开始生成)")
+                results.append(self._adopt(started.result(), title, i, output_name))
+                continue
+
+            # 等提前生成的请求结束再发起新的，保持图像请求串行
+            for future in early:
+                if not future.cancelled():
+                    future.exception()
             print(f"\n[{i}/{total}] {title}")
-
-            result = self.run(prompt, output_name)
-            result["title"] = title
-            result["index"] = i
-            results.append(result)
+            results.append(self.run_design(design, i, draft))
 
             # 间隔
             if i < total:
@@ -129,9 +278,80 @@ class GenerateSkill:
         success_count = sum(1 for r in results if r.get("success"))
         print("\n" + "=" * 50)
         print(f"完成: {success_count}/{total} 成功")
+        if draft:
+            print(f"草稿尺寸 {DRAFT_IMAGE_SIZE}，确认后使用 /finalize <序号|all> 以 {DEFAULT_IMAGE_SIZE} 定稿")
+
+        return results
+
+    def _adopt(self, result: dict, title: str, index: int, output_name: str) -> dict:
+        """复用提前生成的结果：流式返回时的序号可能与最终设计列表不同，按最终序号重命名文件"""
+        result = dict(result, title=title, index=index)
+        path = result.get("output_path")
+        if result.get("success") and path:
+            target = self.output_dir / f"{output_name}{Path(path).suffix}"
+            if Path(path) != target:
+                os.replace(path, target)
+                result["output_path"] = str(target)
+        return result
+
+    @traced("skill.generate_finalize")
+    def finalize(self, designs: list | dict, indices: list = None, delay: float = 2.0) -> list:
+        """
+        定稿：以完整尺寸、相同提示词和种子重新生成选中的设计
+
+        Args:
+            designs: design skill的输出，或包含prompt的列表
+            indices: 要定稿的序号（从1开始），为 None 时全部定稿
+            delay: 请求间隔（秒）
+
+        Returns:
+            生成结果列表
+        """
+        provider = self.client.image_provider
+        if provider and not provider.supports_image_size:
+            # 草稿模式在这类提供商上无效，图像已按正常尺寸生成，重新生成只会重复计费
+            print(f"⚠ 图像提供商 {provider.provider_id} 不支持指定输出尺寸，图像已按 {DEFAULT_IMAGE_SIZE} 生成，无需定稿")
+            return []
+
+        designs = self._design_list(designs)
+        indices = indices or list(range(1, len(designs) + 1))
+
+        results = []
+        total = len(indices)
+
+        print(f"🎯 定稿 {total} 张图像 ({DEFAULT_IMAGE_SIZE})...")
+        print("=" * 50)
+
+        for n, i in enumerate(indices, 1):
+            if not 1 <= i <= len(designs):
+                print(f"✗ 序号超出范围: {i} (1-{len(designs)})")
+                continue
+
+            _, title, _ = self.prepare_design(designs[i - 1], i, draft=False)
+            print(f"\n[{n}/{total}] {title}")
+            results.append(self.run_design(designs[i - 1], i, draft=False))
+
+            if n < total:
+                time.sleep(delay)
+
+        success_count = sum(1 for r in results if r.get("success"))
+        print("\n" + "=" * 50)
+        print(f"定稿完成: {success_count}/{total} 成功")
 
         return results
 
+    @staticmethod
+    def _design_list(designs: list | dict | str) -> list:
+        """统一为设计列表"""
+        if isinstance(designs, dict):
+            if "designs" in designs:
+                designs = designs["designs"]
+
+        if isinstance(designs, str):
+            designs = json.loads(designs)
+
+        return designs
+
     def format_output(self, results: list) -> str:
         """格式化批量生成结果"""
         lines = [
@@ -155,11 +375,14 @@ if __name__ == "__main__":
 
     if len(sys.argv) < 2:
         print("Usage:")
-        print("  python generate.py <prompt> [output_name]")
-        print("  python generate.py --batch <designs_json>")
+        print("  python generate.py <prompt> [output_name] [--draft]")
+        print("  python generate.py --batch <designs_json> [--draft]")
+        print("  python generate.py --finalize <designs_json> [1,3|all]")
         sys.exit(1)
 
-    skill = GenerateSkill()
+    draft = "--draft" in sys.argv
+    sys.argv = [a for a in sys.argv if a != "--draft"]
+    skill = GenerateSkill(draft=draft)
 
     if sys.argv[1] == "--batch":
         if len(sys.argv) < 3:
@@ -172,6 +395,19 @@ if __name__ == "__main__":
         results = skill.run_batch(designs)
         print(skill.format_output(results))
 
+    elif sys.argv[1] == "--finalize":
+        if len(sys.argv) < 3:
+            print("Please provide designs JSON file")
+            sys.exit(1)
+
+        with open(sys.argv[2]) as f:
+            designs = json.load(f)
+
+        selection = sys.argv[3] if len(sys.argv) > 3 else "all"
+        indices = None if selection == "all" else [int(i) for i in selection.split(",")]
+        results = skill.finalize(designs, indices)
+        print(skill.format_output(results))
+
     else:
         prompt = sys.argv[1]
         output_name = sys.argv[2] if len(sys.argv) > 2 else None
@@ -3,16 +3,24 @@ Skill: /learn - 从示例学习
 输入包含文章和生成图片的文件夹，反向分析并扩充 frameworks、charts、styles
 """
 
-import json
-import base64
 import sys
+import shutil
+import tempfile
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
 from typing import List, Dict, Tuple
 sys.path.append(str(Path(__file__).parent.parent))
 
 from lib.api import GeminiClient
-from lib.registry import Registry
-from config import LOCKED_STYLE_IDS
+from lib.registry import Registry, RegistryOverlay
+from lib import tracing
+from lib.tracing import traced
+from lib.json_utils import parse_json_response, JSONExtractionError
+from lib.image_prep import image_preparer
+from lib import image_similarity
+from config import (LOCKED_STYLE_IDS, PRESCREEN_ENABLED, LEARN_BATCH_WORKERS, LEARN_BATCH_IMAGE_BUDGET,
+                    LEARN_VERIFY_MIN_IMAGES)
 from .analyze import AnalyzeSkill
 from .map_framework import MapFrameworkSkill
 from .design import DesignSkill
@@ -22,6 +30,8 @@ from .generate import GenerateSkill
 IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp'}
 # 支持的文章格式
 ARTICLE_EXTENSIONS = {'.md', '.txt', '.markdown'}
+# 候选类别 -> 分析结果中的字段
+CANDIDATE_KINDS = {'frameworks': 'frameworks', 'charts': 'chart_types', 'styles': 'visual_styles'}
 
 
 VERIFY_PROMPT = """你是一位专业的图像比较分析师。
@@ -70,6 +80,33 @@ VERIFY_PROMPT = """你是一位专业的图像比较分析师。
 注意：average_score >= 70 时 passed 为 true
 """
 
+VERIFY_SCHEMA = {
+    "type": "object",
+    "required": ["average_score"],
+    "properties": {
+        "scores": {
+            "type": "object",
+            "properties": {
+                "visual_style": {"type": "number"},
+                "chart_type": {"type": "number"},
+                "concept_expression": {"type": "number"},
+                "overall_quality": {"type": "number"}
+            }
+        },
+        "average_score": {"type": "number"},
+        "passed": {"type": "boolean"},
+        "analysis": {
+            "type": "object",
+            "properties": {
+                "strengths": {"type": "array", "items": {"type": "string"}},
+                "weaknesses": {"type": "array", "items": {"type": "string"}},
+                "suggestions": {"type": "array", "items": {"type": "string"}}
+            }
+        },
+        "verdict": {"type": "string"}
+    }
+}
+
 
 ANALYZE_EXAMPLE_PROMPT = """你是一位博学的视觉设计分析专家，精通理论框架、图表类型和视觉风格。
 
@@ -168,31 +205,51 @@ ANALYZE_EXAMPLE_PROMPT = """你是一位博学的视觉设计分析专家，精
 }}
 """
 
+_NAMED_ITEM = {
+    "type": "object",
+    "required": ["id", "name"],
+    "properties": {
+        "id": {"type": "string"},
+        "name": {"type": "string"},
+        "name_en": {"type": "string"},
+        "description": {"type": "string"}
+    }
+}
+
+ANALYZE_EXAMPLE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "frameworks": {"type": "array", "items": _NAMED_ITEM},
+        "chart_types": {"type": "array", "items": _NAMED_ITEM},
+        "visual_styles": {"type": "array", "items": _NAMED_ITEM},
+        "analysis_notes": {"type": "string"}
+    }
+}
+
 
 class LearnExampleSkill:
     """从示例学习技能 - 带闭环验证"""
 
     name = "learn"
     description = "从示例文件夹学习新的frameworks、charts、styles（含验证）"
-    usage = "/learn <文件夹路径> [--no-verify] [--threshold=70]"
+    usage = "/learn <文件夹路径> [--no-verify] [--threshold=70] [--batch] [--workers=4] [--budget=30]"
 
-    def __init__(self, verify: bool = True, pass_threshold: int = 70):
+    def __init__(self, verify: bool = True, pass_threshold: int = 70, registry: Registry = None):
         """
         Args:
             verify: 是否进行闭环验证（正向生成并比较）
             pass_threshold: 验证通过的分数阈值 (0-100)
+            registry: 学习结果写入的注册表（默认全局单例）
         """
         self.client = GeminiClient()
-        self.registry = Registry()
+        self.registry = registry or Registry()
         self.verify = verify
         self.pass_threshold = pass_threshold
 
-        # 用于验证的技能
+        # 用于验证的技能（映射/设计/生成在每次验证时基于候选视图创建）
         self.analyze_skill = AnalyzeSkill()
-        self.map_skill = MapFrameworkSkill()
-        self.design_skill = DesignSkill()
-        self.generate_skill = None  # 延迟初始化
 
+    @traced("skill.learn")
     def run(self, folder_path: str) -> dict:
         """
         从示例文件夹学习
@@ -287,7 +344,7 @@ class LearnExampleSkill:
 
             # 检查是否通过验证
             if not verification_result.get("passed", False):
-                print(f"\n  ✗ 验证未通过 (分数: {verification_result.get('average_score', 0)}/{self.pass_threshold})")
+                print(f"\n  ✗ 验证未通过 ({self._score_text(verification_result, self.pass_threshold)})")
                 print(f"  → 原因: {verification_result.get('verdict', 'N/A')}")
                 print("  → 学习结果未保存")
 
@@ -301,7 +358,7 @@ class LearnExampleSkill:
                     "summary": self._get_summary(0, 0, 0)
                 }
 
-            print(f"\n  ✓ 验证通过! (分数: {verification_result.get('average_score', 0)}/{self.pass_threshold})")
+            print(f"\n  ✓ 验证通过! ({self._score_text(verification_result, self.pass_threshold)})")
 
         # 5. 持久化学习结果
         print("\n" + "-" * 40)
@@ -333,7 +390,7 @@ class LearnExampleSkill:
         print(f"新增 Chart Types: {result['summary']['charts_added']}")
         print(f"新增 Visual Styles: {result['summary']['styles_added']}")
         if self.verify and verification_result.get("passed"):
-            print(f"验证分数: {verification_result.get('average_score', 0)}")
+            print(f"验证结果: {self._score_text(verification_result)}")
         print("-" * 40)
         print(f"框架库总数: {result['summary']['total_frameworks']}")
         print(f"图表库总数: {result['summary']['total_charts']}")
@@ -342,6 +399,186 @@ class LearnExampleSkill:
 
         return result
 
+    @traced("skill.learn_batch")
+    def run_batch(self, root_path: str, workers: int = LEARN_BATCH_WORKERS,
+                  image_budget: int = LEARN_BATCH_IMAGE_BUDGET) -> dict:
+        """
+        批量学习：扫描根目录下的所有示例文件夹
+
+        并发分析各文件夹；候选跨文件夹去重后再验证，同一候选只验证一次；
+        所有验证共享一个生图预算；通过验证的候选在最后一次性写入注册表
+
+        Args:
+            root_path: 示例根目录（子文件夹各包含一篇文章和若干图片）
+            workers: 并发分析的文件夹数
+            image_budget: 所有验证共享的生图数量上限
+
+        Returns:
+            批量学习结果
+        """
+        root = Path(root_path)
+        if not root.exists() or not root.is_dir():
+            return {"error": f"文件夹不存在: {root_path}"}
+
+        examples = self._find_examples(root)
+        if not examples:
+            return {"error": "未找到示例文件夹（需包含文章和图片）"}
+
+        print("=" * 60)
+        print("📚 BATCH LEARN FROM EXAMPLES" + (" (with verification)" if self.verify else ""))
+        print("=" * 60)
+        print(f"根目录: {root_path}")
+        print(f"示例文件夹: {len(examples)} 个")
+        if self.verify:
+            print(f"验证阈值: {self.pass_threshold} · 生图预算: {image_budget}")
+
+        # 1. 并发分析
+        print("\n" + "-" * 40)
+        print(f"🔬 STEP 1: 并发分析示例作品 ({workers} 路)...")
+        print("-" * 40)
+
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(examples)))) as pool:
+            futures = [tracing.submit(pool, self._analyze_example, ex["article"], ex["images"])
+                       for ex in examples]
+
+        for ex, future in zip(examples, futures):
+            try:
+                ex["analysis"] = future.result()
+            except Exception as e:
+                ex["analysis"] = {"error": str(e)}
+            error = ex["analysis"].get("error")
+            print(f"  {'✗' if error else '✓'} {ex['folder'].name}" + (f": {error}" if error else ""))
+
+        # 2. 跨文件夹去重
+        print("\n" + "-" * 40)
+        print("📋 STEP 2: 合并去重候选知识...")
+        print("-" * 40)
+
+        merged = {key: [] for key in CANDIDATE_KINDS.values()}
+        sources: Dict[tuple, List[int]] = {}  # (分析字段, ID) -> 提出该候选的文件夹序号
+        for i, ex in enumerate(examples):
+            if "error" in ex["analysis"]:
+                continue
+            for key in merged:
+                for item in ex["analysis"].get(key, []):
+                    item_id = item.get("id")
+                    if not item_id:
+                        continue
+                    if (key, item_id) not in sources:
+                        merged[key].append(item)
+                        sources[(key, item_id)] = []
+                    sources[(key, item_id)].append(i)
+
+        candidates = self._extract_candidates(merged)
+
+        approved = {kind: [] for kind in CANDIDATE_KINDS}
+        verifications = []
+        deferred = []
+
+        # 3. 验证（共享预算）
+        if candidates["has_new"] and not self.verify:
+            approved = {kind: candidates[kind] for kind in CANDIDATE_KINDS}
+        elif candidates["has_new"]:
+            print("\n" + "-" * 40)
+            print("🔄 STEP 3: 闭环验证（去重后，共享生图预算）...")
+            print("-" * 40)
+
+            pending = [(kind, item) for kind in CANDIDATE_KINDS for item in candidates[kind]]
+            budget = image_budget
+            while pending:
+                if budget <= 0:
+                    deferred = [item["id"] for _, item in pending]
+                    print(f"  ⚠ 生图预算已用完，{len(deferred)} 个候选留待下次验证")
+                    break
+
+                # 贪心：选能一次验证最多未验证候选的文件夹
+                counts = Counter(i for kind, item in pending for i in sources[(CANDIDATE_KINDS[kind], item["id"])])
+                best = max(counts, key=lambda i: (counts[i], -i))
+                group = [(kind, item) for kind, item in pending
+                         if best in sources[(CANDIDATE_KINDS[kind], item["id"])]]
+                pending = [(kind, item) for kind, item in pending
+                           if best not in sources[(CANDIDATE_KINDS[kind], item["id"])]]
+
+                ex = examples[best]
+                group_candidates = {kind: [item for k, item in group if k == kind] for kind in CANDIDATE_KINDS}
+                group_candidates["has_new"] = True
+                max_images = min(3, budget)
+
+                print(f"\n  → {ex['folder'].name}: 验证 {len(group)} 个候选 (剩余预算 {budget} 张)")
+                result = self._verify_by_regeneration(
+                    ex["article"], ex["images"], group_candidates, ex["folder"], max_images=max_images
+                )
+                budget -= result.get("images_generated", max_images)
+                verifications.append({
+                    "folder": str(ex["folder"]),
+                    "candidates": [item["id"] for _, item in group],
+                    "result": result
+                })
+
+                if result.get("passed"):
+                    print(f"  ✓ 验证通过 ({self._score_text(result)})")
+                    for kind in CANDIDATE_KINDS:
+                        approved[kind].extend(group_candidates[kind])
+                else:
+                    reason = result.get("error") or result.get("verdict", "N/A")
+                    print(f"  ✗ 验证未通过 ({self._score_text(result)}): {reason}")
+
+        # 4. 一次性持久化
+        learning_result = {"frameworks_added": 0, "charts_added": 0, "styles_added": 0}
+        if any(approved.values()):
+            print("\n" + "-" * 40)
+            print("💾 STEP 4: 保存学习结果...")
+            print("-" * 40)
+            learning_result = self._persist_candidates(approved)
+
+        result = {
+            "root": root_path,
+            "folders": [{
+                "folder": str(ex["folder"]),
+                "article": str(ex["article_path"]),
+                "images": len(ex["images"]),
+                "error": ex["analysis"].get("error")
+            } for ex in examples],
+            "candidates": candidates,
+            "verifications": verifications,
+            "deferred": deferred,
+            "learning": learning_result,
+            "summary": self._get_summary(
+                learning_result.get("frameworks_added", 0),
+                learning_result.get("charts_added", 0),
+                learning_result.get("styles_added", 0)
+            )
+        }
+
+        print("\n" + "=" * 60)
+        print("📊 批量学习完成!")
+        print("=" * 60)
+        print(f"文件夹: {len(examples)} 个 · 去重后候选: "
+              f"{sum(len(candidates[kind]) for kind in CANDIDATE_KINDS)} 个 · 验证: {len(verifications)} 次")
+        print(f"新增 Frameworks: {result['summary']['frameworks_added']}")
+        print(f"新增 Chart Types: {result['summary']['charts_added']}")
+        print(f"新增 Visual Styles: {result['summary']['styles_added']}")
+        if deferred:
+            print(f"未验证（预算不足）: {', '.join(deferred)}")
+        print("=" * 60)
+
+        return result
+
+    def _find_examples(self, root: Path) -> List[dict]:
+        """查找根目录下所有包含文章和图片的示例文件夹（跳过 _ 和 . 开头的目录）"""
+        examples = []
+        for folder in [root] + sorted(p for p in root.rglob("*") if p.is_dir()):
+            if any(part.startswith(("_", ".")) for part in folder.relative_to(root).parts):
+                continue
+            images = self._find_images(folder)
+            if not images:
+                continue
+            article_path, article = self._find_article(folder)
+            if article:
+                examples.append({"folder": folder, "article_path": article_path,
+                                 "article": article, "images": images})
+        return examples
+
     def _get_summary(self, fw_added: int, charts_added: int, styles_added: int) -> dict:
         """生成摘要"""
         return {
@@ -393,18 +630,25 @@ class LearnExampleSkill:
 
         return candidates
 
+    @traced("skill.learn_verify")
     def _verify_by_regeneration(self, article: str, original_images: List[Path],
-                                 candidates: dict, output_folder: Path) -> dict:
-        """通过重新生成来验证学习结果"""
+                                 candidates: dict, output_folder: Path, max_images: int = 3) -> dict:
+        """通过重新生成来验证学习结果（最多生成 max_images 张）"""
 
-        # 临时添加候选内容到注册表（不持久化）
+        # 候选内容只加入本次验证的写时复制视图，共享注册表不受影响
         print("  → 临时加载候选知识...")
-        for fw in candidates["frameworks"]:
-            self.registry.add_framework(fw["id"], fw, persist=False)
-        for chart in candidates["charts"]:
-            self.registry.add_chart_type(chart["id"], chart, persist=False)
-        for style in candidates["styles"]:
-            self.registry.add_visual_style(style["id"], style, persist=False)
+        overlay = RegistryOverlay(self.registry)
+        overlay.add_many(
+            frameworks={fw["id"]: fw for fw in candidates["frameworks"]},
+            chart_types={chart["id"]: chart for chart in candidates["charts"]},
+            visual_styles={style["id"]: style for style in candidates["styles"]}
+        )
+        verify_output_dir = None
+        renders = None
+
+        # 分析文章的同时在后台预加载原图（多模态数据 + 预筛指纹）
+        loader = ThreadPoolExecutor(max_workers=1)
+        originals = tracing.submit(loader, self._load_originals, original_images[:5])
 
         try:
             # 正向生成流程
@@ -414,101 +658,129 @@ class LearnExampleSkill:
                 return {"error": f"分析失败: {analyze_result['error']}"}
 
             print("  → 映射框架...")
-            map_result = self.map_skill.run(analyze_result)
+            map_result = MapFrameworkSkill(registry=overlay).run(analyze_result)
             if "error" in map_result:
                 return {"error": f"映射失败: {map_result['error']}"}
 
             print("  → 设计可视化...")
             # 使用候选风格（如果有）
             style_id = candidates["styles"][0]["id"] if candidates["styles"] else None
-            design_skill = DesignSkill(style_id)
+            design_skill = DesignSkill(style_id, registry=overlay)
             design_result = design_skill.run(map_result)
             if "error" in design_result:
                 return {"error": f"设计失败: {design_result['error']}"}
 
             # 生成图片
             print("  → 生成验证图片...")
-            verify_output_dir = output_folder / "_verify_temp"
-            verify_output_dir.mkdir(exist_ok=True)
+            verify_output_dir = Path(tempfile.mkdtemp(prefix="_verify_temp_", dir=output_folder))
+            generate_skill = GenerateSkill(str(verify_output_dir), registry=overlay)
 
-            self.generate_skill = GenerateSkill(str(verify_output_dir))
-
-            # 只生成前3张用于验证
-            designs = design_result.get("designs", [])[:3]
+            # 只并发生成比较所需的张数，某张失败时再补生成下一个设计，够数即进入比较
+            designs = design_result.get("designs", [])[:max_images]
             generated_images = []
-
-            for i, design in enumerate(designs):
-                result = self.generate_skill.run(
-                    design.get("image_prompt"),
-                    f"verify_{i+1}"
-                )
-                if result.get("success") and result.get("output_path"):
-                    generated_images.append(Path(result["output_path"]))
-                    print(f"    ✓ 生成: verify_{i+1}")
+            enough = min(LEARN_VERIFY_MIN_IMAGES, len(designs))
+            queue = list(enumerate(designs))
+            running = {}
+
+            def start_next():
+                i, design = queue.pop(0)
+                future = tracing.submit(renders, generate_skill.run, design.get("image_prompt"), f"verify_{i+1}")
+                running[future] = f"verify_{i+1}"
+
+            renders = ThreadPoolExecutor(max_workers=max(1, enough))
+            for _ in range(enough):
+                start_next()
+            while running and len(generated_images) < enough:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    result = future.result()
+                    if result.get("success") and result.get("output_path"):
+                        generated_images.append(Path(result["output_path"]))
+                        print(f"    ✓ 生成: {name}")
+                    elif queue:
+                        start_next()
+            images_started = len(designs) - len(queue)
 
             if not generated_images:
-                return {"error": "未能生成任何验证图片"}
-
-            # 比较图片
-            print("  → 比较原始图片与生成图片...")
-            comparison_result = self._compare_images(
-                original_images[:5],  # 原始图片取前5张
-                generated_images
-            )
-
-            # 清理临时文件
-            import shutil
-            if verify_output_dir.exists():
-                shutil.rmtree(verify_output_dir)
+                return {"error": "未能生成任何验证图片", "images_generated": images_started}
+
+            loaded = originals.result()
+
+            # 本地预筛：明显不符时不再调用多模态模型（显式配置 PRESCREEN_ACCEPT_SCORE 时明显相符也跳过）
+            prescreen = None
+            if PRESCREEN_ENABLED:
+                prescreen = image_similarity.prescreen(original_images[:5], generated_images,
+                                                       original_prints=loaded["prints"])
+            if prescreen:
+                print(f"  → 本地预筛: 相似度 {prescreen['score']} ({prescreen['decision']})")
+
+            if prescreen and prescreen["decision"] != "uncertain":
+                passed = prescreen["decision"] == "accept"
+                # 相似度与模型评分不是同一标尺，单独记录，不写入 average_score
+                comparison_result = {
+                    "prescreen_score": prescreen["score"],
+                    "passed": passed,
+                    "verdict": f"本地预筛{'通过' if passed else '未通过'}（感知哈希+颜色直方图），未调用模型评分",
+                    "method": "prescreen"
+                }
+            else:
+                # 比较图片
+                print("  → 比较原始图片与生成图片...")
+                comparison_result = self._compare_images(
+                    original_images[:5],  # 原始图片取前5张
+                    generated_images,
+                    original_payloads=loaded["images"]
+                )
+                comparison_result["method"] = "llm"
+            comparison_result["prescreen"] = prescreen
+            comparison_result["images_generated"] = images_started
 
             return comparison_result
 
         except Exception as e:
             return {"error": str(e)}
         finally:
-            # 移除临时添加的候选内容
-            for fw in candidates["frameworks"]:
-                if fw["id"] in self.registry.frameworks:
-                    del self.registry.frameworks[fw["id"]]
-            for chart in candidates["charts"]:
-                if chart["id"] in self.registry.chart_types:
-                    del self.registry.chart_types[chart["id"]]
-            for style in candidates["styles"]:
-                if style["id"] in self.registry.visual_styles:
-                    del self.registry.visual_styles[style["id"]]
-
-    def _compare_images(self, original_paths: List[Path], generated_paths: List[Path]) -> dict:
-        """使用多模态AI比较两组图片"""
-
-        # 加载原始图片
-        original_images = []
-        for img_path in original_paths:
-            try:
-                with open(img_path, "rb") as f:
-                    img_bytes = f.read()
-                    img_base64 = base64.b64encode(img_bytes).decode('utf-8')
-                    ext = img_path.suffix.lower()
-                    mime_type = {'.jpg': 'image/jpeg', '.jpeg': 'image/jpeg',
-                               '.png': 'image/png', '.gif': 'image/gif',
-                               '.webp': 'image/webp'}.get(ext, 'image/jpeg')
-                    original_images.append({"mime_type": mime_type, "data": img_base64})
-            except:
-                continue
-
-        # 加载生成图片
-        generated_images = []
-        for img_path in generated_paths:
+            loader.shutdown(wait=False, cancel_futures=True)
+            # 正常结束时没有在途的生成；出错退出时不等待仍在进行的生成（候选视图随函数结束丢弃，无需回滚）
+            if renders:
+                renders.shutdown(wait=False, cancel_futures=True)
+            if verify_output_dir:
+                shutil.rmtree(verify_output_dir, ignore_errors=True)
+
+    @staticmethod
+    def _score_text(result: dict, threshold: float = None) -> str:
+        """验证结果的分数说明（本地预筛的相似度与模型评分不是同一标尺，分开显示）"""
+        if result.get("method") == "prescreen":
+            return f"本地预筛相似度: {result.get('prescreen_score')}，未调用模型评分"
+        score = result.get("average_score", 0)
+        return f"分数: {score}/{threshold}" if threshold is not None else f"分数: {score}"
+
+    def _load_originals(self, paths: List[Path]) -> dict:
+        """预加载原图：多模态调用的图片数据，以及本地预筛的指纹"""
+        loaded = {
+            "images": [img for _, img, _ in image_preparer.prepare_many(paths) if img],
+            "prints": None
+        }
+        if PRESCREEN_ENABLED and image_similarity.available():
             try:
-                with open(img_path, "rb") as f:
-                    img_bytes = f.read()
-                    img_base64 = base64.b64encode(img_bytes).decode('utf-8')
-                    ext = img_path.suffix.lower()
-                    mime_type = {'.jpg': 'image/jpeg', '.jpeg': 'image/jpeg',
-                               '.png': 'image/png', '.gif': 'image/gif',
-                               '.webp': 'image/webp'}.get(ext, 'image/jpeg')
-                    generated_images.append({"mime_type": mime_type, "data": img_base64})
-            except:
-                continue
+                loaded["prints"] = image_similarity.fingerprint_many(paths)
+            except Exception:
+                pass  # 预筛时会重新计算并报告错误
+        return loaded
+
+    def _compare_images(self, original_paths: List[Path], generated_paths: List[Path],
+                        original_payloads: List[dict] = None) -> dict:
+        """使用多模态AI比较两组图片（original_payloads 为已预加载的原图数据）"""
+
+        # 并行缩放、编码（按文件哈希缓存）
+        if original_payloads is None:
+            prepared = image_preparer.prepare_many(list(original_paths) + list(generated_paths))
+            original_images = [img for _, img, _ in prepared[:len(original_paths)] if img]
+            generated_images = [img for _, img, _ in prepared[len(original_paths):] if img]
+        else:
+            original_images = original_payloads
+            generated_images = [img for _, img, _ in image_preparer.prepare_many(generated_paths) if img]
 
         if not original_images or not generated_images:
             return {"error": "无法加载比较图片"}
@@ -529,17 +801,8 @@ class LearnExampleSkill:
         all_images = original_images + generated_images
 
         try:
-            response = self.client.generate_with_images(prompt, all_images)
-
-            # 解析JSON
-            text = response.strip()
-            if text.startswith("```"):
-                text = text.split("```")[1]
-                if text.startswith("json"):
-                    text = text[4:]
-            text = text.strip()
-
-            result = json.loads(text)
+            response = self.client.generate_with_images(prompt, all_images, stage="learn_verify")
+            result = parse_json_response(response, VERIFY_SCHEMA, repair_client=self.client)
 
             # 根据阈值判断是否通过
             avg_score = result.get("average_score", 0)
@@ -547,7 +810,7 @@ class LearnExampleSkill:
 
             return result
 
-        except json.JSONDecodeError as e:
+        except JSONExtractionError as e:
             return {"error": f"JSON解析失败: {str(e)}", "passed": False}
         except Exception as e:
             return {"error": str(e), "passed": False}
@@ -563,20 +826,24 @@ class LearnExampleSkill:
             "new_styles": []
         }
 
+        # 一次性写入，避免部分候选落盘而其余失败
+        self.registry.add_many(
+            frameworks={fw["id"]: fw for fw in candidates["frameworks"]},
+            chart_types={chart["id"]: chart for chart in candidates["charts"]},
+            visual_styles={style["id"]: style for style in candidates["styles"]}
+        )
+
         for fw in candidates["frameworks"]:
-            self.registry.add_framework(fw["id"], fw, persist=True)
             result["frameworks_added"] += 1
             result["new_frameworks"].append(fw)
             print(f"  ✓ 保存框架: {fw.get('name')} ({fw['id']})")
 
         for chart in candidates["charts"]:
-            self.registry.add_chart_type(chart["id"], chart, persist=True)
             result["charts_added"] += 1
             result["new_charts"].append(chart)
             print(f"  ✓ 保存图表: {chart.get('name')} ({chart['id']})")
 
         for style in candidates["styles"]:
-            self.registry.add_visual_style(style["id"], style, persist=True)
             result["styles_added"] += 1
             result["new_styles"].append(style)
             print(f"  ✓ 保存风格: {style.get('name')} ({style['id']})")
@@ -612,51 +879,24 @@ class LearnExampleSkill:
             image_count=len(image_paths)
         )
 
-        # 读取图片并转为base64
+        # 并行缩放、编码（按文件哈希缓存）
         images_data = []
-        for img_path in image_paths[:10]:  # 最多10张图
-            try:
-                with open(img_path, "rb") as f:
-                    img_bytes = f.read()
-                    img_base64 = base64.b64encode(img_bytes).decode('utf-8')
-
-                    # 确定MIME类型
-                    ext = img_path.suffix.lower()
-                    mime_map = {
-                        '.jpg': 'image/jpeg',
-                        '.jpeg': 'image/jpeg',
-                        '.png': 'image/png',
-                        '.gif': 'image/gif',
-                        '.webp': 'image/webp'
-                    }
-                    mime_type = mime_map.get(ext, 'image/jpeg')
-
-                    images_data.append({
-                        "mime_type": mime_type,
-                        "data": img_base64
-                    })
-                    print(f"  ✓ 加载图片: {img_path.name}")
-            except Exception as e:
-                print(f"  ✗ 加载失败: {img_path.name} - {e}")
+        for img_path, img, error in image_preparer.prepare_many(image_paths[:10]):  # 最多10张图
+            if img:
+                images_data.append(img)
+                print(f"  ✓ 加载图片: {img_path.name}")
+            else:
+                print(f"  ✗ 加载失败: {img_path.name} - {error}")
 
         if not images_data:
             return {"error": "无法加载任何图片"}
 
         # 调用多模态API
         try:
-            response = self.client.generate_with_images(prompt, images_data)
-
-            # 解析JSON
-            text = response.strip()
-            if text.startswith("```"):
-                text = text.split("```")[1]
-                if text.startswith("json"):
-                    text = text[4:]
-            text = text.strip()
-
-            return json.loads(text)
+            response = self.client.generate_with_images(prompt, images_data, stage="learn")
+            return parse_json_response(response, ANALYZE_EXAMPLE_SCHEMA, repair_client=self.client)
 
-        except json.JSONDecodeError as e:
+        except JSONExtractionError as e:
             print(f"JSON解析错误: {e}")
             return {"error": f"JSON解析失败: {str(e)}", "raw_response": response}
         except Exception as e:
@@ -717,9 +957,20 @@ if __name__ == "__main__":
 
     if len(sys.argv) < 2:
         print("Usage: python learn_example.py <folder_path>")
+        print("       python learn_example.py --batch <root_path>")
         sys.exit(1)
 
     skill = LearnExampleSkill()
+
+    if sys.argv[1] == "--batch":
+        if len(sys.argv) < 3:
+            print("Usage: python learn_example.py --batch <root_path>")
+            sys.exit(1)
+        result = skill.run_batch(sys.argv[2])
+        if "error" in result:
+            print(f"错误: {result['error']}")
+        sys.exit(0)
+
     result = skill.run(sys.argv[1])
 
     if "error" in result:
@@ -9,10 +9,14 @@ from pathlib import Path
 sys.path.append(str(Path(__file__).parent.parent))
 
 from lib.api import client
-from lib.registry import registry
+from lib.registry import Registry, registry as default_registry
+from lib.tracing import traced
+from lib.json_utils import JSONExtractionError
+from lib.prompt_cache import PrefixedPrompt
 
 
-MAP_PROMPT = '''你是一个跨学科理论家，擅长将概念映射到科学和哲学框架。
+# 静态前缀在前（框架库与输出格式，多次运行间不变，可由提供商缓存），输入概念在后
+MAP_PREFIX = '''你是一个跨学科理论家，擅长将概念映射到科学和哲学框架。
 
 **可用的理论框架库：**
 
@@ -25,11 +29,6 @@ MAP_PROMPT = '''你是一个跨学科理论家，擅长将概念映射到科学
 3. 提供理论框架带来的新洞察
 4. 注意框架的推荐图表类型，如果框架有推荐图表，请在输出中包含
 
-**输入概念：**
-```json
-{concepts}
-```
-
 **输出格式（必须是有效JSON）：**
 ```json
 {{
@@ -50,10 +49,44 @@ MAP_PROMPT = '''你是一个跨学科理论家，擅长将概念映射到科学
   ]
 }}
 ```
+'''
+
+MAP_PROMPT = '''
+**输入概念：**
+```json
+{concepts}
+```
 
 请直接输出JSON，不要有任何其他文字。
 '''
 
+MAP_SCHEMA = {
+    "type": "object",
+    "required": ["mappings"],
+    "properties": {
+        "mappings": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "required": ["concept_id", "framework"],
+                "properties": {
+                    "concept_id": {"type": "string"},
+                    "original_name": {"type": "string"},
+                    "framework": {"type": "string"},
+                    "framework_name": {"type": "string"},
+                    "mapping_explanation": {"type": "string"},
+                    "new_title": {"type": "string"},
+                    "subtitle": {"type": "string"},
+                    "insight": {"type": "string"},
+                    "visual_metaphor": {"type": "string"},
+                    "recommended_chart": {"type": "string"},
+                    "alternative_charts": {"type": "array", "items": {"type": "string"}}
+                }
+            }
+        }
+    }
+}
+
 
 class MapFrameworkSkill:
     """理论框架映射技能"""
@@ -62,24 +95,47 @@ class MapFrameworkSkill:
     description = "将概念映射到科学/哲学理论框架"
     usage = "/map <analyze结果JSON>"
 
-    def __init__(self):
+    def __init__(self, registry: Registry = None):
+        """
+        Args:
+            registry: 使用的注册表（默认全局单例，可传入 RegistryOverlay 等隔离视图）
+        """
         self.client = client
-        self.registry = registry
+        self.registry = registry or default_registry
 
     def _get_frameworks_description(self) -> str:
         """生成框架描述文本（从registry动态获取）"""
         return self.registry.get_frameworks_for_prompt()
 
-    def run(self, concepts: list | dict) -> dict:
+    @traced("skill.map")
+    def run(self, concepts: list | dict, on_item=None) -> dict:
         """
         映射概念到理论框架
 
         Args:
             concepts: analyze skill的输出，或概念列表
+            on_item: 每完成一个映射时的回调（流式），为 None 时不流式
 
         Returns:
             映射结果字典
         """
+        prompt = self.build_prompt(concepts)
+
+        print("🗺️ 正在映射理论框架...")
+
+        # 生成结构化JSON
+        try:
+            result = self.complete(self.client.generate_json(prompt, MAP_SCHEMA, on_item=on_item,
+                                                             item_key="mappings", stage="map"))
+            print(f"✓ 完成 {len(result.get('mappings', []))} 个概念的框架映射")
+            return result
+
+        except JSONExtractionError as e:
+            print(f"⚠ JSON解析失败: {e}")
+            return {"raw_response": e.raw_response, "error": str(e)}
+
+    def build_prompt(self, concepts: list | dict | str) -> PrefixedPrompt:
+        """映射提示词（离线批量模式也由此构建）"""
         # 处理输入
         if isinstance(concepts, dict):
             if "key_concepts" in concepts:
@@ -88,50 +144,24 @@ class MapFrameworkSkill:
         if isinstance(concepts, str):
             concepts = json.loads(concepts)
 
-        prompt = MAP_PROMPT.format(
-            frameworks_desc=self._get_frameworks_description(),
-            concepts=json.dumps(concepts, ensure_ascii=False, indent=2)
+        return PrefixedPrompt(
+            MAP_PREFIX.format(frameworks_desc=self._get_frameworks_description()),
+            MAP_PROMPT.format(concepts=json.dumps(concepts, ensure_ascii=False, indent=2))
         )
 
-        print("🗺️ 正在映射理论框架...")
-
-        response = self.client.generate_text(prompt)
-
-        # 提取JSON
-        try:
-            if "```json" in response:
-                json_str = response.split("```json")[1].split("```")[0]
-            elif "```" in response:
-                # 处理 JSON 后面带有 ``` 的情况
-                json_str = response.split("```")[0] if response.strip().startswith("{") else response.split("```")[1].split("```")[0]
-            else:
-                json_str = response
-
-            # 清理可能的尾部 ```
-            json_str = json_str.strip()
-            if json_str.endswith("```"):
-                json_str = json_str[:-3].strip()
-
-            result = json.loads(json_str.strip())
-
-            # 补充图表推荐：如果LLM没有返回，从Registry获取
-            for mapping in result.get('mappings', []):
-                framework_id = mapping.get('framework')
-                if framework_id:
-                    chart_rec = self.registry.get_framework_chart_recommendation(framework_id)
-                    # 如果LLM没有返回recommended_chart，使用Registry的
-                    if not mapping.get('recommended_chart') and chart_rec.get('canonical_chart'):
-                        mapping['recommended_chart'] = chart_rec['canonical_chart']
-                    # 如果LLM没有返回alternative_charts，使用Registry的
-                    if not mapping.get('alternative_charts') and chart_rec.get('suggested_charts'):
-                        mapping['alternative_charts'] = chart_rec['suggested_charts']
-
-            print(f"✓ 完成 {len(result.get('mappings', []))} 个概念的框架映射")
-            return result
-
-        except json.JSONDecodeError as e:
-            print(f"⚠ JSON解析失败: {e}")
-            return {"raw_response": response, "error": str(e)}
+    def complete(self, result: dict) -> dict:
+        """补充图表推荐：如果LLM没有返回，从Registry获取"""
+        for mapping in result.get('mappings', []):
+            framework_id = mapping.get('framework')
+            if framework_id:
+                chart_rec = self.registry.get_framework_chart_recommendation(framework_id)
+                # 如果LLM没有返回recommended_chart，使用Registry的
+                if not mapping.get('recommended_chart') and chart_rec.get('canonical_chart'):
+                    mapping['recommended_chart'] = chart_rec['canonical_chart']
+                # 如果LLM没有返回alternative_charts，使用Registry的
+                if not mapping.get('alternative_charts') and chart_rec.get('suggested_charts'):
+                    mapping['alternative_charts'] = chart_rec['suggested_charts']
+        return result
 
     def format_output(self, result: dict) -> str:
         """格式化输出结果"""
@@ -4,18 +4,95 @@ Skill: /pipeline - 完整流水线
 包含自动学习功能：发现并扩充理论框架库
 """
 
+import os
+import io
 import json
 import time
+import hashlib
+import threading
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
 from datetime import datetime
+from typing import Callable
 sys.path.append(str(Path(__file__).parent.parent))
 
-from .analyze import AnalyzeSkill
-from .map_framework import MapFrameworkSkill
-from .design import DesignSkill
+from .analyze import AnalyzeSkill, ANALYZE_PROMPT, ANALYZE_SCHEMA
+from .map_framework import MapFrameworkSkill, MAP_PREFIX, MAP_PROMPT, MAP_SCHEMA
+from .design import DesignSkill, DESIGN_PREFIX, DESIGN_PROMPT, DESIGN_SCHEMA
 from .generate import GenerateSkill
-from .discover import DiscoverSkill
+from .discover import DiscoverSkill, DISCOVER_PREFIX, DISCOVER_PROMPT, DISCOVER_SCHEMA
+from .analyze_discover import (AnalyzeDiscoverSkill, ANALYZE_DISCOVER_PREFIX, ANALYZE_DISCOVER_PROMPT,
+                               ANALYZE_DISCOVER_SCHEMA)
+from lib import metrics, tracing
+from lib.compress import compress_article
+from lib.jobs import JobCancelled, route_output, current_output
+from lib.metrics import RunMetrics
+from config import DEFAULT_ASPECT_RATIO, DEFAULT_IMAGE_SIZE, DRAFT_IMAGE_SIZE
+
+# 各阶段的产物文件（增量重跑与 batch.py 的阶段状态均以此为准）
+STAGE_ARTIFACTS = {
+    "discover": "00_discover.json",
+    "analyze": "01_analyze.json",
+    "map": "02_map.json",
+    "design": "03_design.json",
+    "generate": "04_generate.json"
+}
+
+# 记录各阶段输入摘要的清单文件
+MANIFEST_FILE = "manifest.json"
+
+# 各阶段的上游阶段（上游产物内容是下游的输入之一，上游结果变化时下游随之重跑）
+UPSTREAM = {"map": "analyze", "design": "map", "generate": "design"}
+
+# 依赖样式的阶段：多样式模式下按样式分叉，产物写入各样式子目录
+STYLE_STAGES = ("design", "generate")
+
+
+def _digest(*parts) -> str:
+    """输入摘要（sha256 前 16 位）"""
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()[:16]
+
+
+# 提示词模板版本：模板或 schema 修改后对应阶段自动失效
+PROMPT_VERSIONS = {
+    "discover": _digest(DISCOVER_PREFIX, DISCOVER_PROMPT, json.dumps(DISCOVER_SCHEMA, sort_keys=True)),
+    "analyze": _digest(ANALYZE_PROMPT, json.dumps(ANALYZE_SCHEMA, sort_keys=True)),
+    "map": _digest(MAP_PREFIX, MAP_PROMPT, json.dumps(MAP_SCHEMA, sort_keys=True)),
+    "design": _digest(DESIGN_PREFIX, DESIGN_PROMPT, json.dumps(DESIGN_SCHEMA, sort_keys=True)),
+    "analyze_discover": _digest(ANALYZE_DISCOVER_PREFIX, ANALYZE_DISCOVER_PROMPT,
+                                json.dumps(ANALYZE_DISCOVER_SCHEMA, sort_keys=True))
+}
+
+class _DeferredOutput:
+    """
+    暂存后台阶段输出的目标：交互式选择样式期间，后台阶段的打印（经 lib.jobs 的 stdout 代理按上下文路由到这里）
+    先缓存，选择完成后一次性输出到 target 并恢复直通，避免打乱选择菜单
+    """
+
+    def __init__(self, target):
+        self.target = target
+        self._buffer = io.StringIO()
+        self._released = False
+        self._lock = threading.Lock()
+
+    def write(self, text: str) -> int:
+        with self._lock:
+            if not self._released:
+                return self._buffer.write(text)
+        return self.target.write(text)
+
+    def release(self):
+        """输出缓存内容，此后全部直通"""
+        with self._lock:
+            self.target.write(self._buffer.getvalue())
+            self.target.flush()
+            self._released = True
 
 
 class PipelineSkill:
@@ -23,22 +100,39 @@ class PipelineSkill:
 
     name = "pipeline"
     description = "一键执行完整的文章→图像workflow，同时自动学习新框架"
-    usage = "/pipeline <文章文件路径> [输出目录] [--no-learn]"
+    usage = "/pipeline <文章文件路径> [输出目录] [--no-learn] [--draft] [--force] [--styles=a,b] [--fused] [--compress]"
 
-    def __init__(self, output_dir: str = None, auto_learn: bool = True, style: str = None, interactive_style: bool = True):
-        from config import DEFAULT_VISUAL_STYLE, VISUAL_STYLES
+    def __init__(self, output_dir: str = None, auto_learn: bool = True, style: str = None, interactive_style: bool = True,
+                 draft: bool = False, styles: list = None, fused: bool = None, compress: bool = None):
+        """
+        Args:
+            output_dir: 输出目录（默认 output/run_<时间戳>）
+            auto_learn: 是否先执行框架发现与学习
+            style: 视觉风格ID
+            interactive_style: 未指定样式时是否交互式选择
+            draft: 草稿模式
+            styles: 多个视觉风格ID：discover/analyze/map 只执行一次，design/generate 按样式并行分叉到 <输出目录>/<样式>/
+            fused: discover 与 analyze 合并为一次调用（仅 auto_learn 时有效，默认 FUSED_ANALYZE_DISCOVER）
+            compress: discover/analyze 之前在本地压缩文章（默认 COMPRESS_ARTICLES）
+        """
+        from config import DEFAULT_VISUAL_STYLE, FUSED_ANALYZE_DISCOVER, COMPRESS_ARTICLES
 
-        # 交互式选择样式
-        if interactive_style and style is None:
-            self.style = self._select_style_interactive(VISUAL_STYLES, DEFAULT_VISUAL_STYLE)
+        # 需要交互式选择样式时推迟到 run()：选择期间后台先执行与样式无关的阶段
+        if styles:
+            styles = list(dict.fromkeys(styles))
+        elif interactive_style and style is None:
+            styles = []
         else:
-            self.style = style or DEFAULT_VISUAL_STYLE
+            styles = [style or DEFAULT_VISUAL_STYLE]
 
         self.analyze = AnalyzeSkill()
         self.map_framework = MapFrameworkSkill()
-        self.design = DesignSkill(style=self.style)
         self.discover = DiscoverSkill(auto_save=True)
+        self.analyze_discover = AnalyzeDiscoverSkill(self.discover)
         self.auto_learn = auto_learn
+        self.fused = auto_learn and (FUSED_ANALYZE_DISCOVER if fused is None else fused)
+        self.compress = COMPRESS_ARTICLES if compress is None else compress
+        self.draft = draft
 
         # 设置输出目录
         if output_dir:
@@ -48,7 +142,34 @@ class PipelineSkill:
             self.output_dir = Path(f"output/run_{timestamp}")
 
         self.output_dir.mkdir(parents=True, exist_ok=True)
-        self.generate = GenerateSkill(str(self.output_dir / "images"), style=self.style)
+        self.styles, self.style, self.branches = [], None, []
+        self.design = self.generate = None
+        if styles:
+            self._set_styles(styles)
+        self.on_stage = None
+        self.force = False
+        self._manifests = {}
+        self._cancelled = threading.Event()
+
+    def _set_styles(self, styles: list):
+        """确定样式并创建各样式的 design/generate 分支"""
+        self.styles = styles
+        self.style = styles[0]
+        self.branches = [self._make_branch(s) for s in styles]
+        # 主样式（单样式时即唯一样式）的技能，供 /finalize 等后续命令使用
+        self.design = self.branches[0]["design"]
+        self.generate = self.branches[0]["generate"]
+
+    def _make_branch(self, style: str) -> dict:
+        """某个样式的 design/generate 分支（单样式时直接使用输出目录）"""
+        out = self.output_dir if len(self.styles) == 1 else self.output_dir / style
+        out.mkdir(parents=True, exist_ok=True)
+        return {
+            "style": style,
+            "dir": out,
+            "design": DesignSkill(style=style),
+            "generate": GenerateSkill(str(out / "images"), style=style, draft=self.draft)
+        }
 
     def _select_style_interactive(self, styles: dict, default: str) -> str:
         """交互式选择视觉风格"""
@@ -85,17 +206,198 @@ class PipelineSkill:
         print("=" * 50 + "\n")
         return selected
 
-    def run(self, article_path: str, generate_images: bool = True) -> dict:
+    @tracing.traced("skill.pipeline")
+    def run(self, article_path: str, generate_images: bool = True, on_stage: Callable[[str], None] = None,
+            force: bool = False) -> dict:
         """
         执行完整流水线
 
         Args:
             article_path: 文章文件路径
             generate_images: 是否生成图像
+            on_stage: 每个阶段开始时的回调（参数为阶段名），用于上报进度
+            force: 忽略 manifest.json 全部重跑（默认只重跑输入发生变化的阶段及其下游）
 
         Returns:
             完整结果字典
         """
+        self.on_stage = on_stage
+        self.force = force
+        self._manifests = {}
+        self._cancelled = threading.Event()
+        self.metrics = RunMetrics()
+        with metrics.collect(self.metrics):
+            try:
+                return self._run(article_path, generate_images)
+            finally:
+                self.metrics.save(self.output_dir / "metrics.json")
+
+    @contextmanager
+    def _stage(self, name: str):
+        """一个流水线阶段：同时记录遥测和追踪 span"""
+        self._check_cancelled()
+        if self.on_stage:
+            self.on_stage(name)
+        with tracing.span(f"pipeline.{name}", output_dir=str(self.output_dir)), self.metrics.stage(name):
+            yield
+
+    def _check_cancelled(self):
+        """阶段边界：流水线已被取消时抛出 JobCancelled"""
+        if self._cancelled.is_set():
+            raise JobCancelled("流水线已取消")
+
+    def _learn(self, discovery: dict) -> dict:
+        """从发现结果学习（写入注册表，流水线取消后不再执行）"""
+        if "error" in discovery:
+            return discovery
+        self._check_cancelled()
+        return self.discover.complete(discovery)
+
+    @staticmethod
+    def _write_json(path: Path, data):
+        """写入 JSON（临时文件 + 原子重命名，中途崩溃不会留下半个文件）"""
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2, default=str)
+        os.replace(tmp, path)
+
+    def _manifest(self, directory: Path) -> dict:
+        """某个目录的输入清单 {阶段: {"inputs": {...}, "artifact", "updated_at"}}（本次运行内缓存）"""
+        if directory not in self._manifests:
+            try:
+                stages = json.loads((directory / MANIFEST_FILE).read_text(encoding="utf-8")).get("stages", {})
+            except (OSError, json.JSONDecodeError, AttributeError):
+                stages = {}
+            self._manifests[directory] = stages
+        return self._manifests[directory]
+
+    def _stage_dir(self, stage: str, branch: dict = None) -> Path:
+        """阶段产物所在目录：依赖样式的阶段在样式分支目录，其余在输出目录"""
+        return (branch or self.branches[0])["dir"] if stage in STYLE_STAGES else self.output_dir
+
+    @staticmethod
+    def _model_id(provider, key: str, model: str = None) -> str:
+        return f"{provider.provider_id}:{model or provider.config.get(key, '')}" if provider else ""
+
+    def _inputs(self, stage: str, article: str = None, branch: dict = None, fused: bool = None) -> dict:
+        """
+        某阶段的全部输入摘要（写入 manifest.json，任一项变化即重跑该阶段）
+
+        文章文本、上游产物内容、注册表中该阶段读取的部分、样式、模型、提示词模板版本
+
+        Args:
+            fused: discover/analyze 是否由合并调用产生（决定记录的提示词模板与模型），默认取实例设置
+        """
+        if stage in STYLE_STAGES:
+            branch = branch or self.branches[0]
+        inputs = {}
+        if stage in UPSTREAM:
+            upstream = self._stage_dir(UPSTREAM[stage], branch) / STAGE_ARTIFACTS[UPSTREAM[stage]]
+            inputs[UPSTREAM[stage]] = _digest(upstream.read_bytes()) if upstream.exists() else None
+        else:
+            inputs["article"] = _digest(article)
+
+        if stage == "discover":
+            inputs["registry"] = self.discover.registry.fingerprint("frameworks")
+        elif stage == "map":
+            inputs["registry"] = self.map_framework.registry.fingerprint("frameworks")
+        elif stage == "design":
+            inputs["registry"] = branch["design"].registry.fingerprint("chart_types", "visual_styles")
+            inputs["style"] = branch["style"]
+
+        if stage == "generate":
+            generate = branch["generate"]
+            inputs["style"] = _digest(generate.style_prefix)
+            inputs["model"] = self._model_id(generate.client.image_provider, "image_model")
+            inputs["image"] = f"{DEFAULT_ASPECT_RATIO}/{DRAFT_IMAGE_SIZE if generate.use_draft() else DEFAULT_IMAGE_SIZE}"
+        else:
+            # 合并调用时两个阶段共用同一个提示词模板与模型，切换模式会让两者各重跑一次
+            fused = self.fused if fused is None else fused
+            model_stage = "analyze_discover" if fused and stage in ("discover", "analyze") else stage
+            provider, model = self.analyze.client.text_provider_for(model_stage)
+            inputs["model"] = self._model_id(provider, "text_model", model)
+            inputs["prompt"] = PROMPT_VERSIONS[model_stage]
+        return inputs
+
+    def _input_options(self, stage: str, article: str) -> list:
+        """
+        discover/analyze 可复用的输入：合并模式下另一阶段已被复用时，本阶段单独执行，
+        其产物对应单独调用的提示词模板与模型，两种记录都有效
+        """
+        options = [self._inputs(stage, article)]
+        if self.fused:
+            options.append(self._inputs(stage, article, fused=False))
+        return options
+
+    def _save_json(self, stage: str, data, inputs: dict, branch: dict = None):
+        """写入阶段产物，并在 manifest.json 中记录产生它的输入"""
+        directory = self._stage_dir(stage, branch)
+        manifest = self._manifest(directory)
+        self._write_json(directory / STAGE_ARTIFACTS[stage], data)
+        manifest[stage] = {
+            "inputs": inputs,
+            "artifact": STAGE_ARTIFACTS[stage],
+            "updated_at": datetime.now().isoformat(timespec="seconds")
+        }
+        self._write_json(directory / MANIFEST_FILE, {"version": 1, "stages": manifest})
+
+    def _reuse(self, stage: str, inputs: dict | list, branch: dict = None):
+        """
+        增量重跑：输入与 manifest.json 记录一致时读取已有产物（需要重跑时返回 None）
+
+        Args:
+            inputs: 本阶段的输入摘要，或多种均可接受的输入摘要（与其中任一一致即可复用）
+        """
+        directory = self._stage_dir(stage, branch)
+        entry = self._manifest(directory).get(stage)
+        if self.force or not entry:
+            return None
+
+        path = directory / STAGE_ARTIFACTS[stage]
+        options = inputs if isinstance(inputs, list) else [inputs]
+        if entry.get("inputs") not in options:
+            inputs = options[0]
+            changed = [k for k in inputs if entry.get("inputs", {}).get(k) != inputs[k]]
+            print(f"↻ 输入已变化（{', '.join(changed)}），重新执行: {stage}")
+            return None
+
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            return None
+        if not data or (isinstance(data, dict) and "error" in data):
+            return None
+        if stage == "generate" and not all(r.get("success") for r in data):
+            return None
+        print(f"↺ 输入未变化，复用: {path.relative_to(self.output_dir)}")
+        metrics.incr("stages_reused")
+        return data
+
+    @staticmethod
+    def error_message(result: dict) -> str:
+        """流水线结果中的首个错误（成功时返回空字符串）"""
+        if result.get("success"):
+            return ""
+        errors = [step["error"] for step in result.get("steps", {}).values()
+                  if isinstance(step, dict) and step.get("error")]
+        return errors[0] if errors else "流水线未完成"
+
+    @staticmethod
+    def print_item(*keys):
+        """流式进度：每个元素到达时打印一行（agent 的单步命令共用）"""
+        def on_item(item: dict):
+            label = next((item.get(k) for k in keys if item.get(k)), "")
+            print(f"  · {label}")
+        return on_item
+
+    @staticmethod
+    def _generate_early(generate: GenerateSkill, design: dict, index: int) -> dict:
+        """在设计阶段流式返回时提前生成单张图像（调用归属到 generate 阶段）"""
+        with metrics.in_stage("generate"):
+            return generate.run_design(design, index)
+
+    def _run(self, article_path: str, generate_images: bool) -> dict:
+        """流水线主体（在遥测收集上下文中执行）"""
         results = {
             "article_path": article_path,
             "output_dir": str(self.output_dir),
@@ -111,33 +413,119 @@ class PipelineSkill:
         print("=" * 60)
         print(f"输入: {article_path}")
         print(f"输出: {self.output_dir}")
-        print(f"视觉风格: {self.style}")
+        print(f"视觉风格: {', '.join(self.styles) or '待选择'}")
         print(f"自动学习: {'✓ 开启' if self.auto_learn else '✗ 关闭'}")
         print("=" * 60)
 
         # 读取文章
-        article_file = Path(article_path)
-        if not article_file.exists():
+        if not Path(article_path).exists():
             print(f"✗ 文件不存在: {article_path}")
             return results
 
-        article = article_file.read_text(encoding='utf-8')
+        if self.branches:
+            map_result = self._run_shared(article_path, results, total_steps)
+        else:
+            map_result = self._run_speculative(article_path, results, total_steps)
+        if map_result is None:
+            return results
+
+        # Step 3-4: 可视化设计与图像生成（多样式时按样式并行分叉）
+        if len(self.branches) == 1:
+            style_results = [self._run_style(self.branches[0], map_result, generate_images, total_steps)]
+        else:
+            print("\n" + "-" * 40)
+            print(f"STEP 3-4/{total_steps}: 按 {len(self.branches)} 种样式并行设计与生成")
+            print("-" * 40)
+            with ThreadPoolExecutor(max_workers=len(self.branches), thread_name_prefix="style") as pool:
+                futures = [tracing.submit(pool, self._run_style, branch, map_result, generate_images, total_steps)
+                           for branch in self.branches]
+            style_results = [f.result() for f in futures]
+            results["styles"] = {r["style"]: r for r in style_results}
+
+        # 主样式的结果放在 steps 中，与单样式保持一致
+        results["steps"]["design"] = style_results[0]["design"]
+        if "generate" in style_results[0]:
+            results["steps"]["generate"] = style_results[0]["generate"]
+
+        failed = [r for r in style_results if "error" in r["design"]]
+        for r in failed:
+            print(f"✗ 设计失败 [{r['style']}]: {r['design']['error']}")
+        if failed:
+            return results
+
+        # 生成报告
+        report = self._generate_report(results)
+        with open(self.output_dir / "report.md", "w", encoding="utf-8") as f:
+            f.write(report)
+
+        results["success"] = True
+
+        print("\n" + "=" * 60)
+        print("✓ 流水线完成!")
+        print(f"输出目录: {self.output_dir}")
+
+        # 显示学习成果
+        if self.auto_learn and "summary" in results.get("learning", {}):
+            summary = results["learning"]["summary"]
+            print(f"\n📚 学习成果:")
+            print(f"   新增框架: {summary.get('new_added', 0)}")
+            print(f"   框架库总数: {summary.get('total_frameworks', 'N/A')}")
+
+        totals = self.metrics.summary()["totals"]
+        print(f"\n⏱ 耗时 {totals['duration_s']:.1f}s · 调用 {totals['calls']} 次 · "
+              f"tokens {totals['input_tokens']}/{totals['output_tokens']} · 估算成本 ${totals['cost_usd']:.4f}")
+
+        print("=" * 60)
+
+        return results
+
+    def _run_shared(self, article_path: str, results: dict, total_steps: int):
+        """与样式无关的阶段：discover、analyze、map（失败时返回 None）"""
+        article = Path(article_path).read_text(encoding='utf-8')
         print(f"✓ 读取文章: {len(article)} 字符")
 
+        if self.compress:
+            # 压缩后的文章即 discover/analyze 的输入（manifest.json 记录其摘要，预算变化时随之重跑）
+            compressed = compress_article(article)
+            article = compressed["text"]
+            (self.output_dir / "article.compressed.md").write_text(article, encoding="utf-8")
+            print(f"✂ 本地压缩: 约 {compressed['original_tokens']} → {compressed['tokens']} tokens "
+                  f"(保留 {compressed['kept']}/{compressed['sentences']} 句，去重 {compressed['duplicates']} 句，"
+                  f"{compressed['elapsed_ms']}ms)")
+
+        analyze_options = self._input_options("analyze", article)
+        analyze_result = None
+
         # Step 0: 框架发现与学习（可选但推荐）
         if self.auto_learn:
             print("\n" + "-" * 40)
-            print(f"STEP 0/{total_steps}: 🎓 框架发现与学习")
+            print(f"STEP 0/{total_steps}: 🎓 框架发现与学习" + ("（与分析合并）" if self.fused else ""))
             print("-" * 40)
 
-            discover_result = self.discover.run(article)
+            discover_result = self._reuse("discover", self._input_options("discover", article))
+            if discover_result is None:
+                if self.fused:
+                    analyze_result = self._reuse("analyze", analyze_options)
+                if self.fused and analyze_result is None:
+                    # 两个阶段都需要执行：一次调用同时完成，文章只上传一次
+                    with self._stage("analyze_discover"):
+                        analyze_result, discovery = self.analyze_discover.run(
+                            article, on_item=self.print_item("name_cn", "name"), learn=False)
+                        discover_result = self._learn(discovery)
+                    if "error" not in analyze_result:
+                        self._save_json("analyze", analyze_result, self._inputs("analyze", article, fused=True))
+                    fused_call = True
+                else:
+                    with self._stage("discover"):
+                        discover_result = self._learn(self.discover.discover(article))
+                    fused_call = False
+                if "error" not in discover_result:
+                    # 保存学习结果（注册表指纹取学习之后的状态，新增的框架不会让本阶段下次重跑）；
+                    # 按实际执行的调用记录提示词模板与模型
+                    self._save_json("discover", discover_result, self._inputs("discover", article, fused=fused_call))
             results["learning"] = discover_result
 
             if "error" not in discover_result:
-                # 保存学习结果
-                with open(self.output_dir / "00_discover.json", "w", encoding="utf-8") as f:
-                    json.dump(discover_result, f, ensure_ascii=False, indent=2)
-
                 summary = discover_result.get("summary", {})
                 if summary.get("new_added", 0) > 0:
                     print(f"🎉 框架库已扩充！新增 {summary['new_added']} 个框架")
@@ -147,94 +535,150 @@ class PipelineSkill:
         print(f"STEP 1/{total_steps}: 分析文章")
         print("-" * 40)
 
-        analyze_result = self.analyze.run(article)
+        if analyze_result is not None:
+            print("✓ 分析结果已在 STEP 0 中得到")
+        else:
+            analyze_result = self._reuse("analyze", analyze_options)
+        if analyze_result is None:
+            with self._stage("analyze"):
+                analyze_result = self.analyze.run(article, on_item=self.print_item("name_cn", "name"))
+            if "error" not in analyze_result:
+                # 保存分析结果
+                self._save_json("analyze", analyze_result, self._inputs("analyze", article, fused=False))
         results["steps"]["analyze"] = analyze_result
 
         if "error" in analyze_result:
             print(f"✗ 分析失败: {analyze_result['error']}")
-            return results
-
-        # 保存分析结果
-        with open(self.output_dir / "01_analyze.json", "w", encoding="utf-8") as f:
-            json.dump(analyze_result, f, ensure_ascii=False, indent=2)
+            return None
 
         # Step 2: 理论框架映射
         print("\n" + "-" * 40)
         print(f"STEP 2/{total_steps}: 理论框架映射")
         print("-" * 40)
 
-        map_result = self.map_framework.run(analyze_result)
+        inputs = self._inputs("map")
+        map_result = self._reuse("map", inputs)
+        if map_result is None:
+            with self._stage("map"):
+                map_result = self.map_framework.run(analyze_result, on_item=self.print_item("new_title", "framework"))
+            if "error" not in map_result:
+                # 保存映射结果
+                self._save_json("map", map_result, inputs)
         results["steps"]["map"] = map_result
 
         if "error" in map_result:
             print(f"✗ 映射失败: {map_result['error']}")
-            return results
-
-        # 保存映射结果
-        with open(self.output_dir / "02_map.json", "w", encoding="utf-8") as f:
-            json.dump(map_result, f, ensure_ascii=False, indent=2)
-
-        # Step 3: 可视化设计
-        print("\n" + "-" * 40)
-        print(f"STEP 3/{total_steps}: 可视化设计")
-        print("-" * 40)
-
-        design_result = self.design.run(map_result)
-        results["steps"]["design"] = design_result
-
-        if "error" in design_result:
-            print(f"✗ 设计失败: {design_result['error']}")
-            return results
-
-        # 保存设计结果
-        with open(self.output_dir / "03_design.json", "w", encoding="utf-8") as f:
-            json.dump(design_result, f, ensure_ascii=False, indent=2)
-
-        # 保存提示词到markdown
-        prompts_md = self._format_prompts_markdown(design_result)
-        with open(self.output_dir / "prompts.md", "w", encoding="utf-8") as f:
-            f.write(prompts_md)
-
-        # Step 4: 生成图像
-        if generate_images:
-            print("\n" + "-" * 40)
-            print(f"STEP 4/{total_steps}: 生成图像")
-            print("-" * 40)
-
-            generate_result = self.generate.run_batch(design_result)
-            results["steps"]["generate"] = generate_result
-
-            # 保存生成结果
-            with open(self.output_dir / "04_generate.json", "w", encoding="utf-8") as f:
-                json.dump(generate_result, f, ensure_ascii=False, indent=2, default=str)
-
-        else:
-            print("\n" + "-" * 40)
-            print(f"STEP 4/{total_steps}: 跳过图像生成")
-            print("-" * 40)
-            print("提示词已保存到 prompts.md")
+            return None
 
-        # 生成报告
-        report = self._generate_report(results)
-        with open(self.output_dir / "report.md", "w", encoding="utf-8") as f:
-            f.write(report)
+        return map_result
 
-        results["success"] = True
+    def _run_speculative(self, article_path: str, results: dict, total_steps: int):
+        """交互式选择样式的同时，在后台执行与样式无关的阶段；两者都完成后再进入设计"""
+        from config import DEFAULT_VISUAL_STYLE, VISUAL_STYLES
 
-        print("\n" + "=" * 60)
-        print("✓ 流水线完成!")
-        print(f"输出目录: {self.output_dir}")
+        output = _DeferredOutput(current_output())
+        pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="speculative")
+        future = tracing.submit(pool, self._run_deferred, output, article_path, results, total_steps)
+        try:
+            print("⏳ 已在后台开始分析文章，请同时选择视觉风格")
+            style = self._select_style_interactive(VISUAL_STYLES, DEFAULT_VISUAL_STYLE)
+        except BaseException:
+            # 选择被中止（Ctrl+C/EOF）：后台在下一个阶段边界停止，等它退出后再抛出，不再产生调用和学习
+            self._cancelled.set()
+            output.release()
+            print("\n⏹ 已取消，等待后台阶段结束...")
+            pool.shutdown(wait=True)
+            raise
+        output.release()
+        pool.shutdown(wait=False)
+
+        self._set_styles([style])
+        if not future.done():
+            print("⏳ 等待后台分析完成...")
+        return future.result()
+
+    def _run_deferred(self, output: _DeferredOutput, article_path: str, results: dict, total_steps: int):
+        """在后台执行 _run_shared，输出写入 output"""
+        with route_output(output):
+            return self._run_shared(article_path, results, total_steps)
+
+    def _run_style(self, branch: dict, map_result: dict, generate_images: bool, total_steps: int) -> dict:
+        """
+        某个样式的设计与图像生成
 
-        # 显示学习成果
-        if self.auto_learn and "summary" in results.get("learning", {}):
-            summary = results["learning"]["summary"]
-            print(f"\n📚 学习成果:")
-            print(f"   新增框架: {summary.get('new_added', 0)}")
-            print(f"   框架库总数: {summary.get('total_frameworks', 'N/A')}")
+        Returns:
+            {"style", "output_dir", "design", "generate"(生成图像时)}
+        """
+        generate = branch["generate"]
+        label = f" [{branch['style']}]" if len(self.branches) > 1 else ""
+        result = {"style": branch["style"], "output_dir": str(branch["dir"])}
 
-        print("=" * 60)
+        # Step 3: 可视化设计
+        print("\n" + "-" * 40)
+        print(f"STEP 3/{total_steps}: 可视化设计{label}")
+        print("-" * 40)
 
-        return results
+        # 设计以流式返回：每完成一个设计就在后台开始生成它的图像，与剩余设计的生成重叠
+        # （单线程，保持图像请求串行）。流式序号可能与最终设计列表不同（校验失败、修复调用），
+        # 因此按提示词与最终设计匹配
+        early_images = ThreadPoolExecutor(max_workers=1, thread_name_prefix="early-image") if generate_images else None
+        prestarted = {}
+        design_count = 0
+
+        def on_design(design: dict):
+            nonlocal design_count
+            design_count += 1
+            print(f"  ·{label} {design.get('title', design_count)}")
+            if early_images:
+                prompt, _, _ = generate.prepare_design(design, design_count)
+                if prompt and prompt not in prestarted:
+                    prestarted[prompt] = tracing.submit(early_images, self._generate_early,
+                                                        generate, design, design_count)
+
+        try:
+            inputs = self._inputs("design", branch=branch)
+            design_result = self._reuse("design", inputs, branch)
+            if design_result is None:
+                with self._stage("design"):
+                    design_result = branch["design"].run(map_result, on_item=on_design)
+                if "error" not in design_result:
+                    # 保存设计结果
+                    self._save_json("design", design_result, inputs, branch)
+            result["design"] = design_result
+
+            if "error" in design_result:
+                return result
+
+            # 保存提示词到markdown
+            prompts_md = self._format_prompts_markdown(design_result)
+            with open(branch["dir"] / "prompts.md", "w", encoding="utf-8") as f:
+                f.write(prompts_md)
+
+            # Step 4: 生成图像
+            if generate_images:
+                print("\n" + "-" * 40)
+                print(f"STEP 4/{total_steps}: 生成图像{label}")
+                print("-" * 40)
+
+                inputs = self._inputs("generate", branch=branch)
+                generate_result = self._reuse("generate", inputs, branch)
+                if generate_result is None:
+                    with self._stage("generate"):
+                        generate_result = generate.run_batch(design_result, prestarted=prestarted)
+                    # 保存生成结果
+                    self._save_json("generate", generate_result, inputs, branch)
+                result["generate"] = generate_result
+
+            else:
+                print("\n" + "-" * 40)
+                print(f"STEP 4/{total_steps}: 跳过图像生成{label}")
+                print("-" * 40)
+                print(f"提示词已保存到 {branch['dir'] / 'prompts.md'}")
+        finally:
+            if early_images:
+                early_images.shutdown(wait=True, cancel_futures=True)
+
+        return result
 
     def _format_prompts_markdown(self, design_result: dict) -> str:
         """格式化提示词为markdown"""
@@ -295,6 +739,10 @@ class PipelineSkill:
                     lines.append(f"- **{f.get('name')}** (`{f.get('id')}`) - confidence: {f.get('confidence', 0):.0%}")
                 lines.append("")
 
+        # 遥测摘要（详细数据见 metrics.json）
+        if getattr(self, "metrics", None):
+            lines.extend(self.metrics.format_markdown())
+
         lines.append("## Pipeline Steps")
         lines.append("")
 
@@ -339,6 +787,17 @@ class PipelineSkill:
                 ""
             ])
 
+        # 多样式：各样式的设计与生成
+        if results.get("styles"):
+            lines.extend(["### Styles", ""])
+            for style, r in results["styles"].items():
+                designs = r.get("design", {}).get("designs", [])
+                line = f"- **{style}** (`{Path(r['output_dir']).name}/`): {len(designs)} designs"
+                if "generate" in r:
+                    line += f", {sum(1 for g in r['generate'] if g.get('success'))}/{len(r['generate'])} images"
+                lines.append(line)
+            lines.append("")
+
         # 概念列表
         if "analyze" in steps:
             lines.extend([
@@ -358,8 +817,13 @@ class PipelineSkill:
             "- `03_design.json` - 可视化设计",
             "- `04_generate.json` - 图像生成结果",
             "- `prompts.md` - 图像提示词",
+            "- `metrics.json` - 各阶段耗时、token 用量与成本估算",
+            "- `manifest.json` - 各阶段产物的输入摘要（增量重跑）",
+            "- `article.compressed.md` - 本地压缩后的文章（启用压缩时）",
             "- `images/` - 生成的图像",
         ])
+        if results.get("styles"):
+            lines.append("- `<样式>/` - 多样式模式下各样式的 03/04 产物、prompts.md 与 images/")
 
         return "\n".join(lines)
 
@@ -369,18 +833,34 @@ if __name__ == "__main__":
     import sys
 
     if len(sys.argv) < 2:
-        print("Usage: python pipeline.py <article_path> [output_dir] [--no-learn]")
+        print("Usage: python pipeline.py <article_path> [output_dir] [--no-learn] [--draft] [--force] [--styles=a,b] [--fused] "
+              "[--compress]")
         sys.exit(1)
 
     article_path = sys.argv[1]
     output_dir = None
     auto_learn = True
+    draft = False
+    force = False
+    styles = None
+    fused = None
+    compress = None
 
     for arg in sys.argv[2:]:
         if arg == "--no-learn":
             auto_learn = False
+        elif arg.startswith("--styles="):
+            styles = [s for s in arg.split("=", 1)[1].split(",") if s]
+        elif arg == "--draft":
+            draft = True
+        elif arg == "--force":
+            force = True
+        elif arg == "--fused":
+            fused = True
+        elif arg == "--compress":
+            compress = True
         else:
             output_dir = arg
 
-    skill = PipelineSkill(output_dir, auto_learn=auto_learn)
-    skill.run(article_path)
+    skill = PipelineSkill(output_dir, auto_learn=auto_learn, draft=draft, styles=styles, fused=fused, compress=compress)
+    skill.run(article_path, force=force)
@@ -0,0 +1,98 @@
+"""
+批处理工作者的租约：续约遇到任务库临时错误时重试，租约被接管后停止流水线
+"""
+
+import sys
+import time
+import sqlite3
+import threading
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import batch
+from benchmarks.run_benchmarks import make_article
+from lib.job_store import JobStore
+from lib.jobs import RUNNING
+
+
+@pytest.fixture
+def store(tmp_path):
+    article = tmp_path / "article.md"
+    article.write_text(make_article(1500), encoding="utf-8")
+    store = JobStore(tmp_path / "jobs.db")
+    store.add([article], tmp_path / "out", {})
+    return store
+
+
+class FakePipeline:
+    """按阶段调用 on_stage，每个阶段之间等待一次续约"""
+
+    reached = []
+
+    stages = ("discover", "analyze", "map", "design", "generate")
+    beats = None
+
+    def __init__(self, output_dir, **kwargs):
+        self.output_dir = output_dir
+
+    def run(self, article_path, generate_images=True, on_stage=None):
+        for stage in self.stages:
+            on_stage(stage)
+            FakePipeline.reached.append(stage)
+            FakePipeline.beats.wait(5)
+            FakePipeline.beats.clear()
+            time.sleep(0.05)  # 让心跳线程处理完续约结果
+        return {}
+
+    error_message = staticmethod(lambda result: "")
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    FakePipeline.reached = []
+    FakePipeline.beats = threading.Event()
+    monkeypatch.setattr(batch, "PipelineSkill", FakePipeline)
+    return FakePipeline
+
+
+def count_beats(monkeypatch, store, results):
+    """依次返回 results 中的续约结果（异常则抛出），之后正常续约；返回调用记录"""
+    heartbeat = store.heartbeat
+    results = list(results)
+    calls = []
+
+    def beat(*args):
+        calls.append(args)
+        outcome = results.pop(0) if results else None
+        FakePipeline.beats.set()
+        if isinstance(outcome, Exception):
+            raise outcome
+        return heartbeat(*args) if outcome is None else outcome
+
+    monkeypatch.setattr(store, "heartbeat", beat)
+    return calls
+
+
+def test_lost_lease_stops_pipeline(store, pipeline, monkeypatch):
+    job = store.lease("w1", lease_seconds=1)
+    count_beats(monkeypatch, store, [True, False])
+
+    assert not batch.run_job(store, job, "w1", lease_seconds=1)
+    # 第二次续约失败后，下一阶段开始前停止
+    assert pipeline.reached == ["discover", "analyze"]
+    # 不覆盖接管者的状态
+    assert store.get(job["id"])["status"] == RUNNING
+
+
+def test_locked_db_heartbeat_is_retried(store, pipeline, monkeypatch):
+    job = store.lease("w1", lease_seconds=1)
+    calls = count_beats(monkeypatch, store, [sqlite3.OperationalError("database is locked")])
+
+    assert batch.run_job(store, job, "w1", lease_seconds=1)
+    # 心跳线程没有因异常退出，之后每个阶段之间都续约了
+    assert len(calls) >= len(FakePipeline.stages)
+    assert pipeline.reached == list(FakePipeline.stages)
+    assert store.get(job["id"])["status"] == "done"
@@ -0,0 +1,96 @@
+"""
+离线批量：经本地替身（LocalBatch）端到端推进 BulkPipeline
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from benchmarks.run_benchmarks import make_article
+from benchmarks.stub_provider import install_stub
+from lib.api import client
+from lib.batch_api import LocalBatch, BatchError, COMPLETED
+from skills.bulk import BulkPipeline, BULK_STAGES
+from skills.pipeline import STAGE_ARTIFACTS
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    """让默认客户端使用替身提供商，本地替身提交后立即可执行"""
+    monkeypatch.setattr(client, "text_provider_id", client.text_provider_id)
+    monkeypatch.setattr(client, "image_provider_id", client.image_provider_id)
+    monkeypatch.setattr(LocalBatch.__init__, "__defaults__", (0,))
+    return install_stub(client)
+
+
+@pytest.fixture
+def articles(tmp_path):
+    root = tmp_path / "articles"
+    root.mkdir()
+    paths = []
+    for i in range(2):
+        path = root / f"article{i}.md"
+        path.write_text(make_article(1200, seed=i), encoding="utf-8")
+        paths.append(str(path))
+    return paths
+
+
+def make_bulk(tmp_path) -> BulkPipeline:
+    return BulkPipeline(str(tmp_path / "bulk"), style="blueprint", local=True, poll_seconds=0)
+
+
+def test_bulk_end_to_end(stub, articles, tmp_path):
+    bulk = make_bulk(tmp_path)
+    assert bulk.add(articles) == (2, 0)
+
+    result = bulk.run()
+
+    assert result["failures"] == {}
+    status = bulk.status()
+    assert status["pending"] == {}
+    assert status["stages"] == {stage: 2 for stage in BULK_STAGES}
+    for article in bulk.state["articles"]:
+        for stage in BULK_STAGES:
+            assert (Path(article["dir"]) / STAGE_ARTIFACTS[stage]).exists()
+    assert list((tmp_path / "bulk" / "local_batches").iterdir())
+
+
+def test_bulk_rerun_reuses_everything(stub, articles, tmp_path):
+    bulk = make_bulk(tmp_path)
+    bulk.add(articles)
+    bulk.run()
+    calls = stub.calls
+
+    bulk = make_bulk(tmp_path)
+    assert bulk.add(articles) == (0, 2)
+    assert bulk.run()["failures"] == {}
+    assert stub.calls == calls
+
+
+def test_bulk_survives_transient_poll_error(stub, articles, tmp_path, monkeypatch):
+    poll = LocalBatch.poll
+    failed = set()
+
+    def flaky_poll(self, batch):
+        # 每个批次的首次查询失败
+        if batch["id"] not in failed:
+            failed.add(batch["id"])
+            raise BatchError("503 Service Unavailable")
+        return poll(self, batch)
+
+    monkeypatch.setattr(LocalBatch, "poll", flaky_poll)
+    bulk = make_bulk(tmp_path)
+    bulk.add(articles[:1])
+
+    assert bulk.run()["failures"] == {}
+    assert failed
+    assert bulk.status()["stages"] == {stage: 1 for stage in BULK_STAGES}
+
+
+def test_batch_record_has_initial_state(stub, tmp_path):
+    batch = LocalBatch(stub, tmp_path).submit([{"id": "r1", "kind": "json", "prompt": "p"}], "json", "t")
+    assert batch["state"] != COMPLETED
+    assert batch["raw_state"] is None
@@ -0,0 +1,80 @@
+"""
+文章压缩：中英文断句（引号、缩写、小数点）、去重与 token 预算
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from lib.compress import split_sentences, compress_article, clean_markdown, estimate_tokens
+
+
+def make_article(paragraphs: int = 20) -> str:
+    """互不重复的句子组成的文章"""
+    topics = ["graphs", "models", "caches", "queues", "indexes"]
+    return "\n\n".join(
+        " ".join(f"Section {p} shows how {topics[(p + i) % 5]} handle case {i} of {p * 10 + i}."
+                 for i in range(8))
+        for p in range(paragraphs)
+    )
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("他说：“走吧。现在就走！”然后离开了。", ["他说：“走吧。现在就走！”", "然后离开了。"]),
+    ("她回答「好。明天见。」之后没再说话。", ["她回答「好。明天见。」", "之后没再说话。"]),
+    ('She said "Go. Now." Then she left.', ['She said "Go. Now."', "Then she left."]),
+    ("He said 'Stop. Now.' and went.", ["He said 'Stop. Now.' and went."]),
+    ("He said 'Stop. Now.' Then he went.", ["He said 'Stop. Now.'", "Then he went."]),
+    ("He said ‘Stop. Now.’ Then he went.", ["He said ‘Stop. Now.’", "Then he went."]),
+])
+def test_quotes_kept_whole(text, expected):
+    assert split_sentences(text) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("I don't know. It's late.", ["I don't know.", "It's late."]),
+    ("The students' work is done. Next.", ["The students' work is done.", "Next."]),
+    ("It’s here. Rock ’n’ roll. The ’90s ended.", ["It’s here.", "Rock ’n’ roll.", "The ’90s ended."]),
+    ("In the '90s it grew. Then it fell.", ["In the '90s it grew.", "Then it fell."]),
+])
+def test_apostrophes_not_counted_as_quotes(text, expected):
+    assert split_sentences(text) == expected
+
+
+def test_abbreviations_and_decimals_not_split():
+    text = "Dr. Smith measured 3.14 m, e.g. in the U.S. lab. Results vary."
+    assert split_sentences(text) == ["Dr. Smith measured 3.14 m, e.g. in the U.S. lab.", "Results vary."]
+
+
+def test_duplicates_removed():
+    paragraph = "Knowledge graphs connect entities. They make relations explicit."
+    text = "\n\n".join([paragraph, "A different point.", paragraph])
+
+    result = compress_article(text)
+    assert result["duplicates"] == 2
+    assert result["sentences"] == 3
+    assert result["text"].count("Knowledge graphs connect entities.") == 1
+
+
+def test_fits_token_budget_with_original_sentences():
+    article = make_article()
+    result = compress_article(article, token_budget=500)
+
+    assert result["original_tokens"] == estimate_tokens(article)
+    assert result["tokens"] <= 500 < result["original_tokens"]
+    assert 0 < result["kept"] < result["sentences"]
+    # 只删句不改句
+    cleaned = " ".join(block["text"] for block in clean_markdown(article))
+    for paragraph in result["text"].split("\n\n"):
+        for sentence in split_sentences(paragraph):
+            assert sentence in cleaned
+
+
+def test_within_budget_unchanged():
+    text = "第一句。第二句。\n\nShort English text."
+    result = compress_article(text, token_budget=1000)
+    assert result["kept"] == result["sentences"] == 3
+    assert result["text"] == "第一句。第二句。\n\nShort English text."
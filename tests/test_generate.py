@@ -0,0 +1,99 @@
+"""
+批量生成：复用设计阶段流式返回时提前开始的图像；草稿模式只用于支持指定尺寸的提供商
+"""
+
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from benchmarks.stub_provider import install_stub
+from config import DEFAULT_IMAGE_SIZE, DRAFT_IMAGE_SIZE
+from lib.api import client
+from skills.generate import GenerateSkill
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    monkeypatch.setattr(client, "text_provider_id", client.text_provider_id)
+    monkeypatch.setattr(client, "image_provider_id", client.image_provider_id)
+    return install_stub(client)
+
+
+def design(title: str) -> dict:
+    return {"title": title, "image_prompt": f"Technical blueprint of {title}."}
+
+
+def test_prestarted_matched_by_prompt(stub, tmp_path):
+    generate = GenerateSkill(str(tmp_path), use_cache=False)
+    streamed = [design("A"), design("Broken"), design("B"), design("C")]
+    final = [design("A"), design("B"), design("C")]  # "Broken" 未通过最终校验
+
+    gate = threading.Event()
+    pool = ThreadPoolExecutor(max_workers=1)
+
+    def blocked_first():
+        gate.wait(5)
+        return generate.run_design(streamed[0], 1)
+
+    # 第一个请求阻塞，其余排队，便于观察取消
+    prestarted = {streamed[0]["image_prompt"]: pool.submit(blocked_first)}
+    for i, d in enumerate(streamed[1:], 2):
+        prompt, _, _ = generate.prepare_design(d, i)
+        prestarted[prompt] = pool.submit(generate.run_design, d, i)
+    broken = prestarted[generate.prepare_design(streamed[1], 2)[0]]
+    # run_batch 先取消未匹配的提前生成，再等待第一个
+    threading.Timer(0.2, gate.set).start()
+
+    results = generate.run_batch(final, delay=0, prestarted=prestarted)
+    pool.shutdown()
+
+    assert [r["title"] for r in results] == ["A", "B", "C"]
+    assert all(r["success"] for r in results)
+    # 按最终序号命名
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["01_A.png", "02_B.png", "03_C.png"]
+    assert broken.cancelled()
+    assert stub.calls == 3
+
+
+def test_unmatched_design_rendered_after_early_queue(stub, tmp_path):
+    generate = GenerateSkill(str(tmp_path), use_cache=False)
+    pool = ThreadPoolExecutor(max_workers=1)
+    prestarted = {design("A")["image_prompt"]: pool.submit(generate.run_design, design("A"), 1)}
+
+    results = generate.run_batch([design("A"), design("B")], delay=0, prestarted=prestarted)
+    pool.shutdown()
+
+    assert [r["title"] for r in results] == ["A", "B"]
+    assert stub.calls == 2
+
+
+# =============================================================================
+# 草稿模式
+# =============================================================================
+
+def test_draft_uses_draft_size(stub, tmp_path, capsys):
+    generate = GenerateSkill(str(tmp_path), use_cache=False, draft=True)
+    results = generate.run_batch([design("A")], delay=0)
+
+    assert results[0]["draft"] and results[0]["image_size"] == DRAFT_IMAGE_SIZE
+    assert "/finalize" in capsys.readouterr().out
+
+
+def test_draft_disabled_without_size_control(stub, tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(stub, "supports_image_size", False)
+    generate = GenerateSkill(str(tmp_path), use_cache=False, draft=True)
+    results = generate.run_batch([design("A"), design("B")], delay=0)
+
+    assert [(r["draft"], r["image_size"]) for r in results] == [(False, DEFAULT_IMAGE_SIZE)] * 2
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["01_A.png", "02_B.png"]
+    out = capsys.readouterr().out
+    assert out.count("草稿模式无效") == 1
+    assert "/finalize" not in out
+
+    assert generate.finalize([design("A")]) == []
+    assert stub.calls == 2
@@ -0,0 +1,68 @@
+"""
+图像缓存：与输出文件硬链接共享时，重新生成同名图像不影响缓存；超出配额时按最近使用淘汰
+"""
+
+import os
+import sys
+import base64
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from lib.api import save_image
+from lib.image_cache import ImageCache
+
+
+def image(label: bytes) -> str:
+    """内容各不相同的"图像"（只比较字节，不需要是有效的 PNG）"""
+    return base64.b64encode(b"\x89PNG" + label * 64).decode("ascii")
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ImageCache(tmp_path / "cache", max_bytes=10 ** 6)
+
+
+def test_rerender_does_not_overwrite_cached_image(cache, tmp_path):
+    out = tmp_path / "images" / "01_x"
+    out.parent.mkdir()
+    path = save_image(image(b"A"), "image/png", str(out))
+    cache.put("ka", path)
+
+    # 提示词改变后以同一文件名重新生成
+    save_image(image(b"B"), "image/png", str(out))
+    assert Path(path).read_bytes() == base64.b64decode(image(b"B"))
+
+    hit = cache.get("ka", str(tmp_path / "other"))
+    assert Path(hit["output_path"]).read_bytes() == base64.b64decode(image(b"A"))
+
+
+def test_overwriting_cache_hit_output(cache, tmp_path):
+    src = save_image(image(b"A"), "image/png", str(tmp_path / "src"))
+    cache.put("ka", src)
+    hit = cache.get("ka", str(tmp_path / "01_x"))
+
+    # 命中时输出文件与缓存共享 inode，之后重新生成同名图像
+    save_image(image(b"B"), "image/png", hit["output_path"])
+    again = cache.get("ka", str(tmp_path / "02_x"))
+    assert Path(again["output_path"]).read_bytes() == base64.b64decode(image(b"A"))
+
+
+def test_lru_eviction(tmp_path):
+    size = len(base64.b64decode(image(b"0")))
+    # 配额 3.5 张：存入第 4 张时超出，淘汰到 90% 以下只需删除一张
+    cache = ImageCache(tmp_path / "cache", max_bytes=int(size * 3.5))
+    for i, key in enumerate(["k1", "k2", "k3"]):
+        path = save_image(image(str(i).encode()), "image/png", str(tmp_path / key))
+        cache.put(key, path)
+        # 时间戳分开，淘汰顺序确定
+        os.utime(cache._find(key), (1000 + i, 1000 + i))
+
+    # 使用 k1 后它成为最近使用的，超出配额时先淘汰 k2
+    assert cache.get("k1", str(tmp_path / "hit"))
+    cache.put("k4", save_image(image(b"4"), "image/png", str(tmp_path / "k4")))
+
+    assert [k for k in ("k1", "k2", "k3", "k4") if cache._find(k)] == ["k1", "k3", "k4"]
+    assert cache._size == size * 3
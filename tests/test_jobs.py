@@ -0,0 +1,120 @@
+"""
+进程内任务队列的取消语义，以及后台任务结果写入 Agent 上下文；流水线提前结束时保留上一次的生成技能
+"""
+
+import sys
+import time
+import threading
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from benchmarks.run_benchmarks import make_article
+from benchmarks.stub_provider import install_stub
+from lib.api import client
+from lib.jobs import JobQueue, QUEUED, RUNNING, DONE, CANCELLED
+
+
+def wait_status(jobs: JobQueue, job_id: str, *statuses, timeout: float = 5) -> dict:
+    deadline = time.time() + timeout
+    while jobs.get(job_id)["status"] not in statuses:
+        assert time.time() < deadline, f"任务未进入 {statuses}"
+        time.sleep(0.01)
+    return jobs.get(job_id)
+
+
+def test_cancel_running_job_with_stage_hooks():
+    release = threading.Event()
+
+    def handler(job_id, params, on_stage):
+        on_stage("analyze")
+        release.wait(5)
+        on_stage("map")
+        return {"summary": "不应到达"}
+
+    jobs = JobQueue(handler, workers=1)
+    job = jobs.submit({})
+    wait_status(jobs, job["id"], RUNNING)
+    assert jobs.cancel(job["id"])
+    release.set()
+    assert wait_status(jobs, job["id"], DONE, CANCELLED)["status"] == CANCELLED
+    jobs.shutdown()
+
+
+def test_running_job_without_stage_hooks_is_not_cancellable():
+    release = threading.Event()
+
+    def handler(job_id, params, on_stage):
+        release.wait(5)
+        return {"summary": "ok"}
+
+    jobs = JobQueue(handler, workers=1)
+    running = jobs.submit({}, cancellable=False)
+    queued = jobs.submit({}, cancellable=False)
+    wait_status(jobs, running["id"], RUNNING)
+
+    assert not jobs.cancel(running["id"])
+    assert not jobs.get(running["id"])["cancel_requested"]
+    # 排队中的任务仍可取消
+    assert jobs.get(queued["id"])["status"] == QUEUED
+    assert jobs.cancel(queued["id"])
+    assert jobs.get(queued["id"])["status"] == CANCELLED
+
+    release.set()
+    assert wait_status(jobs, running["id"], DONE, CANCELLED)["status"] == DONE
+    jobs.shutdown()
+
+
+# =============================================================================
+# Agent
+# =============================================================================
+
+@pytest.fixture
+def agent(monkeypatch, tmp_path):
+    from agent import ConceptVisualizerAgent
+
+    agent = ConceptVisualizerAgent()
+    for c in {id(c): c for c in [client] + [s.client for s in agent.skills.values() if hasattr(s, "client")]}.values():
+        monkeypatch.setattr(c, "text_provider_id", c.text_provider_id)
+        monkeypatch.setattr(c, "image_provider_id", c.image_provider_id)
+        install_stub(c)
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "article.md").write_text(make_article(1500), encoding="utf-8")
+    yield agent
+    agent.shutdown_jobs()
+
+
+def test_cancel_refused_for_running_learn(agent, capsys, monkeypatch):
+    release = threading.Event()
+    # /learn 不调用阶段回调，这里只模拟一个长时间运行的命令
+    monkeypatch.setattr(agent, "handle_command", lambda command: release.wait(5))
+
+    agent.submit_background("learn", "examples")
+    job = agent.jobs.list()[0]
+    wait_status(agent.jobs, job["id"], RUNNING)
+    agent.show_jobs(f"cancel {job['id'][:6]}")
+    assert "不能取消" in capsys.readouterr().out
+    release.set()
+    assert wait_status(agent.jobs, job["id"], DONE, CANCELLED)["status"] == DONE
+
+
+def test_pipeline_merges_into_context(agent):
+    agent.context["discover"] = {"discovered_frameworks": []}
+    agent.handle_command("/pipeline article.md out --style=blueprint --no-learn")
+
+    assert "discover" in agent.context
+    assert "analyze" in agent.context and "learning" in agent.context
+
+
+def test_failed_pipeline_keeps_last_generate(agent, capsys):
+    previous = agent.last_generate
+    # 未指定样式时交互选择，文章不存在则在选择之前结束
+    agent.handle_command("/pipeline missing.md out")
+    assert agent.last_generate is previous
+
+    agent.context["design"] = {"designs": []}
+    agent.last_generate = None
+    agent.handle_command("/finalize all")
+    assert "尚未生成过图像" in capsys.readouterr().out
@@ -0,0 +1,91 @@
+"""
+原生JSON模式的回退：只有明确表示不支持JSON模式参数的 400 才回退为提示词模式；修复调用沿用原调用的模型
+"""
+
+import sys
+import json
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from config import PROVIDERS
+from lib.api import OpenAIProvider, OllamaProvider
+
+SCHEMA = {"type": "object", "required": ["a"], "properties": {"a": {"type": "integer"}}}
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, body: dict):
+        self.status_code = status_code
+        self.text = json.dumps(body)
+        self.content = self.text.encode("utf-8")
+        self._body = body
+
+    def json(self):
+        return self._body
+
+
+class FakeSession:
+    """按顺序返回预设响应，并记录请求体"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.payloads = []
+
+    def post(self, url, headers=None, data=None, timeout=None, stream=False):
+        self.payloads.append(json.loads(data))
+        return self.responses.pop(0)
+
+
+def openai_ok(text: str) -> FakeResponse:
+    return FakeResponse(200, {"choices": [{"message": {"content": text}}], "usage": {}})
+
+
+def make_openai(*responses) -> OpenAIProvider:
+    provider = OpenAIProvider(dict(PROVIDERS["openai"], api_key="test", enabled=True))
+    provider._session = FakeSession(*responses)
+    return provider
+
+
+def test_unsupported_response_format_falls_back_once():
+    unsupported = FakeResponse(400, {"error": {"message": "Invalid parameter: 'response_format' of type "
+                                                          "'json_schema' is not supported with this model."}})
+    provider = make_openai(unsupported, openai_ok('{"a": 1}'), openai_ok('{"a": 2}'))
+
+    assert provider.generate_json("p", SCHEMA) == {"a": 1}
+    # 按解析后的模型名记录，之后同一模型直接走提示词模式
+    assert provider._json_mode_rejected == {PROVIDERS["openai"]["text_model"]}
+    assert provider.generate_json("p", SCHEMA, model=PROVIDERS["openai"]["text_model"]) == {"a": 2}
+    assert ["response_format" in p for p in provider._session.payloads] == [True, False, False]
+
+
+def test_other_400_raises_and_keeps_json_mode():
+    too_long = FakeResponse(400, {"error": {"message": "This model's maximum context length is 128000 tokens.",
+                                            "code": "context_length_exceeded"}})
+    provider = make_openai(too_long, openai_ok('{"a": 3}'))
+
+    with pytest.raises(Exception, match="400"):
+        provider.generate_json("p", SCHEMA)
+    assert provider._json_mode_rejected == set()
+    assert provider.generate_json("p", SCHEMA) == {"a": 3}
+    assert all("response_format" in p for p in provider._session.payloads)
+
+
+def test_ollama_old_server_rejects_schema_format():
+    provider = OllamaProvider(dict(PROVIDERS["ollama"], enabled=True))
+    provider._session = FakeSession(
+        FakeResponse(400, {"error": "invalid format: expected \"json\" or a JSON schema"}),
+        FakeResponse(200, {"response": '{"a": 4}'})
+    )
+    assert provider.generate_json("p", SCHEMA) == {"a": 4}
+    assert "format" not in provider._session.payloads[1]
+
+
+def test_repair_call_uses_requested_model():
+    provider = make_openai(openai_ok('{"b": 1}'), openai_ok('{"a": 5}'))
+
+    assert provider.generate_json("p", SCHEMA, model="tiered-model") == {"a": 5}
+    # 修复调用沿用按阶段分配的模型，不退回提供商默认模型
+    assert [p["model"] for p in provider._session.payloads] == ["tiered-model", "tiered-model"]
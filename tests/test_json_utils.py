@@ -0,0 +1,162 @@
+"""
+lib/json_utils 的提取、修复与校验
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from lib.json_utils import (extract_json, validate, parse_json_response, JSONArrayStream,
+                            JSONExtractionError)
+
+
+# =============================================================================
+# 提取与修复
+# =============================================================================
+
+def test_plain_object():
+    assert extract_json('{"a": 1}') == {"a": 1}
+
+
+def test_fenced_block_with_prose():
+    text = '以下是分析结果：\n```json\n{"title": "概念图", "items": [1, 2]}\n```\n如有需要请告诉我。'
+    assert extract_json(text) == {"title": "概念图", "items": [1, 2]}
+
+
+def test_fenced_block_preferred_over_earlier_brackets():
+    text = '参考[图1]的结构：\n```json\n{"a": 1}\n```'
+    assert extract_json(text) == {"a": 1}
+
+
+def test_cjk_prose_before_json():
+    assert extract_json('见[图1]如下 {"a":1}') == {"a": 1}
+    assert extract_json('见[图1]如下 {"a":1}', expect="{") == {"a": 1}
+
+
+def test_cjk_word_inside_object():
+    assert extract_json('{"a": 1, 说明}') == {"a": 1}
+    assert extract_json('{"a": 1, 说明, "b": 2}') == {"a": 1}
+
+
+def test_cjk_only_raises_extraction_error():
+    with pytest.raises(JSONExtractionError):
+        extract_json("抱歉，我无法完成这个请求。")
+
+
+def test_empty_output():
+    with pytest.raises(JSONExtractionError):
+        extract_json("  \n")
+
+
+def test_python_literals_and_trailing_comma():
+    assert extract_json('{"a": True, "b": None, "c": [1, 2,],}') == {"a": True, "b": None, "c": [1, 2]}
+
+
+def test_line_comment():
+    assert extract_json('{"a": 1, // 注释\n "b": 2}') == {"a": 1, "b": 2}
+
+
+def test_unescaped_quote_and_newline_in_string():
+    assert extract_json('{"a": "他说"好"\n然后"}') == {"a": '他说"好"\n然后'}
+
+
+def test_truncated_array_closes_brackets():
+    assert extract_json('{"items": [1, 2, 3') == {"items": [1, 2, 3]}
+
+
+def test_truncated_array_drops_partial_element():
+    text = '{"designs": [{"title": "甲", "n": 1}, {"title": "乙", "n":'
+    assert extract_json(text) == {"designs": [{"title": "甲", "n": 1}, {"title": "乙", "n": None}]}
+
+
+def test_truncated_mid_string():
+    assert extract_json('{"designs": [{"title": "甲"}, {"title": "未完') == \
+        {"designs": [{"title": "甲"}, {"title": "未完"}]}
+
+
+def test_expect_skips_other_opener():
+    assert extract_json('[1, 2] {"a": 1}', expect="{") == {"a": 1}
+
+
+# =============================================================================
+# 校验
+# =============================================================================
+
+SCHEMA = {
+    "type": "object",
+    "required": ["title", "count"],
+    "properties": {
+        "title": {"type": "string"},
+        "count": {"type": "integer"},
+        "kind": {"type": "string", "enum": ["a", "b"]},
+        "items": {"type": "array", "minItems": 1, "items": {"type": "object", "required": ["name"]}}
+    }
+}
+
+
+def test_validate_ok_and_coerces():
+    data = {"title": 3, "count": "8", "items": [{"name": "x"}]}
+    assert validate(data, SCHEMA) == []
+    assert data == {"title": "3", "count": 8, "items": [{"name": "x"}]}
+
+
+def test_validate_reports_errors():
+    errors = validate({"count": "八", "kind": "c", "items": [{}]}, SCHEMA)
+    assert any("title" in e for e in errors)
+    assert any("$.count" in e for e in errors)
+    assert any("$.kind" in e for e in errors)
+    assert any("$.items[0]" in e for e in errors)
+
+
+def test_validate_min_items():
+    assert validate({"title": "t", "count": 1, "items": []}, SCHEMA)
+
+
+# =============================================================================
+# 统一入口
+# =============================================================================
+
+class FakeClient:
+    def __init__(self, reply):
+        self.reply = reply
+        self.prompts = []
+
+    def generate_text(self, prompt, model=None):
+        self.prompts.append(prompt)
+        return self.reply
+
+
+def test_parse_without_repair():
+    assert parse_json_response('好的：{"title": "t", "count": 2}', SCHEMA) == {"title": "t", "count": 2}
+
+
+def test_parse_repair_call_on_invalid():
+    client = FakeClient('{"title": "t", "count": 1}')
+    assert parse_json_response('{"title": "t"}', SCHEMA, repair_client=client) == {"title": "t", "count": 1}
+    assert len(client.prompts) == 1
+
+
+def test_parse_raises_without_client():
+    with pytest.raises(JSONExtractionError) as e:
+        parse_json_response("无法生成", SCHEMA)
+    assert e.value.raw_response == "无法生成"
+
+
+def test_parse_raises_when_repair_fails():
+    with pytest.raises(JSONExtractionError):
+        parse_json_response('{"title": "t"}', SCHEMA, repair_client=FakeClient("仍然不是JSON"))
+
+
+# =============================================================================
+# 流式
+# =============================================================================
+
+def test_array_stream_yields_complete_items():
+    stream = JSONArrayStream("designs")
+    items = []
+    for chunk in ['说明 {"designs": [{"t": "甲', '"}, {"t": "乙"}', ', {"t": "丙"}]}']:
+        items.extend(stream.feed(chunk))
+    assert items == [{"t": "甲"}, {"t": "乙"}, {"t": "丙"}]
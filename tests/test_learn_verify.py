@@ -0,0 +1,126 @@
+"""
+/learn 闭环验证：只生成比较所需的张数，失败时补生成；本地预筛只用于拒绝
+"""
+
+import sys
+import base64
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from benchmarks.run_benchmarks import make_article
+from benchmarks.stub_provider import install_stub, StubProvider, TINY_PNG_BASE64
+from config import LEARN_VERIFY_MIN_IMAGES
+from lib import image_similarity
+from lib.api import client
+from skills import LearnExampleSkill
+
+EMPTY_CANDIDATES = {"frameworks": [], "charts": [], "styles": []}
+
+
+@pytest.fixture
+def skill(monkeypatch):
+    skill = LearnExampleSkill()
+    for c in (client, skill.client):
+        monkeypatch.setattr(c, "text_provider_id", c.text_provider_id)
+        monkeypatch.setattr(c, "image_provider_id", c.image_provider_id)
+    # 每次都真正调用提供商，便于计数
+    monkeypatch.setattr(sys.modules["skills.generate"], "IMAGE_CACHE_ENABLED", False)
+    skill.stub = install_stub(client, skill.client)
+    return skill
+
+
+@pytest.fixture
+def example(tmp_path):
+    (tmp_path / "1.png").write_bytes(base64.b64decode(TINY_PNG_BASE64))
+    return tmp_path
+
+
+def count_images(monkeypatch, fail_first: int = 0) -> list:
+    """记录每次图像生成的提示词，前 fail_first 次返回失败"""
+    prompts = []
+    generate_image = StubProvider.generate_image
+
+    def counting(self, prompt, *args, **kwargs):
+        prompts.append(prompt)
+        if len(prompts) <= fail_first:
+            return {"success": False, "error": "模拟失败"}
+        return generate_image(self, prompt, *args, **kwargs)
+
+    monkeypatch.setattr(StubProvider, "generate_image", counting)
+    return prompts
+
+
+def test_renders_only_what_comparison_needs(skill, example, monkeypatch):
+    prompts = count_images(monkeypatch)
+    result = skill._verify_by_regeneration(make_article(1500), [example / "1.png"], EMPTY_CANDIDATES,
+                                           example, max_images=3)
+
+    assert "error" not in result
+    assert len(prompts) == LEARN_VERIFY_MIN_IMAGES
+    assert result["images_generated"] == LEARN_VERIFY_MIN_IMAGES
+    # 临时目录已清理
+    assert [p.name for p in example.iterdir()] == ["1.png"]
+
+
+def test_failed_render_is_replaced(skill, example, monkeypatch):
+    prompts = count_images(monkeypatch, fail_first=1)
+    result = skill._verify_by_regeneration(make_article(1500), [example / "1.png"], EMPTY_CANDIDATES,
+                                           example, max_images=3)
+
+    assert "error" not in result
+    assert len(prompts) == LEARN_VERIFY_MIN_IMAGES + 1
+    assert result["images_generated"] == LEARN_VERIFY_MIN_IMAGES + 1
+
+
+def test_all_renders_fail(skill, example, monkeypatch):
+    prompts = count_images(monkeypatch, fail_first=10)
+    result = skill._verify_by_regeneration(make_article(1500), [example / "1.png"], EMPTY_CANDIDATES,
+                                           example, max_images=3)
+
+    assert result["error"] == "未能生成任何验证图片"
+    assert len(prompts) == 3
+
+
+# =============================================================================
+# 本地预筛
+# =============================================================================
+
+def fake_similarity(monkeypatch, score: float):
+    """未安装 Pillow 时替换指纹计算，让每张图的相似度都为 score"""
+    monkeypatch.setattr(image_similarity, "available", lambda: True)
+    monkeypatch.setattr(image_similarity, "fingerprint_many", lambda paths: [{} for _ in paths])
+    monkeypatch.setattr(image_similarity, "similarity", lambda a, b: {"score": score})
+
+
+def test_high_similarity_still_scored_by_model(skill, example, monkeypatch):
+    fake_similarity(monkeypatch, 99)
+    result = skill._verify_by_regeneration(make_article(1500), [example / "1.png"], EMPTY_CANDIDATES,
+                                           example, max_images=3)
+
+    assert result["method"] == "llm"
+    assert result["prescreen"]["decision"] == "uncertain"
+    # average_score 只来自模型评分
+    assert result["average_score"] == 80
+
+
+def test_low_similarity_rejected_without_model(skill, example, monkeypatch):
+    fake_similarity(monkeypatch, 10)
+    compared = []
+    monkeypatch.setattr(skill, "_compare_images", lambda *args, **kwargs: compared.append(args))
+    result = skill._verify_by_regeneration(make_article(1500), [example / "1.png"], EMPTY_CANDIDATES,
+                                           example, max_images=3)
+
+    assert result["method"] == "prescreen" and not result["passed"]
+    assert result["prescreen_score"] == 10
+    assert "average_score" not in result
+    assert compared == []
+
+
+def test_accept_only_when_configured(monkeypatch, example):
+    fake_similarity(monkeypatch, 95)
+    images = [example / "1.png"]
+    assert image_similarity.prescreen(images, images)["decision"] == "uncertain"
+    assert image_similarity.prescreen(images, images, accept=90)["decision"] == "accept"
@@ -0,0 +1,100 @@
+"""
+交互式选择样式期间后台执行的阶段：输出暂存到选择完成，选择被中止时后台停止且不再学习；
+合并模式下 manifest.json 记录实际执行的调用的输入
+"""
+
+import sys
+import json
+import time
+import threading
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from benchmarks.run_benchmarks import make_article
+from benchmarks.stub_provider import install_stub
+from lib.api import client
+from skills import PipelineSkill
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    monkeypatch.setattr(client, "text_provider_id", client.text_provider_id)
+    monkeypatch.setattr(client, "image_provider_id", client.image_provider_id)
+    return install_stub(client, latency=0.3)
+
+
+@pytest.fixture
+def article(tmp_path):
+    path = tmp_path / "article.md"
+    path.write_text(make_article(1500), encoding="utf-8")
+    return str(path)
+
+
+def answer(monkeypatch, reply):
+    """input() 等待片刻（后台阶段正在调用模型）后返回 reply，reply 为异常时抛出"""
+    def fake_input(prompt=""):
+        time.sleep(0.1)
+        if isinstance(reply, BaseException):
+            raise reply
+        return reply
+
+    monkeypatch.setattr("builtins.input", fake_input)
+
+
+def test_background_output_deferred_until_style_selected(stub, article, tmp_path, monkeypatch, capsys):
+    answer(monkeypatch, "")
+    skill = PipelineSkill(str(tmp_path / "out"), auto_learn=False)
+    result = skill.run(article, generate_images=False)
+
+    out = capsys.readouterr().out
+    assert result["success"]
+    # 选择菜单中间没有后台阶段的输出
+    assert out.index("读取文章") > out.index("✓ 已选择")
+
+
+@pytest.mark.parametrize("fused", [False, True])
+def test_aborted_style_prompt_stops_background(stub, article, tmp_path, monkeypatch, fused):
+    answer(monkeypatch, KeyboardInterrupt())
+    skill = PipelineSkill(str(tmp_path / "out"), auto_learn=True, fused=fused)
+    learned = []
+    monkeypatch.setattr(skill.discover, "complete", lambda discovery: learned.append(discovery))
+
+    with pytest.raises(KeyboardInterrupt):
+        skill.run(article)
+
+    # 抛出前后台已经退出：只有取消时正在进行的那一次调用，没有学习
+    assert not [t for t in threading.enumerate() if t.name.startswith("speculative")]
+    calls = stub.calls
+    time.sleep(0.5)
+    assert stub.calls == calls == 1
+    assert learned == []
+
+
+def test_fused_mode_records_inputs_of_the_call_that_ran(stub, article, tmp_path, monkeypatch):
+    pipeline_module = sys.modules["skills.pipeline"]
+    out = tmp_path / "out"
+
+    def run() -> int:
+        calls = stub.calls
+        skill = PipelineSkill(str(out), auto_learn=True, style="blueprint", fused=True)
+        assert skill.run(article, generate_images=False)["success"]
+        return stub.calls - calls
+
+    def recorded(stage: str) -> dict:
+        return json.loads((out / "manifest.json").read_text(encoding="utf-8"))["stages"][stage]["inputs"]
+
+    run()
+    assert recorded("discover")["prompt"] == pipeline_module.PROMPT_VERSIONS["analyze_discover"]
+
+    # 只有 discover 需要重跑：analyze 复用，discover 单独执行
+    (out / "00_discover.json").unlink()
+    assert run() == 1
+    assert recorded("discover")["prompt"] == pipeline_module.PROMPT_VERSIONS["discover"]
+    assert run() == 0
+
+    # 单独执行的 discover 随 discover 提示词模板失效
+    monkeypatch.setitem(pipeline_module.PROMPT_VERSIONS, "discover", "changed")
+    assert run() == 1
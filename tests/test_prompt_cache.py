@@ -0,0 +1,116 @@
+"""
+Gemini 显式缓存：只有明确表示缓存失效/不可缓存的错误才作废句柄或停止创建，默认只在批处理入口开启
+"""
+
+import sys
+import json
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from config import PROVIDERS
+from lib.api import GoogleProvider
+from lib.prompt_cache import prompt_cache, PrefixedPrompt
+
+PROMPT = PrefixedPrompt("Known frameworks and output format. " * 400, "Article body.")
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, body: dict):
+        self.status_code = status_code
+        self.text = json.dumps(body)
+        self.content = self.text.encode("utf-8")
+        self._body = body
+
+    def json(self):
+        return self._body
+
+
+class FakeSession:
+    """按顺序返回预设响应，并记录请求地址与请求体"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def post(self, url, headers=None, data=None, timeout=None, stream=False):
+        self.requests.append((url.rsplit("/", 1)[-1], json.loads(data)))
+        return self.responses.pop(0)
+
+
+def created(name: str = "cachedContents/abc") -> FakeResponse:
+    return FakeResponse(200, {"name": name, "usageMetadata": {"totalTokenCount": 4000}})
+
+
+def answer(text: str = "ok") -> FakeResponse:
+    return FakeResponse(200, {"candidates": [{"content": {"parts": [{"text": text}]}}], "usageMetadata": {}})
+
+
+def error(status_code: int, message: str) -> FakeResponse:
+    return FakeResponse(status_code, {"error": {"code": status_code, "message": message}})
+
+
+@pytest.fixture
+def cache(monkeypatch, tmp_path):
+    monkeypatch.setattr(prompt_cache, "path", tmp_path / "prompt_cache.json")
+    monkeypatch.setattr(prompt_cache, "_entries", None)
+    monkeypatch.setattr(prompt_cache, "explicit", True)
+    return prompt_cache
+
+
+def make_google(*responses) -> GoogleProvider:
+    provider = GoogleProvider(dict(PROVIDERS["google"], api_key="test", enabled=True))
+    provider._session = FakeSession(*responses)
+    return provider
+
+
+def sent(provider: GoogleProvider) -> list:
+    return [(endpoint.split(":")[-1], "cachedContent" in body) for endpoint, body in provider._session.requests]
+
+
+def test_explicit_cache_off_by_default(cache, monkeypatch):
+    monkeypatch.setattr(prompt_cache, "explicit", False)
+    provider = make_google(answer())
+
+    assert provider.generate_text(PROMPT) == "ok"
+    assert sent(provider) == [("generateContent", False)]
+
+
+def test_deleted_cache_invalidated_and_retried(cache):
+    provider = make_google(created(), error(403, "CachedContent not found (or permission denied)"), answer())
+
+    assert provider.generate_text(PROMPT) == "ok"
+    assert sent(provider) == [("cachedContents", False), ("generateContent", True), ("generateContent", False)]
+    assert cache.list() == []
+
+
+def test_permission_error_not_treated_as_stale_cache(cache):
+    provider = make_google(created(), error(403, "Permission denied: Consumer 'api_key:x' has been suspended."))
+
+    with pytest.raises(Exception, match="403"):
+        provider.generate_text(PROMPT)
+    # 没有以完整提示词再发一次，句柄仍然有效
+    assert sent(provider) == [("cachedContents", False), ("generateContent", True)]
+    assert [e["handle"] for e in cache.list()] == ["cachedContents/abc"]
+
+
+def test_prefix_too_small_not_retried_until_expiry(cache):
+    provider = make_google(
+        error(400, "Cached content is too small. total_token_count=3000, min_total_token_count=4096"),
+        answer("a"), answer("b")
+    )
+
+    assert provider.generate_text(PROMPT) == "a"
+    assert provider.generate_text(PROMPT) == "b"
+    assert sent(provider) == [("cachedContents", False), ("generateContent", False), ("generateContent", False)]
+
+
+def test_other_create_error_retried_next_time(cache):
+    provider = make_google(error(400, "Request contains an invalid argument."), answer("a"), created(), answer("b"))
+
+    assert provider.generate_text(PROMPT) == "a"
+    assert provider.generate_text(PROMPT) == "b"
+    assert sent(provider) == [("cachedContents", False), ("generateContent", False),
+                              ("cachedContents", False), ("generateContent", True)]
@@ -0,0 +1,108 @@
+"""
+注册表的并发读写与写时复制视图（含从文件导入）
+"""
+
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+import yaml
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from lib.registry import registry, RegistryOverlay
+
+# lib 包导出了同名的 registry 实例，模块本身从 sys.modules 取
+registry_module = sys.modules["lib.registry"]
+
+
+@pytest.fixture
+def isolated(monkeypatch, tmp_path):
+    """测试结束后恢复全局注册表，持久化写入临时目录"""
+    for kind in ("frameworks", "chart_types", "visual_styles", "providers"):
+        monkeypatch.setattr(registry, kind, dict(getattr(registry, kind)))
+    monkeypatch.setattr(registry_module, "FRAMEWORKS_DIR", tmp_path / "frameworks")
+    monkeypatch.setattr(registry_module, "CHART_TYPES_DIR", tmp_path / "chart_types")
+    monkeypatch.setattr(registry_module, "VISUAL_STYLES_DIR", tmp_path / "visual_styles")
+    return tmp_path
+
+
+def framework(i: int) -> dict:
+    return {"id": f"learned_{i}", "name": f"Learned {i}", "description": "学习得到的框架",
+            "keywords": ["k"], "visual_elements": ["v"], "use_when": "测试"}
+
+
+def test_concurrent_learning_while_building_prompts(isolated):
+    errors = []
+    done = threading.Event()
+
+    def learn(offset: int):
+        try:
+            for i in range(offset, offset + 200):
+                registry.add_framework(f"learned_{i}", framework(i), persist=(i % 20 == 0))
+        except Exception as e:
+            errors.append(e)
+
+    def read():
+        try:
+            while not done.is_set():
+                registry.get_frameworks_for_prompt()
+                registry.fingerprint("frameworks")
+        except Exception as e:
+            errors.append(e)
+
+    readers = [threading.Thread(target=read) for _ in range(2)]
+    writers = [threading.Thread(target=learn, args=(k * 1000,)) for k in range(3)]
+    for t in readers + writers:
+        t.start()
+    for t in writers:
+        t.join()
+    done.set()
+    for t in readers:
+        t.join()
+
+    assert errors == []
+    assert sum(1 for fid in registry.frameworks if fid.startswith("learned_")) == 600
+    assert len(list((isolated / "frameworks").glob("*.yaml"))) == 30
+    assert not list((isolated / "frameworks").glob(".*.tmp"))
+
+
+def test_add_framework_persists_yaml(isolated):
+    registry.add_framework("learned_1", framework(1), persist=True)
+    data = yaml.safe_load((isolated / "frameworks" / "learned_1.yaml").read_text(encoding="utf-8"))
+    assert data["name"] == "Learned 1"
+
+
+def test_mutation_replaces_dict(isolated):
+    before = registry.frameworks
+    registry.add_framework("learned_1", framework(1))
+    assert "learned_1" not in before
+    assert "learned_1" in registry.frameworks
+
+
+def test_overlay_isolated_until_commit(isolated):
+    overlay = RegistryOverlay(registry)
+    overlay.add_framework("learned_1", framework(1))
+    assert "learned_1" in overlay.frameworks
+    assert "learned_1" not in registry.frameworks
+    overlay.fingerprint("frameworks")
+
+    overlay.commit()
+    assert "learned_1" in registry.frameworks
+    assert (isolated / "frameworks" / "learned_1.yaml").exists()
+
+
+@pytest.mark.parametrize("wrapped", [False, True])
+def test_overlay_import_frameworks_stays_in_layer(isolated, wrapped):
+    path = isolated / "import.yaml"
+    data = {"learned_1": framework(1)}
+    path.write_text(yaml.dump({"frameworks": data} if wrapped else data, allow_unicode=True), encoding="utf-8")
+
+    overlay = RegistryOverlay(registry)
+    overlay.import_frameworks(str(path))
+    assert "learned_1" in overlay.frameworks
+    assert "learned_1" not in registry.frameworks
+
+    overlay.reload()
+    assert "learned_1" not in overlay.frameworks